@@ -0,0 +1,88 @@
+# auth_cache.py
+"""Bounded TTL cache of resolved users for the JWT auth path.
+
+Tokens carry sub, uid, role and ver (the user's token_version). A resolved
+user is cached under (sub, ver), so authenticated requests need no database
+read until the entry expires. Bumping users.token_version (role change,
+forced logout) makes every older token miss and then fail the version
+check. `invalidate(sub)` drops this process's entries at once; other workers
+see the change within AUTH_CACHE_TTL_SECONDS.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import metrics
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class AuthUser:
+    """The user fields endpoints read, detached from any DB session."""
+    id: int
+    username: str
+    role: str
+    full_name: Optional[str] = None
+    token_version: int = 0
+
+
+class TTLCache:
+    def __init__(self, maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS, name="auth_cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = metrics.Counter()
+        self.misses = metrics.Counter()
+        self.invalidations = metrics.Counter()
+        metrics.register(name, self.stats)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] < now:
+                del self._items[key]
+                entry = None
+            if entry is not None:
+                self._items.move_to_end(key)
+        (self.hits if entry is not None else self.misses).inc()
+        return None if entry is None else entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, subject):
+        """Drop every cached entry for `subject` (keys are (subject, version))."""
+        with self._lock:
+            for key in [k for k in self._items if k[0] == subject]:
+                del self._items[key]
+        self.invalidations.inc()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        lookups = self.hits.value + self.misses.value
+        return {
+            "entries": len(self._items),
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_ratio": round(self.hits.value / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations.value,
+        }
+
+
+auth_cache = TTLCache()
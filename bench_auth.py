@@ -0,0 +1,66 @@
+# bench_auth.py
+# Authenticated requests/sec on /me with the user cache off (a users select
+# per request, as before) and on. Uses a throwaway SQLite database.
+#   python bench_auth.py
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/auth_bench.db"
+
+import httpx
+
+import main
+from main import UserModel, app, auth_cache, create_user_token, engine, async_session
+
+REQUESTS = 3000
+CONCURRENCY = 50
+
+
+async def hammer(client, headers):
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with sem:
+            r = await client.get("/me", headers=headers)
+            assert r.status_code == 200, r.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main_():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(main.Base.metadata.create_all, tables=[UserModel.__table__])
+    async with async_session() as db:
+        user = UserModel(username="bench", full_name="Bench User", hashed_password="x", role="driver")
+        db.add(user)
+        await db.commit()
+        token = create_user_token(user)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        size = auth_cache.maxsize
+        auth_cache.maxsize = 0
+        uncached = await hammer(client, headers)
+        auth_cache.maxsize = size
+        cached = await hammer(client, headers)
+
+        # Revocation: a role change bumps token_version, so the old token fails
+        async with async_session() as db:
+            user = await db.get(UserModel, user.id)
+            await main.revoke_user_tokens(db, user)
+            await db.commit()
+            auth_cache.invalidate(user.username)
+        assert (await client.get("/me", headers=headers)).status_code == 401
+
+    print(f"🐢 DB lookup per request: {uncached:8.1f} req/s")
+    print(f"🚀 cached users:          {cached:8.1f} req/s")
+    print(auth_cache.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main_())
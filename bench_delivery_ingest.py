@@ -0,0 +1,125 @@
+# bench_delivery_ingest.py
+# Rows/sec for delivery_ingest (COPY on PostgreSQL, executemany elsewhere)
+# vs the row-by-row add/commit/refresh path used by log_delivery.
+# Runs against DATABASE_URL; use PostgreSQL to measure the COPY path. Bench
+# rows are tagged with a unique pickup_location and deleted afterwards, so
+# existing delivery_logs rows are left alone.
+#   DATABASE_URL=postgresql+asyncpg://... python bench_delivery_ingest.py
+import asyncio
+import csv
+import io
+import json
+import random
+import time
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from database import engine, async_session
+from main import DeliveryLog, create_tables
+from delivery_ingest import ingest
+
+ROWS = 20000
+ROW_BY_ROW = 1000  # the slow path gets a smaller sample
+TAG = f"bench-{uuid.uuid4().hex[:8]}"
+CITIES = ["Hyderabad", "Warangal", "Chennai", "Pondicherry", "Bengaluru", "Mysuru", "Vijayawada"]
+
+
+def make_rows(n):
+    rows = []
+    for _ in range(n):
+        distance = round(random.uniform(10, 500), 2)
+        duration = round(distance * random.uniform(1.0, 1.5), 2)
+        rows.append({
+            "pickup_location": TAG,
+            "destination_location": random.choice(CITIES),
+            "stops": random.sample(CITIES, random.randint(0, 3)),
+            "distance_km": distance,
+            "duration_min": duration,
+            "actual_eta_min": round(duration * random.uniform(0.9, 1.1), 2),
+            "weather": random.choice(["Clear", "Rainy", "Cloudy", "Foggy"]),
+            "time_of_day": random.choice(["Morning", "Afternoon", "Evening", "Night"]),
+            "traffic_level": random.choice(["Light", "Moderate", "Heavy"]),
+        })
+    return rows
+
+
+def to_ndjson(rows):
+    return "".join(json.dumps(r) + "\n" for r in rows).encode()
+
+
+def to_csv(rows):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=list(rows[0]))
+    writer.writeheader()
+    for r in rows:
+        writer.writerow({**r, "stops": "|".join(r["stops"])})
+    return buf.getvalue().encode()
+
+
+async def body(data, size=64 * 1024):
+    # Same shape as Request.stream(): a series of byte chunks
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def count_rows():
+    async with async_session() as db:
+        return (await db.execute(
+            select(func.count()).select_from(DeliveryLog).where(DeliveryLog.pickup_location == TAG)
+        )).scalar()
+
+
+async def cleanup():
+    async with async_session() as db:
+        await db.execute(delete(DeliveryLog).where(DeliveryLog.pickup_location == TAG))
+        await db.commit()
+
+
+async def main():
+    engine.echo = False
+    await create_tables()
+    try:
+        await bench()
+    finally:
+        await cleanup()
+
+
+async def bench():
+    rows = make_rows(ROWS)
+
+    # --- Baseline: one add/commit/refresh per delivery ---
+    start = time.perf_counter()
+    async with async_session() as db:
+        for r in rows[:ROW_BY_ROW]:
+            log = DeliveryLog(**r)
+            db.add(log)
+            await db.commit()
+            await db.refresh(log)
+    baseline = ROW_BY_ROW / (time.perf_counter() - start)
+
+    results = {}
+    for fmt, data in (("ndjson", to_ndjson(rows)), ("csv", to_csv(rows))):
+        async with async_session() as db:
+            report = await ingest(db, DeliveryLog.__table__, body(data), fmt)
+        assert report["inserted"] == ROWS, report
+        results[fmt] = report
+
+    # A chunk with bad rows still writes the good ones
+    bad = to_ndjson(rows[:10]) + b'{"pickup_location": "X"}\nnot json\n'
+    async with async_session() as db:
+        report = await ingest(db, DeliveryLog.__table__, body(bad), "ndjson")
+    assert report["inserted"] == 10 and report["rejected"] == 2, report
+    print("⚠️ sample errors:", report["chunks"][0]["errors"])
+
+    total = await count_rows()
+    assert total == ROW_BY_ROW + 2 * ROWS + 10, total
+
+    print(f"🐢 row-by-row:   {baseline:9.1f} rows/s ({ROW_BY_ROW} rows)")
+    for fmt, report in results.items():
+        print(f"🚀 bulk {fmt:<7} {report['rows_per_sec']:9.1f} rows/s ({ROWS} rows, "
+              f"{len(report['chunks'])} chunks, {engine.dialect.driver})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+# bench_delivery_recorder.py
+# Per-call latency of log_delivery through the write-behind recorder vs an
+# add/commit/refresh per event, with concurrent producers.
+# Runs against DATABASE_URL (PostgreSQL or SQLite). Bench rows are tagged
+# with a unique pickup_location and deleted afterwards.
+#   DATABASE_URL=postgresql+asyncpg://... python bench_delivery_recorder.py
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete, func, select
+
+from database import engine, async_session
+from main import DeliveryLog, create_tables
+from delivery_recorder import DeliveryRecorder
+
+PRODUCERS = 20
+EVENTS_PER_PRODUCER = 500
+EVENT = dict(
+    pickup_location=f"bench-{uuid.uuid4().hex[:8]}", destination_location="Warangal", stops=["Jangaon"],
+    distance_km=140.0, duration_min=160.0, actual_eta_min=150.0,
+    weather="Clear", time_of_day="Afternoon", traffic_level="Moderate",
+)
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(producer):
+    latencies = []
+
+    async def one():
+        for _ in range(EVENTS_PER_PRODUCER):
+            t = time.perf_counter()
+            await producer()
+            latencies.append((time.perf_counter() - t) * 1e6)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(PRODUCERS)))
+    return latencies, time.perf_counter() - start
+
+
+async def main():
+    engine.echo = False
+    await create_tables()
+    try:
+        await bench()
+    finally:
+        async with async_session() as db:
+            await db.execute(delete(DeliveryLog).where(DeliveryLog.pickup_location == EVENT["pickup_location"]))
+            await db.commit()
+
+
+async def bench():
+    async def direct():
+        async with async_session() as db:
+            log = DeliveryLog(**EVENT)
+            db.add(log)
+            await db.commit()
+            await db.refresh(log)
+
+    recorder = DeliveryRecorder(DeliveryLog.__table__)
+
+    async def buffered():
+        await recorder.record(**EVENT)
+
+    total = PRODUCERS * EVENTS_PER_PRODUCER
+    direct_lat, direct_time = await run(direct)
+    buffered_lat, buffered_time = await run(buffered)
+    start = time.perf_counter()
+    await recorder.stop()
+    drain = time.perf_counter() - start
+
+    async with async_session() as db:
+        stored = (await db.execute(
+            select(func.count()).select_from(DeliveryLog)
+            .where(DeliveryLog.pickup_location == EVENT["pickup_location"])
+        )).scalar()
+    assert stored == 2 * total, stored
+
+    print(f"🐢 commit per event: {total / direct_time:9.1f} events/s  "
+          f"p50 {pct(direct_lat, 0.5):8.1f} µs  p99 {pct(direct_lat, 0.99):8.1f} µs")
+    print(f"🚀 write-behind:     {total / (buffered_time + drain):9.1f} events/s  "
+          f"p50 {pct(buffered_lat, 0.5):8.1f} µs  p99 {pct(buffered_lat, 0.99):8.1f} µs  "
+          f"(final flush {drain * 1000:.1f} ms)")
+    print(f"📊 flushes: {recorder.flush_size_hist.snapshot()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+# bench_email_outbox.py
+# Sends queued mail through email_outbox to a local aiosmtpd stand-in server
+# (pip install aiosmtpd) and compares it with one aiosmtplib.send per message.
+#   python bench_email_outbox.py
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/outbox_bench.db",
+    "SMTP_HOST": "127.0.0.1",
+    "SMTP_PORT": "8025",
+    "SMTP_STARTTLS": "false",
+    "SMTP_USERNAME": "",
+    "SMTP_PASSWORD": "",
+    "EMAIL_POLL_SECONDS": "0.2",
+})
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+from email.message import EmailMessage
+
+from database import engine, Base
+from email_outbox import EmailOutbox, OutboxWorkerPool
+
+MESSAGES = 200
+ATTACHMENT = b"%PDF-1.4 bench" * 1000
+
+
+class CountingHandler:
+    def __init__(self):
+        self.messages = 0
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+async def wait_for(handler, target):
+    while handler.messages < target:
+        await asyncio.sleep(0.01)
+
+
+async def main():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[EmailOutbox.__table__])
+
+    handler = CountingHandler()
+    server = Controller(handler, hostname="127.0.0.1", port=8025)
+    server.start()
+    try:
+        # --- Baseline: fresh connection per message ---
+        start = time.perf_counter()
+        for i in range(MESSAGES):
+            msg = EmailMessage()
+            msg["From"], msg["To"], msg["Subject"] = "bench@localhost", f"user{i}@example.com", "Route"
+            msg.set_content("Route report")
+            msg.add_attachment(ATTACHMENT, maintype="application", subtype="pdf", filename="r.pdf")
+            await aiosmtplib.send(msg, hostname="127.0.0.1", port=8025, start_tls=False)
+        baseline = time.perf_counter() - start
+        baseline_sessions = len(handler.sessions)
+
+        # --- Outbox ---
+        handler.messages, handler.sessions = 0, set()
+        pool = OutboxWorkerPool(workers=2, batch_size=50)
+        await pool.start()
+        start = time.perf_counter()
+        enqueue_times = []
+        for i in range(MESSAGES):
+            t = time.perf_counter()
+            await pool.enqueue(f"user{i}@example.com", "Route", "Route report",
+                               attachment_name="r.pdf", attachment=ATTACHMENT)
+            enqueue_times.append((time.perf_counter() - t) * 1000)
+        await asyncio.wait_for(wait_for(handler, MESSAGES), 60)
+        outbox_time = time.perf_counter() - start
+        await pool.stop()
+    finally:
+        server.stop()
+
+    enqueue_times.sort()
+    print(f"📨 per-message connect: {MESSAGES / baseline:7.1f} msg/s over {baseline_sessions} SMTP sessions")
+    print(f"📬 outbox workers:      {MESSAGES / outbox_time:7.1f} msg/s over {len(handler.sessions)} SMTP sessions")
+    print(f"⏱ enqueue p50 {enqueue_times[len(enqueue_times) // 2]:.2f} ms  p99 {enqueue_times[int(len(enqueue_times) * 0.99)]:.2f} ms")
+    print(pool.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+# bench_eta_compiled.py
+# Parity check and load/throughput benchmark: sklearn pipeline vs compiled arrays.
+# Run after model_train.py:  python bench_eta_compiled.py
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from eta_compiled import CompiledETAModel, export_compiled
+
+FEATURES = ["distance_km", "num_stops", "weather", "time_of_day", "traffic_level"]
+PKL_PATH = "eta_model.pkl"
+COMPILED_PATH = "eta_model_compiled"
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - start) / repeat
+
+
+pipeline, pkl_load = timed(lambda: joblib.load(PKL_PATH))
+export_compiled(pipeline, COMPILED_PATH)
+compiled, compiled_load = timed(lambda: CompiledETAModel(COMPILED_PATH))
+print(f"⏱ Load: joblib {pkl_load * 1000:.1f} ms | compiled (mmap) {compiled_load * 1000:.1f} ms")
+
+df = pd.read_csv("delivery_data.csv")[FEATURES]
+# Add a row with unseen categories to exercise handle_unknown="ignore"
+df.loc[len(df)] = [42.0, 1, "Snow", "Dawn", "Gridlock"]
+
+# --- Parity ---
+expected = pipeline.predict(df)
+actual = compiled.predict_columns({c: df[c].tolist() for c in FEATURES})
+max_diff = float(np.max(np.abs(expected - actual)))
+assert max_diff < 1e-6, f"Compiled model diverges from sklearn (max diff {max_diff})"
+print(f"✅ Parity OK on {len(df)} rows (max abs diff {max_diff:.2e})")
+
+# --- Throughput ---
+for batch in (1, 100, 2000):
+    sample = df.sample(batch, replace=True, random_state=0)
+    cols = {c: sample[c].tolist() for c in FEATURES}
+    repeat = 50 if batch == 1 else 5
+    _, t_sk = timed(lambda: pipeline.predict(sample), repeat)
+    _, t_c = timed(lambda: compiled.predict_columns(cols), repeat)
+    print(f"📦 batch={batch:5d}  sklearn {batch / t_sk:10.0f} rows/s  compiled {batch / t_c:10.0f} rows/s")
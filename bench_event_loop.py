@@ -0,0 +1,65 @@
+# bench_event_loop.py
+# Load test: while a stubbed Mapbox upstream takes UPSTREAM_DELAY seconds per call,
+# a heartbeat request to /metrics must keep answering quickly. Before the move to
+# http_client every slow call froze the loop for its full duration.
+#   python bench_event_loop.py
+import asyncio
+import statistics
+import time
+
+import httpx
+
+import main
+from http_client import get_client
+
+UPSTREAM_DELAY = 1.0
+SLOW_CALLS = 50
+MAX_HEARTBEAT_MS = 200
+
+
+async def slow_upstream(request):
+    await asyncio.sleep(UPSTREAM_DELAY)
+    return httpx.Response(200, json={"routes": [], "stub": True})
+
+
+async def heartbeat(client, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/metrics")
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def run():
+    mapbox = get_client("mapbox")
+    mapbox.transport = httpx.MockTransport(slow_upstream)
+    mapbox.max_concurrency = SLOW_CALLS
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        stop, samples = asyncio.Event(), []
+        beat = asyncio.create_task(heartbeat(client, stop, samples))
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(
+            client.get("/api/traffic-route", params={"source": "78.4,17.3", "destination": "79.5,18.0"})
+            for _ in range(SLOW_CALLS)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+    await mapbox.aclose()
+
+    ok = sum(r.status_code == 200 for r in responses)
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"🐢 {ok}/{SLOW_CALLS} slow upstream calls finished in {elapsed:.2f}s")
+    print(f"💓 heartbeat n={len(samples)} p50={statistics.median(samples):.1f}ms "
+          f"p99={p99:.1f}ms max={samples[-1]:.1f}ms")
+    assert ok == SLOW_CALLS, "slow calls failed"
+    assert elapsed < UPSTREAM_DELAY * 3, "upstream calls were serialized"
+    assert samples[-1] < MAX_HEARTBEAT_MS, "event loop was blocked"
+    print("✅ Event loop stayed responsive")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,93 @@
+# bench_login_storm.py
+# p50/p99 latency of /history while a burst of drivers log in, with bcrypt
+# inline on the event loop (PASSWORD_WORKERS=0, the old behaviour) and on the
+# bounded password pool. Uses a throwaway SQLite database.
+#   python bench_login_storm.py
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/login_bench.db"
+
+import httpx
+from passlib.context import CryptContext
+
+import main
+from main import RouteHistory, UserModel, app, create_user_token, engine, async_session, password_hasher
+from password_pool import BCRYPT_ROUNDS, pwd_context
+
+LOGINS = 24
+LOGIN_CONCURRENCY = 12
+POLL_INTERVAL = 0.01
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def storm(client, reader_headers, workers):
+    password_hasher.workers = workers
+    latencies, statuses = [], []
+    done = asyncio.Event()
+
+    async def poll():
+        while not done.is_set():
+            start = time.perf_counter()
+            r = await client.get("/history", headers=reader_headers)
+            assert r.status_code == 200, r.text
+            latencies.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    sem = asyncio.Semaphore(LOGIN_CONCURRENCY)
+
+    async def login(i):
+        async with sem:
+            r = await client.post("/token", data={"username": f"driver{i}", "password": "secret"})
+            statuses.append(r.status_code)
+
+    poller = asyncio.create_task(poll())
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await poller
+    return latencies, statuses, elapsed
+
+
+async def run():
+    engine.echo = False
+    async with engine.begin() as conn:
+        await conn.run_sync(main.Base.metadata.create_all,
+                            tables=[UserModel.__table__, RouteHistory.__table__])
+
+    # Drivers' hashes use a lower cost than configured, so the first login rehashes them
+    old_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=max(4, BCRYPT_ROUNDS - 2))
+    old_hash = old_context.hash("secret")
+    async with async_session() as db:
+        reader = UserModel(username="reader", hashed_password=old_hash, role="customer")
+        db.add(reader)
+        db.add_all(UserModel(username=f"driver{i}", hashed_password=old_hash, role="driver") for i in range(LOGINS))
+        await db.commit()
+        reader_headers = {"Authorization": f"Bearer {create_user_token(reader)}"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        results = {}
+        for label, workers in (("inline", 0), ("pool", main.password_hasher.workers or 4)):
+            results[label] = await storm(client, reader_headers, workers)
+
+    async with async_session() as db:
+        driver = (await db.execute(main.select(UserModel).where(UserModel.username == "driver0"))).scalar_one()
+    assert not pwd_context.needs_update(driver.hashed_password), "login should have rehashed"
+
+    print(f"🔐 {LOGINS} logins, bcrypt rounds={BCRYPT_ROUNDS}, /history polled every {POLL_INTERVAL * 1000:.0f} ms")
+    for label, (latencies, statuses, elapsed) in results.items():
+        print(f"{label:>7}: /history p50 {pct(latencies, 0.5):7.1f} ms  p99 {pct(latencies, 0.99):7.1f} ms  "
+              f"({len(latencies)} polls)  logins {LOGINS / elapsed:5.1f}/s  statuses {sorted(set(statuses))}")
+    print(password_hasher.stats())
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
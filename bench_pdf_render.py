@@ -0,0 +1,59 @@
+# bench_pdf_render.py
+# Reports/sec for pdf_renderer under concurrency: cold (every report new) vs
+# warm (same reports re-sent, served from cache). Set PDF_WORKERS to compare.
+#   python bench_pdf_render.py
+import asyncio
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from pdf_renderer import PDFRenderer
+
+REPORTS = 40
+CONCURRENCY = 8
+
+
+def make_png(seed, size=(1200, 800)):
+    img = Image.new("RGBA", size, (seed * 37 % 255, 120, 200, 160))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+async def run_batch(renderer, jobs):
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(job):
+        async with sem:
+            return await renderer.render(*job)
+
+    start = time.perf_counter()
+    pdfs = await asyncio.gather(*(one(job) for job in jobs))
+    return pdfs, time.perf_counter() - start
+
+
+async def main():
+    renderer = PDFRenderer(workers=int(os.getenv("PDF_WORKERS", "2")))
+    images = [make_png(i) for i in range(REPORTS)]
+    jobs = [
+        (
+            {"id": i, "name": f"Route {i}", "distance_km": 12.5 + i, "duration_min": 30.0 + i},
+            [f"Stop {k}" for k in range(6)],
+            images[i],
+            images[(i + 1) % REPORTS],
+        )
+        for i in range(REPORTS)
+    ]
+    pdfs, cold = await run_batch(renderer, jobs)
+    _, warm = await run_batch(renderer, jobs)
+    renderer.shutdown()
+    print(f"📄 workers={renderer.workers} concurrency={CONCURRENCY} avg size {sum(map(len, pdfs)) / len(pdfs) / 1024:.0f} KB")
+    print(f"🧊 cold: {REPORTS / cold:7.1f} reports/s")
+    print(f"🔥 warm: {REPORTS / warm:7.1f} reports/s")
+    print(renderer.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
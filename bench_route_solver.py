@@ -0,0 +1,28 @@
+# bench_route_solver.py
+# Solve time and tour quality of route_solver on random instances around Hyderabad.
+#   python bench_route_solver.py
+import statistics
+import time
+
+import numpy as np
+
+from route_solver import haversine_matrix, nearest_neighbour, solve_route, tour_cost
+
+SIZES = (10, 25, 50, 100)
+INSTANCES = 20
+TIME_BUDGET_MS = 50
+
+rng = np.random.default_rng(42)
+for n in SIZES:
+    times, gains = [], []
+    for _ in range(INSTANCES):
+        coords = np.column_stack([rng.uniform(78.2, 78.7, n), rng.uniform(17.2, 17.6, n)])
+        start = time.perf_counter()
+        dist = haversine_matrix(coords)
+        seed_cost = tour_cost(dist, nearest_neighbour(dist, 0, n - 1))
+        _, cost = solve_route(dist, time_budget_ms=TIME_BUDGET_MS)
+        times.append((time.perf_counter() - start) * 1000)
+        gains.append(100 * (seed_cost - cost) / seed_cost)
+    times.sort()
+    print(f"🚚 n={n:3d}  median {statistics.median(times):6.1f} ms  max {times[-1]:6.1f} ms  "
+          f"improvement over NN seed {statistics.mean(gains):5.1f}%")
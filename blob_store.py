@@ -0,0 +1,79 @@
+# blob_store.py
+"""Content-addressed storage for route images.
+
+Blobs are stored once per SHA-256 of their bytes, so the same map uploaded
+twice takes no extra space, and the hash doubles as a strong ETag. Only the
+local filesystem backend exists today; other backends implement the same
+put/get/open/exists methods and are selected with BLOB_STORE.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import tempfile
+
+BLOB_STORE = os.getenv("BLOB_STORE", "local")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blobs")
+
+
+def decode_data_url(data_url: str) -> bytes:
+    """Decode a "data:image/png;base64,..." URL (or bare base64) to bytes."""
+    payload = data_url.split(",", 1)[1] if data_url.startswith("data:") else data_url
+    try:
+        # validate=True rejects non-alphabet characters instead of skipping them
+        data = base64.b64decode("".join(payload.split()), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {e}")
+    if not data:
+        raise ValueError("Invalid base64 image: empty")
+    return data
+
+
+def sniff_content_type(head: bytes) -> str:
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class LocalBlobStore:
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise KeyError(key)
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def open(self, key: str):
+        return open(self.path(key), "rb")
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+
+_BACKENDS = {"local": LocalBlobStore}
+blob_store = _BACKENDS[BLOB_STORE]()
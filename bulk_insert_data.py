@@ -2,6 +2,7 @@
 import random
 from faker import Faker
 import psycopg2
+from psycopg2.extras import execute_values
 import json
 
 fake = Faker()
@@ -30,18 +31,16 @@ def generate_record():
     weather = random.choice(weather_options)
     time_of_day = random.choice(time_of_day_options)
     traffic = random.choice(traffic_levels)
-    return (pickup, destination, stops, distance, duration, eta, weather, time_of_day, traffic)
+    return (pickup, destination, json.dumps(stops), len(stops), distance, duration, eta, weather, time_of_day, traffic)
 
-# Generate and insert 10,000 records
-for _ in range(10000):
-    record = generate_record()
-    cur.execute("""
-        INSERT INTO delivery_logs (
-            pickup_location, destination_location, stops,
-            distance_km, duration_min, actual_eta_min,
-            weather, time_of_day, traffic_level
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, record)
+# Generate and insert 10,000 records, 1,000 rows per INSERT statement
+execute_values(cur, """
+    INSERT INTO delivery_logs (
+        pickup_location, destination_location, stops, num_stops,
+        distance_km, duration_min, actual_eta_min,
+        weather, time_of_day, traffic_level
+    ) VALUES %s
+""", (generate_record() for _ in range(10000)), page_size=1000)
 
 conn.commit()
 cur.close()
@@ -1,7 +1,7 @@
 from fastapi import APIRouter
 from pydantic import BaseModel
-import requests
 import os
+from http_client import get_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -27,11 +27,11 @@ async def chat_with_huggingface(request: ChatRequest):
     }
 
     try:
-        response = requests.post(
-    "https://api-inference.huggingface.co/models/sshleifer/tiny-gpt2",
-    headers=headers,
-    json=payload
-)
+        response = await get_client("huggingface").post(
+            "https://api-inference.huggingface.co/models/sshleifer/tiny-gpt2",
+            headers=headers,
+            json=payload
+        )
         response.raise_for_status()
         result = response.json()
 
@@ -3,6 +3,7 @@ from fastapi import APIRouter
 from pydantic import BaseModel
 import google.generativeai as genai
 import os
+from http_client import get_client
 
 router = APIRouter()
 
@@ -17,7 +18,7 @@ async def chat_with_gemini(request: ChatRequest):
     try:
         model = genai.GenerativeModel("gemini-1.5-flash")  # ✅ use a correct model
         chat = model.start_chat()
-        response = chat.send_message(request.message)
+        response = await get_client("gemini").guard(chat.send_message_async, request.message)
         return {"reply": response.text}
     except Exception as e:
         return {"reply": f"❌ Error: {str(e)}"}
@@ -0,0 +1,77 @@
+# check_delivery_logs.py
+# Checks that delivery_logs stores stops and num_stops consistently on
+# every write path: log_delivery (recorder), /delivery_logs/bulk (COPY on
+# PostgreSQL, executemany elsewhere) and plain ORM inserts. Run it once per
+# backend; it only touches rows it creates.
+#   DATABASE_URL=sqlite+aiosqlite:///./check.db python check_delivery_logs.py
+#   DATABASE_URL=postgresql+asyncpg://... python check_delivery_logs.py
+import asyncio
+import json
+import sys
+import uuid
+
+from sqlalchemy import delete, func, select
+
+import delivery_ingest
+from main import DeliveryLog, async_session, create_tables, delivery_recorder, engine, log_delivery
+
+CASES = [[], ["Jangaon"], ["Jangaon", "Bhongir", "Aler"]]
+
+
+async def chunks(data):
+    yield data
+
+
+async def run():
+    await create_tables()
+    tag = f"check-{uuid.uuid4().hex[:8]}"
+
+    for stops in CASES:
+        await log_delivery(tag, "recorder", stops, 10.0, 20.0, 21.0)
+    await delivery_recorder.flush()
+
+    ndjson = "\n".join(json.dumps({"pickup_location": tag, "destination_location": "bulk", "stops": stops,
+                                   "distance_km": 10, "duration_min": 20, "actual_eta_min": 21})
+                       for stops in CASES)
+    async with async_session() as db:
+        report = await delivery_ingest.ingest(db, DeliveryLog.__table__, chunks(ndjson.encode()))
+        assert report["inserted"] == len(CASES), report
+
+        db.add_all(DeliveryLog(pickup_location=tag, destination_location="orm", stops=stops,
+                               distance_km=10, duration_min=20, actual_eta_min=21) for stops in CASES)
+        db.add(DeliveryLog(pickup_location=tag, destination_location="orm", stops=None,
+                           distance_km=10, duration_min=20, actual_eta_min=21))
+        await db.commit()
+
+        rows = (await db.execute(
+            select(DeliveryLog.destination_location, DeliveryLog.stops, DeliveryLog.num_stops)
+            .where(DeliveryLog.pickup_location == tag)
+        )).all()
+        per_path = dict((await db.execute(
+            select(DeliveryLog.destination_location, func.sum(DeliveryLog.num_stops))
+            .where(DeliveryLog.pickup_location == tag, DeliveryLog.num_stops > 0)
+            .group_by(DeliveryLog.destination_location)
+        )).all())
+
+        await db.execute(delete(DeliveryLog).where(DeliveryLog.pickup_location == tag))
+        await db.commit()
+
+    failures = [(path, stops, n) for path, stops, n in rows if n != len(stops or [])]
+    expected = sum(map(len, CASES))
+    if len(rows) != 3 * len(CASES) + 1 or failures or set(per_path.values()) != {expected}:
+        print(f"❌ {engine.dialect.name}: rows={len(rows)} mismatched={failures} sums={per_path}")
+        return 1
+    print(f"✅ {engine.dialect.name}: stops/num_stops consistent on {sorted(per_path)} writes")
+    return 0
+
+
+async def main():
+    try:
+        return await run()
+    finally:
+        await delivery_recorder.stop()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
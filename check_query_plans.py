@@ -0,0 +1,74 @@
+# check_query_plans.py
+# Regression check for the hot-path indexes (migrations 004 and 006).
+# EXPLAINs the queries behind /history, stop lookups and the delivery_logs
+# exports and fails if they stop using their index or need a sort. Runs on PostgreSQL and SQLite.
+#   python check_query_plans.py
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import desc, func, select, text
+
+from main import DeliveryLog, RouteHistory, RouteStop, create_tables, engine
+from eta_train import export_query
+
+CHECKS = [
+    ("/history page", "ix_route_history_user_id_id",
+     select(RouteHistory.id, RouteHistory.distance_km, RouteHistory.duration_min, RouteHistory.route)
+     .where(RouteHistory.user_id == 1, RouteHistory.id < 1000).order_by(desc(RouteHistory.id)).limit(101)),
+    ("/history etag", "ix_route_history_user_id_id",
+     select(func.max(RouteHistory.id), func.count(RouteHistory.id)).where(RouteHistory.user_id == 1)),
+    ("routes through a stop", "ix_route_stops_address",
+     select(RouteStop.route_id).where(RouteStop.address == "Warangal")),
+    ("delivery_logs since", "ix_delivery_logs_created_at",
+     export_query(datetime(2024, 1, 1))),
+]
+
+
+def _pg_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _pg_nodes(child)
+
+
+def explain(conn, query):
+    """(index names used, whether a sort was needed, plan text)"""
+    sql = str(query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "postgresql":
+        # Small or unanalyzed tables would otherwise be seq- or bitmap-scanned
+        # and sorted whatever the indexes; with these off, a Sort or Seq Scan
+        # left in the plan means no index can serve the query.
+        for setting in ("enable_seqscan", "enable_bitmapscan", "enable_sort"):
+            conn.execute(text(f"SET LOCAL {setting} = off"))
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes = list(_pg_nodes(plan[0]["Plan"]))
+        used = {n["Index Name"] for n in nodes if "Index Name" in n}
+        needs_sort = any(n["Node Type"] in ("Sort", "Incremental Sort") for n in nodes)
+        return used, needs_sort, json.dumps(plan, indent=2)
+    rows = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    used = {word for row in rows for word in row.split() if word.startswith("ix_")}
+    needs_sort = any("TEMP B-TREE" in row for row in rows)
+    return used, needs_sort, "\n".join(rows)
+
+
+async def run():
+    await create_tables()
+    failures = 0
+    async with engine.connect() as conn:
+        for label, index, query in CHECKS:
+            async with conn.begin():
+                used, needs_sort, plan = await conn.run_sync(explain, query)
+            if index in used and not needs_sort:
+                print(f"✅ {label}: {index}")
+            else:
+                failures += 1
+                print(f"❌ {label}: expected {index} without a sort, got {sorted(used) or 'no index'}"
+                      f"{' + sort' if needs_sort else ''}\n{plan}")
+    await engine.dispose()
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(run()) else 0)
@@ -0,0 +1,31 @@
+# database.py
+import os
+from dotenv import load_dotenv
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+
+# Statement logging is synchronous and very chatty; opt in with DB_ECHO=true
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+def engine_options(url=DATABASE_URL):
+    options = {"echo": DB_ECHO, "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"}
+    if ":memory:" not in url:
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        )
+    return options
+
+Base = declarative_base()
+engine = create_async_engine(DATABASE_URL, **engine_options())
+async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+async def get_db():
+    async with async_session() as session:
+        yield session
@@ -0,0 +1,206 @@
+# delivery_ingest.py
+"""Bulk delivery-log ingestion from streamed CSV or NDJSON.
+
+The body is read incrementally and cut into chunks of INGEST_CHUNK_ROWS
+lines; each chunk is validated and written before the next one is read, so
+memory stays flat whatever the upload size. PostgreSQL chunks go through
+COPY (asyncpg `copy_records_to_table`), other backends through one
+executemany INSERT. Every chunk commits on its own and reports its own
+errors by line number, so one bad row never rejects its neighbours.
+
+CSV needs a header row. `stops` may be a JSON list or "A|B|C"; empty
+optional fields take the same defaults as log_delivery.
+"""
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, ValidationError, field_validator
+from sqlalchemy import insert
+
+import metrics
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "1000"))
+INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", "20"))  # reported per chunk
+
+COLUMNS = [
+    "pickup_location", "destination_location", "stops", "num_stops", "distance_km", "duration_min",
+    "actual_eta_min", "weather", "time_of_day", "traffic_level", "created_at",
+]
+
+
+class DeliveryLogRow(BaseModel):
+    pickup_location: str
+    destination_location: str
+    stops: List[str] = []
+    distance_km: float
+    duration_min: float
+    actual_eta_min: float
+    weather: str = "clear"
+    time_of_day: str = "day"
+    traffic_level: str = "moderate"
+    created_at: Optional[datetime] = None
+
+    @field_validator("stops", mode="before")
+    @classmethod
+    def _parse_stops(cls, v):
+        if v is None:
+            return []
+        if isinstance(v, str):
+            v = v.strip()
+            if v.startswith("["):
+                return json.loads(v)
+            return [s.strip() for s in v.split("|") if s.strip()]
+        return v
+
+
+# --- Input parsing ---
+async def iter_lines(chunks):
+    """Yield (line_no, bytes) from an async iterator of byte chunks."""
+    buf, line_no = b"", 0
+    async for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line
+    if buf:
+        yield line_no + 1, buf
+
+
+async def iter_chunks(chunks, fmt, chunk_rows=INGEST_CHUNK_ROWS):
+    """Yield lists of (line_no, record dict | error string), chunk_rows at a time."""
+    header = None
+    batch = []
+    async for line_no, raw in iter_lines(chunks):
+        text = raw.decode("utf-8-sig" if line_no == 1 else "utf-8", errors="replace").rstrip("\r")
+        if not text.strip():
+            continue
+        if fmt == "csv" and header is None:
+            header = [h.strip() for h in next(csv.reader([text]))]
+            continue
+        batch.append((line_no, text))
+        if len(batch) >= chunk_rows:
+            yield _parse(batch, fmt, header)
+            batch = []
+    if batch:
+        yield _parse(batch, fmt, header)
+
+
+def _parse(batch, fmt, header):
+    if fmt == "csv":
+        # One reader per chunk; quoted fields must not span lines
+        values = csv.reader([text for _, text in batch])
+        return [
+            (line_no, {k: v for k, v in zip(header, row) if v != ""})
+            for (line_no, _), row in zip(batch, values)
+        ]
+    parsed = []
+    for line_no, text in batch:
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as e:
+            parsed.append((line_no, f"invalid JSON: {e.msg}"))
+            continue
+        if not isinstance(record, dict):
+            parsed.append((line_no, "expected a JSON object"))
+            continue
+        parsed.append((line_no, {k: v for k, v in record.items() if v is not None and v != ""}))
+    return parsed
+
+
+def validate_chunk(parsed, now):
+    """Split a parsed chunk into insertable rows and [{line, error}]."""
+    rows, errors = [], []
+    for line_no, record in parsed:
+        if isinstance(record, str):
+            errors.append({"line": line_no, "error": record})
+            continue
+        try:
+            row = DeliveryLogRow.model_validate(record).model_dump()
+        except (ValidationError, ValueError) as e:
+            if isinstance(e, ValidationError):
+                first = e.errors()[0]
+                message = f"{'.'.join(map(str, first['loc']))}: {first['msg']}"
+            else:
+                message = str(e)
+            errors.append({"line": line_no, "error": message})
+            continue
+        if row["created_at"] is None:
+            row["created_at"] = now
+        row["num_stops"] = len(row["stops"])
+        rows.append(row)
+    return rows, errors
+
+
+# --- Writers ---
+async def _write_copy(session, table, rows):
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        schema_name=table.schema,
+        columns=COLUMNS,
+        # COPY bypasses SQLAlchemy's JSON type, so encode stops here
+        records=[tuple(json.dumps(row[c]) if c == "stops" else row[c] for c in COLUMNS) for row in rows],
+    )
+
+
+async def _write_executemany(session, table, rows):
+    await session.execute(insert(table), rows)
+
+
+def _writer_for(session):
+    if session.bind.dialect.driver == "asyncpg":
+        return _write_copy
+    return _write_executemany
+
+
+async def ingest(session, table, chunks, fmt="ndjson", chunk_rows=INGEST_CHUNK_ROWS):
+    """Stream `chunks` (async iterator of bytes) into `table`.
+
+    Returns totals plus one entry per chunk with its row count, inserted
+    count, first INGEST_MAX_ERRORS errors and throughput.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError(f"unsupported format: {fmt}")
+    write = _writer_for(session)
+    report = {"format": fmt, "rows": 0, "inserted": 0, "rejected": 0, "chunks": []}
+    started = time.perf_counter()
+
+    async for parsed in iter_chunks(chunks, fmt, chunk_rows):
+        chunk_start = time.perf_counter()
+        rows, errors = validate_chunk(parsed, datetime.utcnow())
+        inserted = 0
+        if rows:
+            try:
+                await write(session, table, rows)
+                await session.commit()
+                inserted = len(rows)
+            except Exception as e:
+                await session.rollback()
+                errors.append({"line": parsed[0][0], "error": f"chunk not written: {type(e).__name__}: {e}"})
+        seconds = time.perf_counter() - chunk_start
+
+        metrics.counter("delivery_ingest_rows").inc(inserted)
+        metrics.counter("delivery_ingest_rejected").inc(len(parsed) - inserted)
+        report["rows"] += len(parsed)
+        report["inserted"] += inserted
+        report["rejected"] += len(parsed) - inserted
+        report["chunks"].append({
+            "chunk": len(report["chunks"]) + 1,
+            "first_line": parsed[0][0],
+            "rows": len(parsed),
+            "inserted": inserted,
+            "errors": errors[:INGEST_MAX_ERRORS],
+            "error_count": len(errors),
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(len(parsed) / seconds, 1) if seconds else None,
+        })
+
+    report["seconds"] = round(time.perf_counter() - started, 4)
+    report["rows_per_sec"] = round(report["rows"] / report["seconds"], 1) if report["seconds"] else None
+    return report
@@ -0,0 +1,139 @@
+# delivery_recorder.py
+"""Write-behind recorder for delivery events.
+
+`record()` only puts the event on a bounded in-memory queue; a background
+task flushes it with other events in one multi-row INSERT when
+DELIVERY_FLUSH_ROWS events are waiting or DELIVERY_FLUSH_MS has passed since
+the first one. A full queue makes `record()` wait (up to
+DELIVERY_RECORD_TIMEOUT_S, then RecorderFullError), so a slow database pushes
+back on producers instead of growing memory. `stop()` flushes what is left.
+
+Events are timestamped when recorded, not when flushed. Anything still
+buffered when the process is killed is lost; use /delivery_logs/bulk for
+data that must be acknowledged only once stored.
+"""
+import asyncio
+import os
+import time
+import traceback
+from datetime import datetime
+
+from sqlalchemy import insert
+
+import metrics
+from database import async_session
+
+FLUSH_SIZE_BUCKETS = [1, 10, 50, 100, 250, 500, 1000, 2500]
+FLUSH_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 250, 1000]
+
+
+class RecorderFullError(Exception):
+    pass
+
+
+class DeliveryRecorder:
+    def __init__(self, table, max_batch=None, flush_ms=None, max_buffer=None,
+                 put_timeout=None, retries=3, name="delivery_log"):
+        self.table = table
+        self.max_batch = max_batch or int(os.getenv("DELIVERY_FLUSH_ROWS", "500"))
+        self.max_wait = (flush_ms if flush_ms is not None
+                         else float(os.getenv("DELIVERY_FLUSH_MS", "200"))) / 1000
+        self.max_buffer = max_buffer or int(os.getenv("DELIVERY_BUFFER_SIZE", "10000"))
+        self.put_timeout = (put_timeout if put_timeout is not None
+                            else float(os.getenv("DELIVERY_RECORD_TIMEOUT_S", "1")))
+        self.retries = retries
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+        self.buffered = metrics.gauge(f"{name}_buffered")
+        self.recorded = metrics.counter(f"{name}_recorded_total")
+        self.flushed = metrics.counter(f"{name}_flushed_total")
+        self.blocked = metrics.counter(f"{name}_backpressure_total")
+        self.rejected = metrics.counter(f"{name}_rejected_total")
+        self.dropped = metrics.counter(f"{name}_dropped_total")
+        self.flush_size_hist = metrics.histogram(f"{name}_flush_rows", FLUSH_SIZE_BUCKETS)
+        self.flush_ms_hist = metrics.histogram(f"{name}_flush_ms", FLUSH_MS_BUCKETS)
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_buffer)
+            self._task = loop.create_task(self._run())
+
+    async def record(self, **event):
+        """Buffer one delivery_logs row; returns as soon as it is queued."""
+        self._ensure_started()
+        event.setdefault("created_at", datetime.utcnow())
+        if self._queue.full():
+            self.blocked.inc()
+            try:
+                await asyncio.wait_for(self._queue.put(event), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.rejected.inc()
+                raise RecorderFullError(f"delivery buffer full ({self.max_buffer} events)")
+        else:
+            self._queue.put_nowait(event)
+        self.recorded.inc()
+        self.buffered.set(self._queue.qsize())
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                if batch[-1] is None:
+                    return batch
+            timeout = deadline - self._loop.time()
+            if len(batch) >= self.max_batch or timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # A None entry is the shutdown sentinel queued by stop()
+            stopping = batch[-1] is None
+            rows = [row for row in batch if row is not None]
+            if rows:
+                await self._flush(rows)
+            self.buffered.set(self._queue.qsize())
+            if stopping:
+                return
+
+    async def _flush(self, rows):
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                async with async_session() as db:
+                    await db.execute(insert(self.table), rows)
+                    await db.commit()
+                break
+            except Exception:
+                traceback.print_exc()
+                if attempt == self.retries:
+                    print(f"❌ Dropped {len(rows)} delivery events after {attempt + 1} attempts")
+                    self.dropped.inc(len(rows))
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        self.flushed.inc(len(rows))
+        self.flush_size_hist.observe(len(rows))
+        self.flush_ms_hist.observe((time.perf_counter() - started) * 1000)
+
+    async def flush(self):
+        """Write everything buffered so far and restart the worker."""
+        await self.stop()
+        self._ensure_started()
+
+    async def stop(self):
+        """Flush buffered events, then stop the worker."""
+        if self._task and not self._task.done() and self._loop is asyncio.get_running_loop():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
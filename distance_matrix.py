@@ -0,0 +1,227 @@
+# distance_matrix.py
+"""N x M distance (km) and duration (min) matrices.
+
+Cells are cached by rounded coordinates, provider and time-of-day bucket, so
+repeated depot-to-zone queries are served from memory. Missing cells are
+fetched from the configured provider (MATRIX_PROVIDER = haversine | mapbox |
+ors) in chunks that respect the provider's size limits; if the provider fails
+the haversine estimate is used for those cells instead.
+"""
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+import metrics
+from http_client import get_client
+
+EARTH_RADIUS_KM = 6371.0
+
+MATRIX_PROVIDER = os.getenv("MATRIX_PROVIDER", "haversine")
+COORD_PRECISION = int(os.getenv("MATRIX_COORD_PRECISION", "3"))  # ~100 m
+TIME_BUCKET_HOURS = int(os.getenv("MATRIX_TIME_BUCKET_HOURS", "3"))
+CACHE_SIZE = int(os.getenv("MATRIX_CACHE_SIZE", "200000"))
+# Straight-line fallback: road distance ~ 1.3x great-circle, average speed in km/h
+ROAD_FACTOR = float(os.getenv("MATRIX_ROAD_FACTOR", "1.3"))
+AVG_SPEED_KMH = float(os.getenv("MATRIX_AVG_SPEED_KMH", "40"))
+
+MAPBOX_TOKEN = os.getenv("MAPBOX_TOKEN", "your_mapbox_token")
+MAPBOX_MAX_COORDS = 10  # driving-traffic profile limit per request
+ORS_API_KEY = os.getenv("ORS_API_KEY")
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+ORS_MAX_CELLS = 3500
+
+
+def haversine_matrix(coords, coords_to=None):
+    """Great-circle distances in km between [lng, lat] points (vectorized)."""
+    a = np.radians(np.asarray(coords, dtype=np.float64))
+    b = a if coords_to is None else np.radians(np.asarray(coords_to, dtype=np.float64))
+    lng1, lat1 = a[:, 0][:, None], a[:, 1][:, None]
+    lng2, lat2 = b[:, 0][None, :], b[:, 1][None, :]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def estimate_matrix(sources, destinations):
+    """Haversine-based (distance_km, duration_min) estimate."""
+    dist = haversine_matrix(sources, destinations) * ROAD_FACTOR
+    return dist, dist / AVG_SPEED_KMH * 60
+
+
+def _chunks(n, size):
+    return [range(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+async def _fetch_mapbox(sources, destinations):
+    # Sources + destinations share one coordinate list of at most MAPBOX_MAX_COORDS
+    half = MAPBOX_MAX_COORDS // 2
+    dist = np.empty((len(sources), len(destinations)))
+    dur = np.empty_like(dist)
+    for si in _chunks(len(sources), half):
+        for di in _chunks(len(destinations), MAPBOX_MAX_COORDS - len(si)):
+            pts = [sources[i] for i in si] + [destinations[j] for j in di]
+            coords = ";".join(f"{lng},{lat}" for lng, lat in pts)
+            res = await get_client("mapbox").get(
+                f"https://api.mapbox.com/directions-matrix/v1/mapbox/driving-traffic/{coords}",
+                params={
+                    "access_token": MAPBOX_TOKEN,
+                    "annotations": "distance,duration",
+                    "sources": ";".join(str(k) for k in range(len(si))),
+                    "destinations": ";".join(str(len(si) + k) for k in range(len(di))),
+                },
+            )
+            res.raise_for_status()
+            body = res.json()
+            block = np.ix_(list(si), list(di))
+            dist[block] = np.array(body["distances"], dtype=np.float64) / 1000
+            dur[block] = np.array(body["durations"], dtype=np.float64) / 60
+    return dist, dur
+
+
+async def _fetch_ors(sources, destinations):
+    dist = np.empty((len(sources), len(destinations)))
+    dur = np.empty_like(dist)
+    rows_per_chunk = max(1, ORS_MAX_CELLS // max(1, min(len(destinations), ORS_MAX_CELLS)))
+    for si in _chunks(len(sources), rows_per_chunk):
+        for di in _chunks(len(destinations), ORS_MAX_CELLS // len(si)):
+            pts = [sources[i] for i in si] + [destinations[j] for j in di]
+            res = await get_client("ors").post(
+                f"{ORS_BASE_URL}/v2/matrix/driving-car",
+                json={
+                    "locations": pts,
+                    "sources": list(range(len(si))),
+                    "destinations": list(range(len(si), len(pts))),
+                    "metrics": ["distance", "duration"],
+                    "units": "km",
+                },
+                headers={"Authorization": ORS_API_KEY or ""},
+            )
+            res.raise_for_status()
+            body = res.json()
+            block = np.ix_(list(si), list(di))
+            dist[block] = np.array(body["distances"], dtype=np.float64)
+            dur[block] = np.array(body["durations"], dtype=np.float64) / 60
+    return dist, dur
+
+
+PROVIDERS = {"mapbox": _fetch_mapbox, "ors": _fetch_ors}
+
+
+def _check_provider(provider):
+    if provider != "haversine" and provider not in PROVIDERS:
+        raise ValueError(f"unknown matrix provider: {provider} (expected haversine, {', '.join(PROVIDERS)})")
+    return provider
+
+
+_check_provider(MATRIX_PROVIDER)
+
+
+class MatrixCache:
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cells = OrderedDict()
+        self.hits = metrics.Counter()
+        self.misses = metrics.Counter()
+        self.fallbacks = metrics.Counter()
+        metrics.register("distance_matrix_cache", self.stats)
+
+    def get(self, key):
+        cell = self._cells.get(key)
+        if cell is not None:
+            self._cells.move_to_end(key)
+        return cell
+
+    def put(self, key, cell):
+        self._cells[key] = cell
+        self._cells.move_to_end(key)
+        while len(self._cells) > self.max_entries:
+            self._cells.popitem(last=False)
+
+    def stats(self):
+        total = self.hits.value + self.misses.value
+        return {
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "provider_fallbacks": self.fallbacks.value,
+            "hit_ratio": round(self.hits.value / total, 4) if total else 0.0,
+            "size": len(self._cells),
+        }
+
+
+matrix_cache = MatrixCache()
+
+
+def _point_key(p):
+    return (round(float(p[0]), COORD_PRECISION), round(float(p[1]), COORD_PRECISION))
+
+
+def time_bucket(depart_at=None):
+    return (depart_at or datetime.now()).hour // TIME_BUCKET_HOURS
+
+
+async def get_matrix(sources, destinations=None, provider=None, depart_at=None):
+    """Return (distance_km, duration_min) arrays of shape (len(sources), len(destinations)).
+    Points are [lng, lat]; destinations default to sources. Road providers
+    may return asymmetric matrices (one-way streets, traffic)."""
+    destinations = sources if destinations is None else destinations
+    provider = _check_provider(provider or MATRIX_PROVIDER)
+    if provider == "haversine":
+        # Cheaper to recompute than to look up
+        return estimate_matrix(sources, destinations)
+
+    bucket = time_bucket(depart_at)
+    src_keys = [_point_key(p) for p in sources]
+    dst_keys = [_point_key(p) for p in destinations]
+    dist = np.empty((len(sources), len(destinations)))
+    dur = np.empty_like(dist)
+
+    missing = np.zeros(dist.shape, dtype=bool)
+    for i, sk in enumerate(src_keys):
+        for j, dk in enumerate(dst_keys):
+            cell = matrix_cache.get((provider, bucket, sk, dk))
+            if cell is None:
+                missing[i, j] = True
+            else:
+                dist[i, j], dur[i, j] = cell
+    n_missing = int(missing.sum())
+    matrix_cache.hits.inc(missing.size - n_missing)
+    if not n_missing:
+        return dist, dur
+    matrix_cache.misses.inc(n_missing)
+
+    # Fetch the sub-matrix spanned by rows/columns that have any missing cell
+    rows = np.flatnonzero(missing.any(axis=1))
+    cols = np.flatnonzero(missing.any(axis=0))
+    sub_src = [sources[i] for i in rows]
+    sub_dst = [destinations[j] for j in cols]
+    try:
+        sub_dist, sub_dur = await PROVIDERS[provider](sub_src, sub_dst)
+        cacheable = True
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        print(f"⚠️ {provider} matrix failed, using haversine estimate:", e)
+        matrix_cache.fallbacks.inc()
+        sub_dist, sub_dur = estimate_matrix(sub_src, sub_dst)
+        cacheable = False
+
+    for a, i in enumerate(rows):
+        for b, j in enumerate(cols):
+            if missing[i, j]:
+                dist[i, j], dur[i, j] = sub_dist[a, b], sub_dur[a, b]
+                if cacheable:
+                    matrix_cache.put((provider, bucket, src_keys[i], dst_keys[j]),
+                                     (float(sub_dist[a, b]), float(sub_dur[a, b])))
+    return dist, dur
+
+
+async def get_pairs(origins, destinations, provider=None, depart_at=None):
+    """(distance_km, duration_min) for each origin[k] -> destination[k] pair."""
+    uniq_o = list(dict.fromkeys(_point_key(p) for p in origins))
+    uniq_d = list(dict.fromkeys(_point_key(p) for p in destinations))
+    dist, dur = await get_matrix(uniq_o, uniq_d, provider, depart_at)
+    oi = {k: i for i, k in enumerate(uniq_o)}
+    di = {k: j for j, k in enumerate(uniq_d)}
+    idx_o = [oi[_point_key(p)] for p in origins]
+    idx_d = [di[_point_key(p)] for p in destinations]
+    return dist[idx_o, idx_d], dur[idx_o, idx_d]
@@ -0,0 +1,300 @@
+# email_outbox.py
+"""Durable email outbox with a background SMTP worker pool.
+
+`enqueue` stores a message in the email_outbox table and returns at once.
+Workers claim queued rows in batches and send them over long-lived,
+authenticated SMTP sessions (reconnecting only when the server drops them).
+Failed sends are retried with jittered exponential backoff; after
+EMAIL_MAX_ATTEMPTS the message is marked "dead" and kept for inspection.
+
+A claimed row is leased to its worker: `claimed_at` is stamped when it
+moves to "sending", and only a claim older than EMAIL_LEASE_SECONDS (the
+worker or its process died mid-batch) may be taken over by another worker.
+Several processes can therefore share the table without resending mail that
+a live worker is still delivering.
+
+Attachments are either stored inline (`attachment`) or produced at send time
+by a builder registered for `attachment_kind` (e.g. rendering a route PDF),
+which keeps large files out of the table.
+"""
+import asyncio
+import os
+import random
+import traceback
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import aiosmtplib
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, LargeBinary, and_, or_, select, update
+
+import metrics
+from database import Base, async_session
+
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_BACKOFF_SECONDS = float(os.getenv("EMAIL_BACKOFF_SECONDS", "30"))
+EMAIL_POLL_SECONDS = float(os.getenv("EMAIL_POLL_SECONDS", "5"))
+EMAIL_LEASE_SECONDS = float(os.getenv("EMAIL_LEASE_SECONDS", "300"))
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    attachment_name = Column(String, nullable=True)
+    attachment = Column(LargeBinary, nullable=True)
+    attachment_kind = Column(String, nullable=True)
+    attachment_ref = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued|sending|sent|dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(TIMESTAMP, default=datetime.utcnow, index=True)
+    claimed_at = Column(TIMESTAMP, nullable=True)  # lease start while "sending"
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    sent_at = Column(TIMESTAMP, nullable=True)
+
+
+# kind -> async fn(ref) -> attachment bytes
+_attachment_builders = {}
+
+
+def register_attachment_builder(kind, fn):
+    _attachment_builders[kind] = fn
+
+
+def smtp_settings():
+    return {
+        "hostname": os.getenv("SMTP_HOST"),
+        "port": int(os.getenv("SMTP_PORT", "587")),
+        "start_tls": os.getenv("SMTP_STARTTLS", "true").lower() == "true",
+        "username": os.getenv("SMTP_USERNAME") or None,
+        "password": os.getenv("SMTP_PASSWORD") or None,
+    }
+
+
+class _Connection:
+    """One SMTP session, opened lazily and reused across messages."""
+
+    def __init__(self):
+        self.client = None
+
+    async def ensure(self):
+        if self.client is not None and self.client.is_connected:
+            return self.client
+        settings = smtp_settings()
+        client = aiosmtplib.SMTP(
+            hostname=settings["hostname"], port=settings["port"], start_tls=settings["start_tls"]
+        )
+        await client.connect()
+        if settings["username"]:
+            await client.login(settings["username"], settings["password"])
+        self.client = client
+        return client
+
+    async def close(self):
+        if self.client is not None and self.client.is_connected:
+            try:
+                await self.client.quit()
+            except aiosmtplib.SMTPException:
+                self.client.close()
+        self.client = None
+
+
+class OutboxWorkerPool:
+    def __init__(self, workers=EMAIL_WORKERS, batch_size=EMAIL_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._tasks = []
+        self._wakeup = None
+        self._stopping = False
+        self.sent = metrics.Counter()
+        self.retried = metrics.Counter()
+        self.dead = metrics.Counter()
+        self.reconnects = metrics.Counter()
+        self.errors = metrics.Counter()
+        metrics.register("email_outbox", self.stats)
+
+    async def enqueue(self, recipient, subject, body, user_id=None, attachment_name=None,
+                      attachment=None, attachment_kind=None, attachment_ref=None):
+        async with async_session() as db:
+            job = EmailOutbox(
+                user_id=user_id, recipient=recipient, subject=subject, body=body,
+                attachment_name=attachment_name, attachment=attachment,
+                attachment_kind=attachment_kind,
+                attachment_ref=None if attachment_ref is None else str(attachment_ref),
+                status="queued", attempts=0, next_attempt_at=datetime.utcnow(),
+            )
+            db.add(job)
+            await db.commit()
+            job_id = job.id
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    @staticmethod
+    def _claimable(now):
+        """Due queued rows, plus "sending" rows whose lease has expired."""
+        expired = now - timedelta(seconds=EMAIL_LEASE_SECONDS)
+        return or_(
+            and_(EmailOutbox.status == "queued", EmailOutbox.next_attempt_at <= now),
+            and_(EmailOutbox.status == "sending",
+                 or_(EmailOutbox.claimed_at.is_(None), EmailOutbox.claimed_at < expired)),
+        )
+
+    async def _claim(self):
+        """Lease up to batch_size due messages ("sending") and return them."""
+        now = datetime.utcnow()
+        async with async_session() as db:
+            result = await db.execute(
+                select(EmailOutbox.id)
+                .where(self._claimable(now))
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+            )
+            claimed = []
+            for job_id in result.scalars().all():
+                # Conditional update so two workers never take the same row
+                res = await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == job_id, self._claimable(now))
+                    .values(status="sending", claimed_at=now)
+                )
+                if res.rowcount:
+                    claimed.append(job_id)
+            await db.commit()
+            if not claimed:
+                return []
+            result = await db.execute(select(EmailOutbox).where(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id))
+            return result.scalars().all()
+
+    async def _build_message(self, job):
+        msg = EmailMessage()
+        msg["Subject"] = job.subject
+        msg["From"] = os.getenv("SMTP_USERNAME") or os.getenv("SMTP_FROM", "noreply@localhost")
+        msg["To"] = job.recipient
+        msg.set_content(job.body)
+        data = job.attachment
+        if data is None and job.attachment_kind:
+            data = await _attachment_builders[job.attachment_kind](job.attachment_ref)
+        if data is not None:
+            msg.add_attachment(data, maintype="application", subtype="pdf",
+                               filename=job.attachment_name or "attachment.pdf")
+        return msg
+
+    def _outcome(self, job, error=None):
+        """Column values recording one send attempt."""
+        values = {"attempts": job.attempts + 1, "claimed_at": None}
+        if error is None:
+            values.update(status="sent", sent_at=datetime.utcnow(), last_error=None)
+            self.sent.inc()
+        elif job.attempts + 1 >= EMAIL_MAX_ATTEMPTS:
+            values.update(status="dead", last_error=error)
+            self.dead.inc()
+        else:
+            delay = EMAIL_BACKOFF_SECONDS * 2 ** job.attempts * random.uniform(0.5, 1.5)
+            values.update(status="queued", last_error=error,
+                          next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+            self.retried.inc()
+        return values
+
+    async def _send_batch(self, conn, jobs):
+        outcomes = []
+        for job in jobs:
+            try:
+                msg = await self._build_message(job)
+            except Exception as e:
+                # A failed attachment builder is this message's problem, not the session's
+                traceback.print_exc()
+                outcomes.append((job, self._outcome(job, error=f"{type(e).__name__}: {e}")))
+                continue
+            try:
+                try:
+                    client = await conn.ensure()
+                    await client.send_message(msg)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # Session timed out between batches; reconnect once
+                    await conn.close()
+                    client = await conn.ensure()
+                    self.reconnects.inc()
+                    await client.send_message(msg)
+            except Exception as e:
+                traceback.print_exc()
+                await conn.close()
+                outcomes.append((job, self._outcome(job, error=f"{type(e).__name__}: {e}")))
+            else:
+                outcomes.append((job, self._outcome(job)))
+        # Record the whole batch in one transaction, only for rows still under
+        # our lease (an expired one may already belong to another worker)
+        async with async_session() as db:
+            for job, values in outcomes:
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id == job.id, EmailOutbox.status == "sending",
+                           EmailOutbox.claimed_at == job.claimed_at)
+                    .values(**values)
+                )
+            await db.commit()
+
+    async def _worker(self):
+        conn = _Connection()
+        failures = 0
+        try:
+            while not self._stopping:
+                try:
+                    jobs = await self._claim()
+                    if jobs:
+                        await self._send_batch(conn, jobs)
+                    failures = 0
+                except Exception:
+                    # e.g. the database is briefly unreachable; rows claimed
+                    # by this batch are picked up again once their lease expires
+                    traceback.print_exc()
+                    failures += 1
+                    self.errors.inc()
+                    await asyncio.sleep(min(EMAIL_POLL_SECONDS * 2 ** (failures - 1), 60) * random.uniform(0.5, 1.5))
+                    continue
+                if jobs:
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), EMAIL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await conn.close()
+
+    async def start(self):
+        # Messages left "sending" by a crashed process are reclaimed by
+        # _claim once their lease expires; live workers elsewhere keep theirs
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        for task in self._tasks:
+            try:
+                await asyncio.wait_for(task, 10)
+            except asyncio.TimeoutError:
+                task.cancel()
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "sent": self.sent.value,
+            "retried": self.retried.value,
+            "dead": self.dead.value,
+            "reconnects": self.reconnects.value,
+            "errors": self.errors.value,
+            "workers": len(self._tasks),
+        }
+
+
+outbox = OutboxWorkerPool()
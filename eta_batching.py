@@ -0,0 +1,104 @@
+# eta_batching.py
+"""Groups concurrent single-row ETA requests into one vectorized model call."""
+import asyncio
+import os
+import time
+
+import metrics
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+WAIT_MS_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250]
+
+
+class MicroBatcher:
+    """Collects items for up to ``max_wait_ms`` or ``max_batch`` items, then runs
+    ``predict_fn(items)`` once in a worker thread and resolves each caller's future.
+    """
+
+    def __init__(self, predict_fn, max_batch=None, max_wait_ms=None, name="eta"):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch or int(os.getenv("ETA_BATCH_MAX_SIZE", "64"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None
+                         else float(os.getenv("ETA_BATCH_MAX_WAIT_MS", "5"))) / 1000
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+        self.queue_depth = metrics.gauge(f"{name}_batch_queue_depth")
+        self.queue_depth_hist = metrics.histogram(f"{name}_batch_queue_depth_hist", QUEUE_DEPTH_BUCKETS)
+        self.batch_size_hist = metrics.histogram(f"{name}_batch_size", BATCH_SIZE_BUCKETS)
+        self.wait_hist = metrics.histogram(f"{name}_batch_wait_ms", WAIT_MS_BUCKETS)
+        self.batches = metrics.counter(f"{name}_batches_total")
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        # Restart the worker if we're on a new event loop (e.g. after a reload)
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_started()
+        fut = self._loop.create_future()
+        await self._queue.put((item, fut, time.perf_counter()))
+        self.queue_depth.set(self._queue.qsize())
+        return await fut
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Take whatever is already queued before waiting for more
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            timeout = deadline - self._loop.time()
+            if len(batch) >= self.max_batch or timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # A None entry is the shutdown sentinel queued by stop()
+            stopping = any(entry is None for entry in batch)
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                await self._process(batch)
+            if stopping:
+                return
+
+    async def _process(self, batch):
+        depth = self._queue.qsize()
+        self.queue_depth.set(depth)
+        self.queue_depth_hist.observe(depth)
+        self.batch_size_hist.observe(len(batch))
+        self.batches.inc()
+
+        now = time.perf_counter()
+        for _, _, enqueued in batch:
+            self.wait_hist.observe((now - enqueued) * 1000)
+
+        items = [item for item, _, _ in batch]
+        try:
+            results = await asyncio.to_thread(self.predict_fn, items)
+        except Exception as e:
+            for _, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut, _), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def stop(self):
+        """Flush queued requests, then stop the worker."""
+        if self._task and not self._task.done() and self._loop is asyncio.get_running_loop():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
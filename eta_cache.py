@@ -0,0 +1,106 @@
+# eta_cache.py
+"""LRU cache of ETA predictions keyed on quantized model inputs.
+
+The model is deterministic, and most requests repeat the same few
+(distance, stops, weather, time_of_day, traffic_level) tuples. distance_km
+is rounded to ETA_CACHE_DISTANCE_STEP (0 = exact) before both the lookup and
+the prediction, so a cached answer is exactly what the model would return
+for that request. With the cache disabled (ETA_CACHE_MB=0) nothing is
+rounded. Entries belong to one model version: the first lookup
+under a new version empties the cache, and late writes from the old version
+are dropped. Memory is capped at ETA_CACHE_MB using an estimated per-entry size.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import metrics
+
+ETA_CACHE_MB = float(os.getenv("ETA_CACHE_MB", "16"))
+ETA_CACHE_DISTANCE_STEP = float(os.getenv("ETA_CACHE_DISTANCE_STEP", "0.5"))
+
+_ENTRY_OVERHEAD = 120  # OrderedDict node + tuple header, roughly
+
+
+class PredictionCache:
+    def __init__(self, max_mb=ETA_CACHE_MB, distance_step=ETA_CACHE_DISTANCE_STEP):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.distance_step = distance_step
+        self.version = None
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = metrics.Counter()
+        self.misses = metrics.Counter()
+        self.evictions = metrics.Counter()
+        self.invalidations = metrics.Counter()
+        metrics.register("eta_cache", self.stats)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def quantize(self, row):
+        """A copy of the request model with distance_km rounded to the cache
+        step; the row itself when the cache is off or there is nothing to round."""
+        if not self.enabled or self.distance_step <= 0 or row.distance_km is None:
+            return row
+        step = self.distance_step
+        return row.model_copy(update={"distance_km": round(round(row.distance_km / step) * step, 6)})
+
+    @staticmethod
+    def key(row):
+        return (row.distance_km, row.num_stops, row.weather, row.time_of_day, row.traffic_level)
+
+    def get(self, version, row):
+        """Cached prediction for a quantized row, or None."""
+        if not self.enabled:
+            return None
+        key = self.key(row)
+        with self._lock:
+            if version != self.version:
+                self._clear(version)
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+        (self.hits if value is not None else self.misses).inc()
+        return None if value is None else value[0]
+
+    def put(self, version, row, prediction):
+        if not self.enabled:
+            return
+        key = self.key(row)
+        nbytes = _ENTRY_OVERHEAD + sum(sys.getsizeof(k) for k in key) + 24
+        with self._lock:
+            if version != self.version or key in self._items:
+                return
+            self._items[key] = (float(prediction), nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes and self._items:
+                _, (_, dropped) = self._items.popitem(last=False)
+                self.size -= dropped
+                self.evictions.inc()
+
+    def _clear(self, version):
+        if self._items:
+            self.invalidations.inc()
+        self._items.clear()
+        self.size = 0
+        self.version = version
+
+    def stats(self):
+        lookups = self.hits.value + self.misses.value
+        return {
+            "version": self.version,
+            "entries": len(self._items),
+            "bytes": self.size,
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "hit_ratio": round(self.hits.value / lookups, 4) if lookups else None,
+            "evictions": self.evictions.value,
+            "invalidations": self.invalidations.value,
+        }
+
+
+eta_cache = PredictionCache()
@@ -0,0 +1,140 @@
+# eta_compiled.py
+"""Flattened, NumPy-only form of the ETA RandomForest pipeline.
+
+`export_compiled` turns the sklearn Pipeline built by model_train.py into a
+directory of .npy node arrays plus a meta.json with the one-hot column
+mapping. `CompiledETAModel` loads those arrays (memory-mapped, so every
+uvicorn worker shares the same pages) and evaluates all trees for a whole
+batch at once without pandas or sklearn.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+ARRAYS = ("feature", "threshold", "left", "right", "value", "roots")
+
+
+def export_compiled(pipeline, out_dir):
+    """Write the fitted pipeline's encoder mapping and forest nodes to out_dir."""
+    preprocessor = pipeline.named_steps["preprocessor"]
+    forest = pipeline.named_steps["regressor"]
+    input_names = list(preprocessor.feature_names_in_)
+
+    # Column layout of the ColumnTransformer output, in order
+    categorical, numeric, col = {}, {}, 0
+    for name, transformer, columns in preprocessor.transformers_:
+        if isinstance(transformer, str) and transformer == "drop":
+            continue
+        columns = [input_names[c] if isinstance(c, (int, np.integer)) else c for c in columns]
+        if not hasattr(transformer, "categories_"):
+            # "passthrough" (or the identity transformer newer sklearn uses for it)
+            for c in columns:
+                numeric[c] = col
+                col += 1
+        else:
+            for c, cats in zip(columns, transformer.categories_):
+                categorical[c] = {str(v): col + i for i, v in enumerate(cats)}
+                col += len(cats)
+
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for est in forest.estimators_:
+        tree = est.tree_
+        n = tree.node_count
+        is_leaf = tree.children_left == -1
+        idx = np.arange(n) + offset
+        # Leaves point at themselves; that is how the predictor recognises them
+        left.append(np.where(is_leaf, idx, tree.children_left + offset))
+        right.append(np.where(is_leaf, idx, tree.children_right + offset))
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+        value.append(tree.value.reshape(n, -1)[:, 0])
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, tree.max_depth)
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {
+        "feature": np.concatenate(feature).astype(np.int32),
+        "threshold": np.concatenate(threshold).astype(np.float64),
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "value": np.concatenate(value).astype(np.float64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    for name, arr in arrays.items():
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+
+    meta = {
+        "n_columns": col,
+        "max_depth": int(max_depth),
+        "categorical": categorical,
+        "numeric": numeric,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return out_dir
+
+
+class CompiledETAModel:
+    def __init__(self, path, mmap=True):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.n_columns = meta["n_columns"]
+        self.max_depth = meta["max_depth"]
+        self.categorical = meta["categorical"]
+        self.numeric = meta["numeric"]
+        mode = "r" if mmap else None
+        self._is_leaf = None
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode))
+
+    def encode(self, columns):
+        """Build the dense design matrix from a dict of equal-length columns."""
+        n = len(next(iter(columns.values())))
+        X = np.zeros((n, self.n_columns), dtype=np.float64)
+        for name, col in self.numeric.items():
+            X[:, col] = np.asarray(columns[name], dtype=np.float64)
+        rows = np.arange(n)
+        for name, mapping in self.categorical.items():
+            # Unknown categories stay all-zero, like OneHotEncoder(handle_unknown="ignore")
+            cols = np.fromiter((mapping.get(str(v), -1) for v in columns[name]), dtype=np.int64, count=n)
+            known = cols >= 0
+            X[rows[known], cols[known]] = 1.0
+        # sklearn trees compare float32 inputs against float64 thresholds
+        return X.astype(np.float32).astype(np.float64)
+
+    def predict_matrix(self, X):
+        n, n_trees = X.shape[0], len(self.roots)
+        if self._is_leaf is None:
+            self._is_leaf = self.left == np.arange(len(self.left), dtype=self.left.dtype)
+        flat_X = np.ascontiguousarray(X).ravel()
+        # One cursor per (row, tree); only cursors not yet at a leaf are advanced
+        node = np.tile(np.asarray(self.roots, dtype=np.int64), n)
+        base = np.repeat(np.arange(n, dtype=np.int64) * X.shape[1], n_trees)
+        active = np.arange(node.size)
+        while active.size:
+            cur = node[active]
+            go_left = flat_X[base[active] + self.feature[cur]] <= self.threshold[cur]
+            nxt = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = nxt
+            active = active[~self._is_leaf[nxt]]
+        return self.value[node].reshape(n, n_trees).mean(axis=1)
+
+    def predict_columns(self, columns):
+        return self.predict_matrix(self.encode(columns))
+
+    def predict(self, rows, features):
+        """Predict for objects exposing the given feature attributes."""
+        return self.predict_columns({f: [getattr(r, f) for r in rows] for f in features})
+
+
+if __name__ == "__main__":
+    import joblib
+
+    src = sys.argv[1] if len(sys.argv) > 1 else "eta_model.pkl"
+    dst = sys.argv[2] if len(sys.argv) > 2 else "eta_model_compiled"
+    export_compiled(joblib.load(src), dst)
+    print(f"✅ Exported {src} to {dst}/")
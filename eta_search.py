@@ -0,0 +1,187 @@
+# eta_search.py
+"""Cross-validated model search for the ETA predictor.
+
+Every candidate (RandomForest, HistGradientBoosting and linear baselines over
+small grids) gets the same features and one-hot encoding as the production
+pipeline. Each (candidate, fold) fit is a separate joblib task spread across
+all cores; the models themselves run single-threaded so cores aren't
+oversubscribed.
+
+The best --top candidates per family are then refit on the training split
+and measured on the holdout. The report covers MAE/RMSE, training time,
+single-row and per-row batch prediction latency, and pickled size on disk,
+so a model can be chosen on the latency/accuracy trade-off.
+
+    python eta_search.py                        # all families, 5 folds
+    python eta_search.py --families rf hgb --folds 3 --out search.json
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.model_selection import KFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from retrain_eta import CATEGORICAL, FEATURES, TARGET, read_data
+
+NUMERIC = [f for f in FEATURES if f not in CATEGORICAL]
+
+GRIDS = {
+    "rf": (
+        lambda **p: RandomForestRegressor(random_state=42, n_jobs=1, **p),
+        {"n_estimators": [50, 100, 200], "max_depth": [None, 12, 20], "min_samples_leaf": [1, 5]},
+    ),
+    "hgb": (
+        lambda **p: HistGradientBoostingRegressor(random_state=42, **p),
+        {"learning_rate": [0.05, 0.1], "max_iter": [100, 300], "max_leaf_nodes": [15, 31]},
+    ),
+    "ridge": (lambda **p: Ridge(**p), {"alpha": [0.1, 1.0, 10.0]}),
+    "linear": (lambda **p: LinearRegression(**p), {}),
+}
+
+
+def make_pipeline(family, params):
+    factory, _ = GRIDS[family]
+    # Linear models need scaled numerics; trees split the raw values
+    numeric = StandardScaler() if family in ("ridge", "linear") else "passthrough"
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False), CATEGORICAL),
+            ("num", numeric, NUMERIC),
+        ]
+    )
+    return Pipeline([("preprocessor", preprocessor), ("regressor", factory(**params))])
+
+
+def candidates(families):
+    for family in families:
+        _, grid = GRIDS[family]
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            yield family, dict(zip(keys, values))
+
+
+def _scores(y_true, y_pred):
+    err = np.asarray(y_pred) - np.asarray(y_true)
+    return float(np.abs(err).mean()), float(np.sqrt((err ** 2).mean()))
+
+
+def fit_fold(family, params, X, y, train_idx, test_idx):
+    pipeline = make_pipeline(family, params)
+    start = time.perf_counter()
+    pipeline.fit(X.iloc[train_idx], y.iloc[train_idx])
+    fit_seconds = time.perf_counter() - start
+    mae, rmse = _scores(y.iloc[test_idx], pipeline.predict(X.iloc[test_idx]))
+    return mae, rmse, fit_seconds
+
+
+def measure(pipeline, X_hold, y_hold, single_calls=200, batch_rows=1000):
+    """Holdout accuracy, prediction latency and pickled size of a fitted pipeline."""
+    mae, rmse = _scores(y_hold, pipeline.predict(X_hold))
+
+    row = X_hold.iloc[:1]
+    pipeline.predict(row)  # warm-up
+    timings = []
+    for _ in range(single_calls):
+        start = time.perf_counter()
+        pipeline.predict(row)
+        timings.append(time.perf_counter() - start)
+
+    batch = X_hold.iloc[np.arange(batch_rows) % len(X_hold)]
+    start = time.perf_counter()
+    pipeline.predict(batch)
+    batch_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.pkl")
+        joblib.dump(pipeline, path)
+        size = os.path.getsize(path)
+
+    return {
+        "holdout_mae": round(mae, 4),
+        "holdout_rmse": round(rmse, 4),
+        "single_row_ms_p50": round(float(np.median(timings)) * 1000, 3),
+        "batch_row_us": round(batch_seconds / batch_rows * 1e6, 3),
+        "size_kb": round(size / 1024, 1),
+    }
+
+
+def search(df, families, folds=5, holdout=0.2, top=1, n_jobs=-1):
+    split = int(len(df) * (1 - holdout))
+    train, hold = df.iloc[:split], df.iloc[split:]
+    X, y = train[FEATURES], train[TARGET]
+    splits = list(KFold(n_splits=folds, shuffle=True, random_state=42).split(X))
+    cands = list(candidates(families))
+
+    print(f"🔎 {len(cands)} candidates x {folds} folds on {len(train)} rows")
+    start = time.perf_counter()
+    fold_results = Parallel(n_jobs=n_jobs)(
+        delayed(fit_fold)(family, params, X, y, tr, te)
+        for family, params in cands
+        for tr, te in splits
+    )
+    print(f"⏱ Search took {time.perf_counter() - start:.1f}s")
+
+    results = []
+    for i, (family, params) in enumerate(cands):
+        maes, rmses, fit_times = zip(*fold_results[i * folds:(i + 1) * folds])
+        results.append({
+            "family": family,
+            "params": params,
+            "cv_mae": round(float(np.mean(maes)), 4),
+            "cv_mae_std": round(float(np.std(maes)), 4),
+            "cv_rmse": round(float(np.mean(rmses)), 4),
+            "fit_seconds": round(float(np.mean(fit_times)), 3),
+        })
+    results.sort(key=lambda r: r["cv_mae"])
+
+    # Latency and size only for each family's best candidates, measured one
+    # at a time so the timings don't compete for cores
+    for family in families:
+        for result in [r for r in results if r["family"] == family][:top]:
+            pipeline = make_pipeline(family, result["params"]).fit(X, y)
+            result.update(measure(pipeline, hold[FEATURES], hold[TARGET]))
+    return results
+
+
+def print_report(results):
+    header = f"{'family':<7} {'cv MAE':>8} {'±':>6} {'RMSE':>8} {'fit s':>7} {'hold MAE':>9} {'1-row ms':>9} {'batch µs':>9} {'KB':>9}  params"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        measured = "holdout_mae" in r
+        print(
+            f"{r['family']:<7} {r['cv_mae']:>8.3f} {r['cv_mae_std']:>6.3f} {r['cv_rmse']:>8.3f} {r['fit_seconds']:>7.3f} "
+            + (f"{r['holdout_mae']:>9.3f} {r['single_row_ms_p50']:>9.3f} {r['batch_row_us']:>9.3f} {r['size_kb']:>9.1f}"
+               if measured else f"{'':>9} {'':>9} {'':>9} {'':>9}")
+            + f"  {json.dumps(r['params'])}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search ETA model families and report accuracy vs cost")
+    parser.add_argument("--data", default="delivery_data.csv")
+    parser.add_argument("--families", nargs="+", choices=list(GRIDS), default=list(GRIDS))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--top", type=int, default=1, help="candidates per family to measure on the holdout")
+    parser.add_argument("--jobs", type=int, default=-1)
+    parser.add_argument("--out", help="write the full report as JSON")
+    args = parser.parse_args()
+
+    results = search(read_data(args.data), args.families, args.folds, args.holdout, args.top, args.jobs)
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Report written to {args.out}")
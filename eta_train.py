@@ -1,36 +1,197 @@
 # eta_train.py
+"""Export delivery_logs as ETA training data.
+
+Rows are streamed from a server-side cursor in chunks of --chunk-rows and
+written chunk by chunk, so memory stays bounded however large the table is.
+Only the training columns are selected and num_stops is read from its
+stored column, so stop lists never reach Python.
+
+    python eta_train.py                                   # full export to delivery_data.csv
+    python eta_train.py --out logs.parquet                # columnar (needs pyarrow)
+    python eta_train.py --since auto                      # only rows newer than the last run
+
+--since takes an ISO timestamp (rows with a later created_at) or "auto",
+which continues from <out>.watermark. The watermark is kept on `id`, not
+created_at: the write-behind recorder commits rows a moment after stamping
+them and /delivery_logs/bulk accepts backdated rows, so a created_at cutoff
+would skip both for good. Ids can commit out of order too, so the watermark
+also lists the missing ids in the last EXPORT_ID_WINDOW ids; the next run
+re-reads from the oldest of them and keeps only rows it has not exported.
+Incremental CSV exports append to --out; Parquet/Feather files can't be
+appended to, so give each incremental run its own --out.
+"""
+import argparse
 import asyncio
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.future import select
-import pandas as pd
-from main import DeliveryLog, Base, DATABASE_URL
-
-engine = create_async_engine(DATABASE_URL, echo=True)
-SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-
-async def fetch_delivery_logs():
-    async with SessionLocal() as session:
-        result = await session.execute(select(DeliveryLog))
-        logs = result.scalars().all()
-        data = [
-            {
-                "pickup_location": log.pickup_location,
-                "destination_location": log.destination_location,
-                "num_stops": len(log.stops),
-                "distance_km": log.distance_km,
-                "duration_min": log.duration_min,
-                "actual_eta_min": log.actual_eta_min,
-                "weather": log.weather,
-                "time_of_day": log.time_of_day,
-                "traffic_level": log.traffic_level,
-            }
-            for log in logs
-        ]
-        return pd.DataFrame(data)
+import csv
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import select
+
+from main import DeliveryLog, engine
+
+EXPORT_ID_WINDOW = int(os.getenv("EXPORT_ID_WINDOW", "10000"))
+
+FIELDS = [
+    "pickup_location", "destination_location", "num_stops", "distance_km", "duration_min",
+    "actual_eta_min", "weather", "time_of_day", "traffic_level",
+]
+
+
+def export_query(since=None, after_id=None):
+    """Training columns (plus created_at and id). `since` filters on
+    created_at; otherwise rows come in id order, after `after_id` if given."""
+    query = select(
+        DeliveryLog.pickup_location,
+        DeliveryLog.destination_location,
+        DeliveryLog.num_stops,
+        DeliveryLog.distance_km,
+        DeliveryLog.duration_min,
+        DeliveryLog.actual_eta_min,
+        DeliveryLog.weather,
+        DeliveryLog.time_of_day,
+        DeliveryLog.traffic_level,
+        DeliveryLog.created_at,
+        DeliveryLog.id,
+    )
+    if since is not None:
+        return query.where(DeliveryLog.created_at > since).order_by(DeliveryLog.created_at, DeliveryLog.id)
+    if after_id is not None:
+        query = query.where(DeliveryLog.id > after_id)
+    return query.order_by(DeliveryLog.id)
+
+
+async def stream_chunks(since=None, after_id=None, chunk_rows=5000):
+    """Yield lists of result rows, chunk_rows at a time."""
+    async with engine.connect() as conn:
+        result = await conn.stream(export_query(since, after_id).execution_options(yield_per=chunk_rows))
+        async for partition in result.partitions(chunk_rows):
+            yield partition
+
+
+# --- Writers: open(path, append) -> write(rows) -> close() ---
+class CSVWriter:
+    def __init__(self, path, append):
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "a" if exists else "w", newline="")
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(FIELDS)
+
+    def write(self, rows):
+        self.writer.writerows(tuple(row)[:len(FIELDS)] for row in rows)
+
+    def close(self):
+        self.file.close()
 
-if __name__ == "__main__":
-   df = asyncio.run(fetch_delivery_logs())
-print(f"✅ Loaded rows: {len(df)}")  # Shows how many rows you got
-df.to_csv("delivery_data.csv", index=False)
 
+class ArrowWriter:
+    """Parquet or Feather (Arrow IPC) output, one record batch per chunk."""
+
+    def __init__(self, path, fmt):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("❌ Parquet/Feather export needs pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("pickup_location", pa.string()), ("destination_location", pa.string()),
+            ("num_stops", pa.int32()), ("distance_km", pa.float64()),
+            ("duration_min", pa.float64()), ("actual_eta_min", pa.float64()),
+            ("weather", pa.string()), ("time_of_day", pa.string()), ("traffic_level", pa.string()),
+        ])
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))[:len(FIELDS)]
+        self.writer.write_batch(self.pa.record_batch(
+            [self.pa.array(col, type=field.type) for col, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+def _format_for(path, fmt):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    return {".parquet": "parquet", ".feather": "feather", ".arrow": "feather"}.get(ext, "csv")
+
+
+def _read_watermark(path):
+    """{"max_id", "missing_ids"}; a pre-id watermark (an ISO created_at) comes
+    back as {"since": datetime} and is replaced after the next run."""
+    try:
+        with open(path) as f:
+            text = f.read().strip()
+    except FileNotFoundError:
+        return {"max_id": None, "missing_ids": []}
+    if not text.startswith("{"):
+        return {"since": datetime.fromisoformat(text)}
+    return json.loads(text)
+
+
+def _write_watermark(path, max_id, missing_ids):
+    with open(path, "w") as f:
+        json.dump({"max_id": max_id, "missing_ids": sorted(missing_ids)}, f)
+
+
+async def export(out="delivery_data.csv", fmt=None, since=None, chunk_rows=5000):
+    fmt = _format_for(out, fmt)
+    watermark_path = out + ".watermark"
+    after_id, missing = None, set()
+    if since == "auto":
+        state = _read_watermark(watermark_path)
+        since = state.get("since")
+        after_id, missing = state.get("max_id"), set(state.get("missing_ids", []))
+    elif isinstance(since, str):
+        since = datetime.fromisoformat(since)
+    incremental = since is not None or after_id is not None
+    # Re-read from the oldest id that was missing last time
+    start_id = min(missing) - 1 if missing else after_id
+
+    writer = CSVWriter(out, append=incremental) if fmt == "csv" else ArrowWriter(out, fmt)
+    total, last_id, gaps = 0, after_id or 0, []
+    try:
+        async for rows in stream_chunks(since, start_id, chunk_rows):
+            if after_id is not None:
+                # Overlap rows exported last time are skipped
+                rows = [r for r in rows if r.id > after_id or r.id in missing]
+                missing.difference_update(r.id for r in rows)
+            if since is None:
+                for r in rows:
+                    if r.id > last_id:
+                        # Ids skipped here may still be committing; retry them next run
+                        gaps.extend(range(max(last_id + 1, r.id - EXPORT_ID_WINDOW), r.id))
+                        last_id = r.id
+            else:
+                last_id = max([last_id] + [r.id for r in rows])
+            writer.write(rows)
+            total += len(rows)
+            print(f"➡️ Exported {total} rows")
+    finally:
+        writer.close()
+
+    if last_id:
+        floor = last_id - EXPORT_ID_WINDOW
+        _write_watermark(watermark_path, last_id, {i for i in missing.union(gaps) if i > floor})
+    print(f"✅ Loaded rows: {total}" + (f" (since {since.isoformat()})" if since else ""))
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export delivery_logs for ETA training")
+    parser.add_argument("--out", default="delivery_data.csv")
+    parser.add_argument("--format", choices=["csv", "parquet", "feather"], help="defaults from --out extension")
+    parser.add_argument("--since", help='ISO timestamp, or "auto" to continue from the last export')
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    args = parser.parse_args()
+    engine.echo = False
+    asyncio.run(export(args.out, args.format, args.since, args.chunk_rows))
@@ -0,0 +1,217 @@
+# geocode_cache.py
+"""Two-level geocoding cache: in-memory LRU in front of the geocode_cache table.
+
+Entries are keyed by (provider, normalized query). A cached value of None means
+the provider found nothing; those are kept for GEOCODE_NEGATIVE_TTL seconds so
+typos don't hit the provider on every keystroke either. Concurrent misses
+for the same key share one provider call.
+
+Set GEOCODER_PROVIDER=stub to answer every lookup from `stub_provider` instead
+of the real APIs (for offline development and tests).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, UniqueConstraint, select
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+from database import Base, async_session
+
+_MISSING = object()
+
+
+class GeocodeCacheEntry(Base):
+    __tablename__ = "geocode_cache"
+    __table_args__ = (UniqueConstraint("provider", "query_key", name="uq_geocode_provider_query"),)
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    query_key = Column(String, nullable=False)
+    value = Column(Text, nullable=True)  # JSON; NULL = not found
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    expires_at = Column(TIMESTAMP, nullable=False)
+
+
+def normalize_query(query: str) -> str:
+    """Lower-case, collapse whitespace and trim punctuation so trivially
+    different spellings of the same address share one entry."""
+    q = re.sub(r"\s+", " ", query.strip().lower())
+    q = re.sub(r"\s*,\s*", ", ", q)
+    return q.strip(" ,.;")
+
+
+def stub_provider(provider: str, query: str):
+    """Deterministic offline answers shaped like each real provider's result.
+    Queries containing "nowhere" are reported as not found."""
+    key = normalize_query(query)
+    if "nowhere" in key:
+        return None
+    digest = hashlib.sha1(key.encode()).digest()
+    # Spread points over India's bounding box
+    lat = round(8 + digest[0] / 255 * 29, 6)
+    lng = round(68 + digest[1] / 255 * 29, 6)
+    if provider == "mapbox_suggest":
+        return [f"{query.strip().title()}, India"]
+    if provider == "ors":
+        return [lng, lat]
+    return {"lat": lat, "lng": lng}
+
+
+class GeocodeCache:
+    def __init__(self, max_entries=None, ttl=None, negative_ttl=None, stub=None, session_factory=None):
+        if max_entries is None:
+            max_entries = int(os.getenv("GEOCODE_CACHE_SIZE", "10000"))
+        if ttl is None:
+            ttl = int(os.getenv("GEOCODE_TTL", str(30 * 24 * 3600)))
+        if negative_ttl is None:
+            negative_ttl = int(os.getenv("GEOCODE_NEGATIVE_TTL", str(6 * 3600)))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stub = stub if stub is not None else os.getenv("GEOCODER_PROVIDER", "").lower() == "stub"
+        self.session_factory = session_factory or async_session
+        self._lru = OrderedDict()
+        self._inflight = {}  # mem_key -> Future of the lookup already running
+
+        self.memory_hits = metrics.Counter()
+        self.db_hits = metrics.Counter()
+        self.misses = metrics.Counter()
+        self.negative_hits = metrics.Counter()
+        self.coalesced = metrics.Counter()
+        metrics.register("geocode_cache", self.stats)
+
+    # --- In-memory LRU ---
+    def _get_memory(self, key):
+        entry = self._lru.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires = entry
+        if expires < time.time():
+            del self._lru[key]
+            return _MISSING
+        self._lru.move_to_end(key)
+        return value
+
+    def _put_memory(self, key, value, expires):
+        self._lru[key] = (value, expires)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    # --- Persistent table ---
+    async def _get_db(self, provider, query_key):
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(GeocodeCacheEntry.value, GeocodeCacheEntry.expires_at).where(
+                    GeocodeCacheEntry.provider == provider,
+                    GeocodeCacheEntry.query_key == query_key,
+                )
+            )
+            row = result.first()
+        if row is None or row.expires_at < datetime.utcnow():
+            return _MISSING, None
+        value = json.loads(row.value) if row.value is not None else None
+        return value, row.expires_at
+
+    async def _put_db(self, provider, query_key, value, expires_at):
+        payload = json.dumps(value) if value is not None else None
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(GeocodeCacheEntry).where(
+                    GeocodeCacheEntry.provider == provider,
+                    GeocodeCacheEntry.query_key == query_key,
+                )
+            )
+            entry = result.scalar_one_or_none()
+            if entry is None:
+                db.add(GeocodeCacheEntry(
+                    provider=provider, query_key=query_key, value=payload, expires_at=expires_at
+                ))
+            else:
+                entry.value = payload
+                entry.created_at = datetime.utcnow()
+                entry.expires_at = expires_at
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another worker stored the same key first
+                await db.rollback()
+
+    async def lookup(self, provider: str, query: str, fetch):
+        """Return the cached value for (provider, query), calling `await fetch()`
+        on a miss. `fetch` returns None for "not found"; exceptions are not cached."""
+        query_key = normalize_query(query)
+        mem_key = (provider, query_key)
+
+        value = self._get_memory(mem_key)
+        if value is not _MISSING:
+            self.memory_hits.inc()
+            if value is None:
+                self.negative_hits.inc()
+            return value
+
+        # Single flight: wait for a lookup of the same key that is already running
+        while (pending := self._inflight.get(mem_key)) is not None:
+            self.coalesced.inc()
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller running it was cancelled; take over
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[mem_key] = future
+        try:
+            value = await self._load(provider, query, query_key, mem_key, fetch)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here; waiters still get it raised
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[mem_key]
+
+    async def _load(self, provider, query, query_key, mem_key, fetch):
+        value, expires_at = await self._get_db(provider, query_key)
+        if value is not _MISSING:
+            self.db_hits.inc()
+            if value is None:
+                self.negative_hits.inc()
+            self._put_memory(mem_key, value, (expires_at - datetime.utcnow()).total_seconds() + time.time())
+            return value
+
+        self.misses.inc()
+        value = stub_provider(provider, query) if self.stub else await fetch()
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._put_memory(mem_key, value, time.time() + ttl)
+        await self._put_db(provider, query_key, value, datetime.utcnow() + timedelta(seconds=ttl))
+        return value
+
+    def stats(self):
+        hits = self.memory_hits.value + self.db_hits.value
+        total = hits + self.misses.value
+        return {
+            "memory_hits": self.memory_hits.value,
+            "db_hits": self.db_hits.value,
+            "misses": self.misses.value,
+            "negative_hits": self.negative_hits.value,
+            "coalesced": self.coalesced.value,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "size": len(self._lru),
+        }
+
+
+geocode_cache = GeocodeCache()
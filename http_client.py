@@ -0,0 +1,213 @@
+# http_client.py
+"""Shared async HTTP clients for external providers.
+
+Each provider gets its own keep-alive connection pool, timeout, concurrency
+limit, retry policy (exponential backoff with jitter) and circuit breaker.
+Only idempotent methods are retried after a response or a dropped
+connection; POSTs are retried only when the connection was never made.
+Settings can be overridden per provider with HTTP_<NAME>_TIMEOUT,
+HTTP_<NAME>_CONCURRENCY and HTTP_<NAME>_RETRIES.
+"""
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# The request never reached the provider, so even a POST is safe to resend
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+PROVIDER_DEFAULTS = {
+    # name: (timeout seconds, max concurrent requests, retries)
+    "mapbox": (5.0, 20, 2),
+    "opencage": (5.0, 10, 2),
+    "ors": (10.0, 10, 2),
+    "huggingface": (30.0, 4, 1),
+    "gemini": (30.0, 4, 1),
+}
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised without calling the provider while its breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state != "half-open":
+            return state == "closed"
+        # Half-open lets a single probe through; its result closes or re-opens
+        # the breaker. A probe that never reports back (e.g. cancelled) is
+        # replaced after another reset_timeout.
+        now = time.monotonic()
+        if self.probe_at is not None and now - self.probe_at < self.reset_timeout:
+            return False
+        self.probe_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self.state == "half-open":
+            self.opened_at = time.monotonic()
+            self.probe_at = None
+
+
+class ProviderClient:
+    def __init__(self, name, timeout=10.0, max_concurrency=10, retries=2,
+                 backoff=0.2, max_backoff=5.0, breaker=None, transport=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.transport = transport
+        self._client = None
+        self._sem = None
+        self._loop = None
+
+        self.requests = metrics.Counter()
+        self.failures = metrics.Counter()
+        self.rejected = metrics.Counter()
+        self.in_flight = 0
+        metrics.register(f"http_{name}", self.stats)
+
+    def _ensure_client(self):
+        loop = asyncio.get_running_loop()
+        # Pools and semaphores belong to one event loop
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                transport=self.transport,
+            )
+        return self._client
+
+    def _delay(self, attempt):
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def request(self, method, url, **kwargs) -> httpx.Response:
+        if not self.breaker.allow():
+            self.rejected.inc()
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        client = self._ensure_client()
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        for attempt in range(self.retries + 1):
+            self.requests.inc()
+            try:
+                async with self._sem:
+                    self.in_flight += 1
+                    try:
+                        response = await client.request(method, url, **kwargs)
+                    finally:
+                        self.in_flight -= 1
+            except httpx.TransportError as e:
+                self.failures.inc()
+                self.breaker.record_failure()
+                if (attempt == self.retries or not self.breaker.allow()
+                        or not (idempotent or isinstance(e, NOT_SENT_ERRORS))):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.failures.inc()
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    # 429: the provider is up, so don't leave a probe hanging
+                    self.breaker.record_success()
+                if attempt == self.retries or not idempotent or not self.breaker.allow():
+                    return response
+            await asyncio.sleep(self._delay(attempt))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def guard(self, coro_fn, *args, **kwargs):
+        """Run a non-httpx awaitable (e.g. an SDK call) under this provider's
+        concurrency limit, timeout and circuit breaker."""
+        if not self.breaker.allow():
+            self.rejected.inc()
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        self._ensure_client()
+        self.requests.inc()
+        async with self._sem:
+            try:
+                result = await asyncio.wait_for(coro_fn(*args, **kwargs), self.timeout)
+            except Exception:
+                self.failures.inc()
+                self.breaker.record_failure()
+                raise
+        self.breaker.record_success()
+        return result
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+
+    def stats(self):
+        return {
+            "requests": self.requests.value,
+            "failures": self.failures.value,
+            "rejected": self.rejected.value,
+            "in_flight": self.in_flight,
+            "circuit": self.breaker.state,
+        }
+
+
+_clients = {}
+
+
+def get_client(name) -> ProviderClient:
+    if name not in _clients:
+        timeout, concurrency, retries = PROVIDER_DEFAULTS.get(name, (10.0, 10, 2))
+        prefix = f"HTTP_{name.upper()}_"
+        _clients[name] = ProviderClient(
+            name,
+            timeout=float(os.getenv(prefix + "TIMEOUT", timeout)),
+            max_concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+            retries=int(os.getenv(prefix + "RETRIES", retries)),
+        )
+    return _clients[name]
+
+
+async def close_all():
+    for client in _clients.values():
+        await client.aclose()
@@ -0,0 +1,320 @@
+# lane_stats.py
+"""Per-lane delivery statistics for ETA serving.
+
+A lane is a (pickup_location, destination_location) pair, compared
+case-insensitively. The lane_stats table holds one row per lane with
+traffic_level = time_of_day = "*" (all deliveries on the lane) plus one row
+per (traffic_level, time_of_day) seen on it. Each row has the row count,
+median actual ETA, duration and distance, and the median ETA-to-duration
+ratio.
+
+Refreshes are incremental: only lanes with delivery_logs rows past the
+table's watermark (max last_log_id, the largest delivery_logs id when the
+lane was last written) are recomputed. The watermark is an id,
+not created_at, so backdated bulk rows are seen, and the last
+LANE_REFRESH_ID_OVERLAP ids are looked at again because ids can commit out
+of order. Recomputing a lane is idempotent, so the overlap costs only time.
+Medians can't be merged, so each changed lane is recomputed from its own
+rows, LANE_CHUNK lanes at a time with the aggregation in a worker thread, so
+neither a full rebuild nor a large refresh holds every row in memory or
+blocks the event loop.
+
+History that never went through delivery_logs (e.g. years of
+delivery_data.csv) is imported into lane_history with --csv and included
+every time a lane is recomputed, so incremental refreshes add new logs to
+the seeded history instead of replacing it.
+
+At serving time `LaneIndex` holds the table in a dict, so lookups are O(1).
+
+    python refresh_lane_stats.py                          # incremental, from delivery_logs
+    python refresh_lane_stats.py --full                   # recompute every lane
+    python refresh_lane_stats.py --csv delivery_data.csv  # import history, then rebuild
+"""
+import asyncio
+import csv
+import os
+import traceback
+from collections import defaultdict
+from datetime import datetime
+from statistics import median
+
+from sqlalchemy import Column, Index, Integer, String, Text, Float, TIMESTAMP, UniqueConstraint, cast, delete, func, insert, null, select, tuple_, union_all
+
+import metrics
+from database import Base, async_session
+
+ALL = "*"
+LANE_MIN_ROWS = int(os.getenv("LANE_MIN_ROWS", "3"))  # per-condition rows needed before they're used
+LANE_RELOAD_SECONDS = float(os.getenv("LANE_STATS_RELOAD_SECONDS", "300"))
+LANE_REFRESH_ID_OVERLAP = int(os.getenv("LANE_REFRESH_ID_OVERLAP", "10000"))
+LANE_CHUNK = 500
+
+
+class LaneStat(Base):
+    __tablename__ = "lane_stats"
+    __table_args__ = (UniqueConstraint("pickup_location", "destination_location", "traffic_level", "time_of_day"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    pickup_location = Column(Text, nullable=False)
+    destination_location = Column(Text, nullable=False)
+    traffic_level = Column(String, nullable=False, default=ALL)
+    time_of_day = Column(String, nullable=False, default=ALL)
+    n = Column(Integer, nullable=False)
+    median_eta_min = Column(Float)
+    median_duration_min = Column(Float)
+    median_distance_km = Column(Float)
+    eta_duration_ratio = Column(Float)
+    last_log_at = Column(TIMESTAMP, nullable=True)
+    last_log_id = Column(Integer, nullable=True)  # refresh watermark
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+
+class LaneHistory(Base):
+    """Deliveries imported from CSV; lane keys are stored normalized."""
+    __tablename__ = "lane_history"
+    __table_args__ = (Index("ix_lane_history_lane", "pickup_location", "destination_location"),)
+
+    id = Column(Integer, primary_key=True)
+    pickup_location = Column(Text, nullable=False)
+    destination_location = Column(Text, nullable=False)
+    distance_km = Column(Float)
+    duration_min = Column(Float)
+    actual_eta_min = Column(Float)
+    traffic_level = Column(String)
+    time_of_day = Column(String)
+    created_at = Column(TIMESTAMP, nullable=True)
+
+
+def normalize(value):
+    # Same as lower(trim(x)) in SQL, which selects the lanes to refresh
+    return str(value or "").strip().lower()
+
+
+# --- Aggregation ---
+def _summary(rows):
+    ratios = [r["actual_eta_min"] / r["duration_min"] for r in rows if r["duration_min"]]
+    return {
+        "n": len(rows),
+        "median_eta_min": median(r["actual_eta_min"] for r in rows),
+        "median_duration_min": median(r["duration_min"] for r in rows),
+        "median_distance_km": median(r["distance_km"] for r in rows),
+        "eta_duration_ratio": median(ratios) if ratios else None,
+        "last_log_at": max((r["created_at"] for r in rows if r.get("created_at")), default=None),
+        "last_log_id": max((r["id"] for r in rows if r.get("id")), default=None),
+    }
+
+
+def compute_lane_stats(rows):
+    """rows: dicts of delivery_logs columns -> lane_stats row dicts."""
+    lanes = defaultdict(list)
+    for r in rows:
+        if r["actual_eta_min"] is None or r["duration_min"] is None or r["distance_km"] is None:
+            continue
+        lanes[(normalize(r["pickup_location"]), normalize(r["destination_location"]))].append(r)
+
+    now = datetime.utcnow()
+    out = []
+    for (pickup, destination), lane_rows in lanes.items():
+        groups = defaultdict(list)
+        for r in lane_rows:
+            groups[(normalize(r["traffic_level"]), normalize(r["time_of_day"]))].append(r)
+        groups[(ALL, ALL)] = lane_rows
+        for (traffic, tod), group in groups.items():
+            out.append(dict(
+                _summary(group), pickup_location=pickup, destination_location=destination,
+                traffic_level=traffic, time_of_day=tod, updated_at=now,
+            ))
+    return out
+
+
+async def _replace_lanes(db, lanes, stats):
+    lanes = list(lanes)
+    for i in range(0, len(lanes), LANE_CHUNK):
+        await db.execute(delete(LaneStat).where(
+            tuple_(LaneStat.pickup_location, LaneStat.destination_location).in_(lanes[i:i + LANE_CHUNK])
+        ))
+    for i in range(0, len(stats), LANE_CHUNK):
+        await db.execute(insert(LaneStat), stats[i:i + LANE_CHUNK])
+
+
+# --- Refresh ---
+def _lane_rows_query(log_table, lanes=None):
+    """delivery_logs plus lane_history rows with normalized lane keys, ordered
+    by lane so they can be aggregated one group of lanes at a time."""
+    c, h = log_table.c, LaneHistory.__table__.c
+    log_keys = (func.lower(func.trim(c.pickup_location)), func.lower(func.trim(c.destination_location)))
+    history_keys = (h.pickup_location, h.destination_location)  # stored normalized
+    parts = []
+    for t, keys, id_col in ((c, log_keys, c.id), (h, history_keys, cast(null(), Integer))):
+        query = select(
+            keys[0].label("pickup_location"), keys[1].label("destination_location"),
+            t.distance_km, t.duration_min, t.actual_eta_min, t.traffic_level, t.time_of_day,
+            t.created_at, id_col.label("id"),
+        )
+        if lanes is not None:
+            query = query.where(tuple_(*keys).in_(lanes))
+        parts.append(query)
+    rows = union_all(*parts).subquery()
+    return select(rows).order_by(rows.c.pickup_location, rows.c.destination_location)
+
+
+async def _write_lanes(db, rows, lanes, watermark):
+    """Aggregate one batch of lanes off the event loop and replace their rows.
+    `lanes` are deleted first (None: the caller already cleared the table)."""
+    stats = await asyncio.to_thread(compute_lane_stats, rows)
+    for s in stats:
+        # Every written row carries the refresh watermark, so it is stored
+        # even when a lane's rows all came from lane_history
+        s["last_log_id"] = max(s["last_log_id"] or 0, watermark)
+    await _replace_lanes(db, lanes or [], stats)
+    return len({(s["pickup_location"], s["destination_location"]) for s in stats})
+
+
+async def refresh_from_logs(log_table, full=False):
+    """Recompute lanes with delivery_logs rows past the watermark (every lane
+    when full), LANE_CHUNK lanes at a time. Returns the number of lanes rewritten."""
+    c = log_table.c
+    pickup_key = func.lower(func.trim(c.pickup_location))
+    destination_key = func.lower(func.trim(c.destination_location))
+
+    async with async_session() as db, async_session() as reader:
+        # Taken before reading any rows; later ids are picked up next time
+        watermark = (await db.execute(select(func.max(c.id)))).scalar() or 0
+        written = 0
+        if full:
+            await db.execute(delete(LaneStat))
+            # One ordered pass over both tables, cut into batches at lane boundaries
+            result = await reader.stream(_lane_rows_query(log_table).execution_options(yield_per=5000))
+            rows, lane, n_lanes = [], None, 0
+            async for r in result:
+                key = (r.pickup_location, r.destination_location)
+                if key != lane:
+                    if n_lanes >= LANE_CHUNK:
+                        written += await _write_lanes(db, rows, None, watermark)
+                        rows, n_lanes = [], 0
+                    lane, n_lanes = key, n_lanes + 1
+                rows.append(dict(r._mapping))
+            if rows:
+                written += await _write_lanes(db, rows, None, watermark)
+        else:
+            last = (await db.execute(select(func.max(LaneStat.last_log_id)))).scalar()
+            query = select(pickup_key, destination_key).distinct()
+            if last is not None:
+                query = query.where(c.id > last - LANE_REFRESH_ID_OVERLAP)
+            changed = [tuple(row) for row in (await db.execute(query)).all()]
+            if not changed:
+                return 0
+            for i in range(0, len(changed), LANE_CHUNK):
+                chunk = changed[i:i + LANE_CHUNK]
+                rows = [dict(r._mapping) for r in await reader.execute(_lane_rows_query(log_table, chunk))]
+                written += await _write_lanes(db, rows, chunk, watermark)
+        await db.commit()
+        return written
+
+
+async def rebuild_from_csv(path, log_table):
+    """Replace lane_history with the CSV's rows, then recompute every lane
+    from history plus delivery_logs. Returns the number of lanes."""
+    async with async_session() as db:
+        await db.execute(delete(LaneHistory))
+        with open(path, newline="") as f:
+            batch = []
+            for r in csv.DictReader(f):
+                batch.append({
+                    "pickup_location": normalize(r["pickup_location"]),
+                    "destination_location": normalize(r["destination_location"]),
+                    "distance_km": float(r["distance_km"]),
+                    "duration_min": float(r["duration_min"]),
+                    "actual_eta_min": float(r["actual_eta_min"]),
+                    "traffic_level": r["traffic_level"],
+                    "time_of_day": r["time_of_day"],
+                    "created_at": datetime.fromisoformat(r["created_at"]) if r.get("created_at") else None,
+                })
+                if len(batch) >= 5000:
+                    await db.execute(insert(LaneHistory), batch)
+                    batch = []
+            if batch:
+                await db.execute(insert(LaneHistory), batch)
+        await db.commit()
+    return await refresh_from_logs(log_table, full=True)
+
+
+# --- Serving side ---
+class LaneIndex:
+    """In-memory copy of lane_stats: (pickup, destination) -> {(traffic, tod): stats}."""
+
+    def __init__(self):
+        self._lanes = {}
+        self.loaded_at = None
+        self._task = None
+        metrics.register("lane_stats", self.stats)
+
+    async def load(self):
+        lanes = defaultdict(dict)
+        async with async_session() as db:
+            result = await db.stream(select(LaneStat).execution_options(yield_per=5000))
+            async for stat in result.scalars():
+                lanes[(stat.pickup_location, stat.destination_location)][(stat.traffic_level, stat.time_of_day)] = {
+                    "n": stat.n,
+                    "median_eta_min": stat.median_eta_min,
+                    "median_duration_min": stat.median_duration_min,
+                    "median_distance_km": stat.median_distance_km,
+                    "eta_duration_ratio": stat.eta_duration_ratio,
+                }
+        # Swap the whole dict so readers never see a half-built index
+        self._lanes = dict(lanes)
+        self.loaded_at = datetime.utcnow()
+        return len(self._lanes)
+
+    def lookup(self, pickup, destination):
+        """Lane-wide stats, or None for an unknown lane."""
+        lane = self._lanes.get((normalize(pickup), normalize(destination)))
+        return lane.get((ALL, ALL)) if lane else None
+
+    def estimate(self, pickup, destination, traffic_level=None, time_of_day=None):
+        """Lane-based ETA in minutes, or None for an unknown lane.
+
+        The lane median is scaled by how much slower or faster deliveries
+        run under these conditions, when there are enough of them."""
+        lane = self._lanes.get((normalize(pickup), normalize(destination)))
+        if not lane:
+            return None
+        overall = lane[(ALL, ALL)]
+        condition = lane.get((normalize(traffic_level), normalize(time_of_day)))
+        if (condition and condition["n"] >= LANE_MIN_ROWS
+                and condition["eta_duration_ratio"] and overall["eta_duration_ratio"]):
+            return overall["median_eta_min"] * condition["eta_duration_ratio"] / overall["eta_duration_ratio"]
+        return overall["median_eta_min"]
+
+    async def _watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception:
+                traceback.print_exc()
+
+    async def start(self, interval=LANE_RELOAD_SECONDS):
+        try:
+            print(f"🛣️ Loaded stats for {await self.load()} lanes")
+        except Exception:
+            # Serving works without lane stats; retry on the next reload
+            traceback.print_exc()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"lanes": len(self._lanes), "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None}
+
+
+lane_index = LaneIndex()
+
@@ -1,61 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Query
+from fastapi import FastAPI, HTTPException, Depends, status, Query, Response, Request, Path
+from fastapi.responses import StreamingResponse
+import json, hashlib
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime, timedelta
-import os, requests, traceback
+import os, httpx, traceback
+from urllib.parse import quote
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, desc
-from sqlalchemy.orm import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, desc, func, insert
+from sqlalchemy.orm import deferred
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import sessionmaker
 from difflib import SequenceMatcher
 from dotenv import load_dotenv
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from io import BytesIO
 from fastapi import FastAPI
 import traceback
-from sqlalchemy import Column, Integer, Float, String, Text, ForeignKey, select, desc
+from sqlalchemy import Column, Integer, Float, String, Text, ForeignKey, select, desc, TIMESTAMP
 
 load_dotenv()
 
-from email.message import EmailMessage
-import aiosmtplib
+from email_outbox import outbox, EmailOutbox, register_attachment_builder
 
 async def send_email_with_attachment(to_email: str, subject: str, body: str, file_path: str):
-    try:
-        message = EmailMessage()
-        message["From"] = os.getenv("SMTP_USERNAME")
-        message["To"] = to_email
-        message["Subject"] = subject
-        message.set_content(body)
-
-        with open(file_path, "rb") as f:
-            file_data = f.read()
-            message.add_attachment(
-                file_data,
-                maintype="application",
-                subtype="pdf",
-                filename=os.path.basename(file_path)
-            )
-
-        print("📨 Sending email...")
-        await aiosmtplib.send(
-            message,
-            hostname=os.getenv("SMTP_HOST"),
-            port=int(os.getenv("SMTP_PORT")),
-            start_tls=True,
-            username=os.getenv("SMTP_USERNAME"),
-            password=os.getenv("SMTP_PASSWORD"),
-        )
-        print("✅ Email sent")
-    except Exception as e:
-        print("❌ Failed to send email:", str(e))
-        raise
+    """Queue an email with a PDF attachment; returns the outbox job id."""
+    with open(file_path, "rb") as f:
+        file_data = f.read()
+    job_id = await outbox.enqueue(
+        recipient=to_email,
+        subject=subject,
+        body=body,
+        attachment_name=os.path.basename(file_path),
+        attachment=file_data,
+    )
+    print("📨 Email queued:", job_id)
+    return job_id
 
 # --- Load environment variables ---
 OPENCAGE_TOKEN = os.getenv("OPENCAGE_API_KEY", "your_opencage_key")
@@ -63,7 +43,6 @@ MAPBOX_TOKEN = os.getenv("MAPBOX_TOKEN", "your_mapbox_token")
 SECRET_KEY = os.getenv("SECRET_KEY", "secret123")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
 
 # --- App init ---
 app = FastAPI()
@@ -73,22 +52,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 from chat_gemini import router as chat_router
 app.include_router(chat_router)
 
 # --- Auth setup ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs on a bounded thread pool (password_pool.py), never on the loop
+from password_pool import password_hasher, PasswordPoolBusy
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- DB setup ---
-Base = declarative_base()
-engine = create_async_engine(DATABASE_URL, echo=True)
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-
-async def get_db():
-    async with async_session() as session:
-        yield session
+from database import Base, engine, async_session, get_db
+from geocode_cache import geocode_cache
+from http_client import get_client, close_all as close_http_clients
+import routing_utils, route_solver, distance_matrix, vrp_solver, time
+from blob_store import blob_store, decode_data_url, sniff_content_type
+from pdf_renderer import pdf_renderer
+import delivery_ingest
+from auth_cache import AuthUser, auth_cache
+import numpy as np
 
 # --- Models ---
 class UserModel(Base):
@@ -98,6 +81,8 @@ class UserModel(Base):
     full_name = Column(String)
     hashed_password = Column(String, nullable=False)
     role = Column(String, nullable=False, default="customer")
+    # Bumped to revoke every token issued so far (role change, forced logout)
+    token_version = Column(Integer, nullable=False, default=0)
 
 class RouteHistory(Base):
     __tablename__ = "route_history"
@@ -107,8 +92,28 @@ class RouteHistory(Base):
     distance_km = Column(Float)
     duration_min = Column(Float)
     route = Column(String)
-    map_image_base64 = Column(Text)
-    summary_image_base64 = Column(Text, nullable=True)
+    # Legacy inline data URLs; new rows store images in blob_store instead
+    # (see migrate_blobs.py). Deferred so ordinary selects never read them.
+    map_image_base64 = deferred(Column(Text))
+    summary_image_base64 = deferred(Column(Text, nullable=True))
+    map_image_key = Column(String(64), nullable=True)
+    summary_image_key = Column(String(64), nullable=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+# /history reads one user's routes newest first
+Index("ix_route_history_user_id_id", RouteHistory.user_id, RouteHistory.id.desc())
+
+class RouteStop(Base):
+    """One stop of a saved route, in visiting order. RouteHistory.route keeps
+    the joined display label for /history; code that needs stops reads these."""
+    __tablename__ = "route_stops"
+    route_id = Column(Integer, ForeignKey("route_history.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    address = Column(Text, nullable=False, index=True)
+    lat = Column(Float, nullable=True)
+    lng = Column(Float, nullable=True)
+
+ROUTE_LABEL_SEPARATOR = " ➡️ "
 
 
 class RouteCreate(BaseModel):
@@ -117,6 +122,15 @@ class RouteCreate(BaseModel):
     duration_min: float
     route: list[str]
 
+class RouteStopIn(BaseModel):
+    address: str
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+# Routes are posted as addresses, or as {address, lat, lng} when the client
+# geocoded them
+RouteStops = List[Union[str, RouteStopIn]]
+
 # --- Schemas ---
 class Token(BaseModel):
     access_token: str
@@ -149,27 +163,35 @@ class RouteSaveRequest(BaseModel):
     name: str
     distance_km: float
     duration_min: float
-    route: List[str]
+    route: RouteStops
 
 class RouteEmailRequest(BaseModel):
     name: str
     distance_km: float
     duration_min: float
-    route: list[str]
+    route: RouteStops
     recipient_email: str
     map_image_base64: str
     summary_image_base64: str 
 
-from sqlalchemy import Column, Integer, Float, String, Text, TIMESTAMP, ARRAY
+from sqlalchemy import Column, Integer, Float, String, Text, TIMESTAMP, JSON, event
 from datetime import datetime
 
+def _count_stops(context):
+    return len(context.get_current_parameters().get("stops") or [])
+
 class DeliveryLog(Base):
     __tablename__ = "delivery_logs"
 
     id = Column(Integer, primary_key=True, index=True)
     pickup_location = Column(Text)
     destination_location = Column(Text)
-    stops = Column(ARRAY(Text))
+    # JSON list of stop names; num_stops is kept in step with it (column
+    # default on insert, the "set" listener below on ORM updates) so training
+    # and analytics can count stops without reading the list. Core UPDATEs
+    # that change stops must set num_stops as well.
+    stops = Column(JSON(none_as_null=True))
+    num_stops = Column(Integer, nullable=False, server_default="0", default=_count_stops)
     distance_km = Column(Float)
     duration_min = Column(Float)
     actual_eta_min = Column(Float)
@@ -177,11 +199,20 @@ class DeliveryLog(Base):
     time_of_day = Column(String)
     traffic_level = Column(String)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
-from sqlalchemy.orm import Session
-from datetime import datetime
 
-def log_delivery(
-    db: Session,
+@event.listens_for(DeliveryLog.stops, "set")
+def _sync_num_stops(target, value, oldvalue, initiator):
+    target.num_stops = len(value or [])
+
+# eta_train.py --since <timestamp> reads WHERE created_at > ? ORDER BY created_at, id
+Index("ix_delivery_logs_created_at", DeliveryLog.created_at, DeliveryLog.id)
+
+from delivery_recorder import DeliveryRecorder, RecorderFullError
+
+# Deliveries are buffered and written in multi-row batches in the background
+delivery_recorder = DeliveryRecorder(DeliveryLog.__table__)
+
+async def log_delivery(
     pickup_location: str,
     destination_location: str,
     stops: list,
@@ -192,7 +223,7 @@ def log_delivery(
     time_of_day: str = "day",
     traffic_level: str = "moderate"
 ):
-    delivery = DeliveryLog(
+    await delivery_recorder.record(
         pickup_location=pickup_location,
         destination_location=destination_location,
         stops=stops,
@@ -204,48 +235,211 @@ def log_delivery(
         traffic_level=traffic_level,
         created_at=datetime.utcnow()
     )
-    db.add(delivery)
-    db.commit()
-    db.refresh(delivery)
-    return delivery
-import joblib
-from pydantic import BaseModel
-
-# Load trained model
+import asyncio
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict
+from eta_batching import MicroBatcher
+from eta_compiled import CompiledETAModel
+from model_registry import ActiveModel
+import model_registry
+import metrics
+import lane_stats
+from lane_stats import lane_index
+from eta_cache import eta_cache
+
+# Load trained model: the version promoted in the model registry, else the
+# files written by model_train.py / train_eta_model.py: the memory-mapped
+# compiled export (needs neither pandas nor sklearn) unless the pickled
+# pipeline is newer
 MODEL_PATH = "eta_model.pkl"
-model = joblib.load(MODEL_PATH)
+COMPILED_MODEL_PATH = os.getenv("ETA_COMPILED_PATH", "eta_model_compiled")
+eta_models = ActiveModel(fallback_compiled=COMPILED_MODEL_PATH, fallback_pickle=MODEL_PATH)
+eta_models.load()
+
+# Feature order used by model_train.py
+ETA_FEATURES = ["distance_km", "num_stops", "weather", "time_of_day", "traffic_level"]
+MAX_ETA_BATCH = int(os.getenv("MAX_ETA_BATCH", "10000"))
 
 # Define input schema
 class ETAPredictRequest(BaseModel):
-    distance_km: float
+    distance_km: Optional[float] = None  # may be filled in from lane stats
     num_stops: int
     weather: str
     time_of_day: str
     traffic_level: str
+    pickup_location: Optional[str] = None
+    destination_location: Optional[str] = None
+
+class ETAPredictBatchRequest(BaseModel):
+    # Either a list of row objects or a dict of equal-length column arrays
+    rows: Optional[List[Dict[str, Any]]] = None
+    columns: Optional[Dict[str, List[Any]]] = None
+
+def predict_eta_rows(rows: List[ETAPredictRequest]):
+    """Run the ETA pipeline once over all rows.
+    Returns (model_version, predictions in row order)."""
+    # One read of the pair, so a hot swap mid-batch can't mix versions
+    version, model = eta_models.current
+    if model is None:
+        raise RuntimeError("ETA model not loaded")
+    if isinstance(model, CompiledETAModel):
+        return version, model.predict(rows, ETA_FEATURES)
+    import pandas as pd
+    input_df = pd.DataFrame(
+        {f: [getattr(r, f) for r in rows] for f in ETA_FEATURES},
+        columns=ETA_FEATURES,
+    )
+    return version, model.predict(input_df)
+
+def enrich_eta_request(data: ETAPredictRequest):
+    """Look up the request's lane (O(1), in memory) and fill a missing
+    distance_km with the lane median. Returns the lane stats or None."""
+    if not (data.pickup_location and data.destination_location):
+        return None
+    lane = lane_index.lookup(data.pickup_location, data.destination_location)
+    if lane and data.distance_km is None:
+        data.distance_km = lane["median_distance_km"]
+    return lane
+
+def lane_fallback_eta(data: ETAPredictRequest):
+    """Lane-based ETA for when the model can't answer, or None."""
+    if not (data.pickup_location and data.destination_location):
+        return None
+    return lane_index.estimate(data.pickup_location, data.destination_location, data.traffic_level, data.time_of_day)
+
+def _lane_summary(lane):
+    return {"deliveries": lane["n"], "median_eta_min": lane["median_eta_min"]}
+
+def _predict_eta_tagged(rows: List[ETAPredictRequest]):
+    version, predictions = predict_eta_rows(rows)
+    return [(prediction, version) for prediction in predictions]
+
+# Concurrent /predict_eta calls share one model.predict in a worker thread
+eta_batcher = MicroBatcher(_predict_eta_tagged)
 
 @app.post("/predict_eta")
 async def predict_eta(data: ETAPredictRequest):
+    lane = enrich_eta_request(data)
+    if data.distance_km is None:
+        raise HTTPException(status_code=422, detail="distance_km is required for lanes without stats")
+    row = eta_cache.quantize(data)
+    version = eta_models.current[0]
+    prediction = eta_cache.get(version, row)
     try:
-        # Match features as used during training
-        df = {
-            "distance_km": [data.distance_km],
-            "num_stops": [data.num_stops],
-            "weather": [data.weather],
-            "time_of_day": [data.time_of_day],
-            "traffic_level": [data.traffic_level]
-        }
-
-        import pandas as pd
-        input_df = pd.DataFrame(df)
-        prediction = model.predict(input_df)[0]
-        return {"predicted_eta_min": round(prediction, 2)}
+        if prediction is None:
+            prediction, version = await eta_batcher.submit(row)
+            eta_cache.put(version, row, prediction)
+        result = {"predicted_eta_min": round(prediction, 2), "model_version": version}
     except Exception as e:
-        return {"error": str(e)}
+        fallback = lane_fallback_eta(data)
+        if fallback is None:
+            return {"error": str(e)}
+        print("⚠️ ETA model failed, answering from lane stats:", e)
+        result = {"predicted_eta_min": round(fallback, 2), "model_version": None, "source": "lane_stats"}
+    if lane:
+        result["lane"] = _lane_summary(lane)
+    return result
+
+@app.post("/predict_eta_batch")
+async def predict_eta_batch(data: ETAPredictBatchRequest):
+    if data.rows is not None and data.columns is not None:
+        raise HTTPException(status_code=400, detail="Send either 'rows' or 'columns', not both")
+
+    if data.columns is not None:
+        lengths = {len(v) for v in data.columns.values()}
+        if len(lengths) > 1:
+            raise HTTPException(status_code=400, detail="All columns must have the same length")
+        n = lengths.pop() if lengths else 0
+        raw_rows = [{k: v[i] for k, v in data.columns.items()} for i in range(n)]
+    else:
+        raw_rows = data.rows or []
+
+    if len(raw_rows) > MAX_ETA_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_ETA_BATCH} rows)")
+
+    # Rows may give origin/destination [lng, lat] instead of distance_km
+    need_distance = [
+        i for i, raw in enumerate(raw_rows)
+        if isinstance(raw, dict) and raw.get("distance_km") is None
+        and raw.get("origin") and raw.get("destination")
+    ]
+    if need_distance:
+        try:
+            distances, _ = await distance_matrix.get_pairs(
+                [raw_rows[i]["origin"] for i in need_distance],
+                [raw_rows[i]["destination"] for i in need_distance],
+            )
+            for i, d in zip(need_distance, distances):
+                raw_rows[i] = dict(raw_rows[i], distance_km=round(float(d), 3))
+        except (TypeError, ValueError, IndexError) as e:
+            # Leave distance_km unset; those rows report a validation error below
+            print("⚠️ Could not compute batch distances:", e)
+
+    # Validate each row on its own so one bad row doesn't reject the whole batch
+    results: List[Dict[str, Any]] = [None] * len(raw_rows)
+    valid_idx, valid_rows = [], []
+    lanes = {}
+    for i, raw in enumerate(raw_rows):
+        try:
+            row = ETAPredictRequest(**raw)
+        except (ValidationError, TypeError) as e:
+            results[i] = {"error": str(e)}
+            continue
+        lane = enrich_eta_request(row)
+        if lane:
+            lanes[i] = lane
+        if row.distance_km is None:
+            results[i] = {"error": "distance_km is required for lanes without stats"}
+            continue
+        valid_rows.append(row)
+        valid_idx.append(i)
+
+    # Only cache misses reach the model. Each row reports the model version
+    # that answered it: a hot swap between the cache lookup and the model
+    # call can leave hits and misses on different versions.
+    lookup_version = eta_models.current[0]
+    version = None
+    miss_idx, misses, miss_rows = [], [], []
+    for i, row in zip(valid_idx, valid_rows):
+        quantized = eta_cache.quantize(row)
+        cached = eta_cache.get(lookup_version, quantized)
+        if cached is None:
+            miss_idx.append(i)
+            misses.append(quantized)
+            miss_rows.append(row)
+        else:
+            version = lookup_version
+            results[i] = {"predicted_eta_min": round(cached, 2), "model_version": lookup_version}
+
+    if misses:
+        try:
+            miss_version, predictions = await asyncio.to_thread(predict_eta_rows, misses)
+            for i, row, prediction in zip(miss_idx, misses, predictions):
+                eta_cache.put(miss_version, row, prediction)
+                results[i] = {"predicted_eta_min": round(float(prediction), 2), "model_version": miss_version}
+            version = version or miss_version
+        except Exception as e:
+            for i, row in zip(miss_idx, miss_rows):
+                fallback = lane_fallback_eta(row)
+                results[i] = ({"error": str(e)} if fallback is None
+                              else {"predicted_eta_min": round(fallback, 2), "model_version": None,
+                                    "source": "lane_stats"})
+    for i, lane in lanes.items():
+        results[i]["lane"] = _lane_summary(lane)
+
+    # Top-level version: the one cache hits were served under, else the
+    # model's that answered the misses, else None (no row from the model)
+    return {"results": results, "count": len(results), "model_version": version}
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
 
 
 # --- Auth Logic ---
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
+def _password_pool_busy():
+    return HTTPException(status_code=503, detail="Too many logins right now, try again shortly",
+                         headers={"Retry-After": "1"})
 
 async def get_user(username: str, db: AsyncSession):
     result = await db.execute(select(UserModel).where(UserModel.username == username))
@@ -253,8 +447,15 @@ async def get_user(username: str, db: AsyncSession):
 
 async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user(username, db)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return False
+    ok, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not ok:
         return False
+    if new_hash:
+        # Stored with an old work factor; upgrade while we have the password
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -263,7 +464,14 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+def create_user_token(user: UserModel):
+    # Role and id ride in the token; ver lets a token_version bump revoke it
+    return create_access_token(
+        data={"sub": user.username, "role": user.role, "uid": user.id, "ver": user.token_version or 0},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
@@ -274,31 +482,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = await get_user(token_data.username, db)
-    if user is None:
+    # Tokens issued before "ver" existed count as version 0
+    key = (token_data.username, payload.get("ver", 0))
+    user = auth_cache.get(key)
+    if user is not None:
+        return user
+
+    async with async_session() as db:
+        db_user = await get_user(token_data.username, db)
+    if db_user is None:
         raise HTTPException(status_code=401, detail="User not found")
+    if (db_user.token_version or 0) != key[1]:
+        raise HTTPException(status_code=401, detail="Token revoked")
+    user = AuthUser(
+        id=db_user.id, username=db_user.username, role=db_user.role,
+        full_name=db_user.full_name, token_version=db_user.token_version or 0,
+    )
+    auth_cache.put(key, user)
     return user
 
-# --- Role-Based Access Control ---
-async def get_current_user_role(required_roles: list[str]):
-    async def role_checker(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            username = payload.get("sub")
-            role = payload.get("role")
-            if username is None or role is None:
-                raise HTTPException(status_code=403, detail="Invalid token or role")
-            if role not in required_roles:
-                raise HTTPException(status_code=403, detail="Access denied for this role")
-        except JWTError:
-            raise HTTPException(status_code=403, detail="Could not validate token")
-
-        user = await get_user(username, db)
-        if user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user
-
-    return role_checker
+async def revoke_user_tokens(db: AsyncSession, user: UserModel):
+    """Invalidate all of the user's tokens. The caller commits and only then
+    calls auth_cache.invalidate(user.username): dropping the cache entry
+    earlier lets a concurrent miss re-cache the old, uncommitted row."""
+    user.token_version = (user.token_version or 0) + 1
 
 
 # --- Auth Routes ---
@@ -309,7 +516,10 @@ async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
 
-    hashed_password = pwd_context.hash(user.password)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
     new_user = UserModel(
         username=user.username,
         full_name=user.full_name,
@@ -320,32 +530,29 @@ async def signup(user: UserCreate, db: AsyncSession = Depends(get_db)):
     await db.commit()
     await db.refresh(new_user)
 
-    access_token = create_access_token(
-        data={"sub": new_user.username, "role": new_user.role},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    access_token = create_user_token(new_user)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @app.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
-    user = await authenticate_user(db, form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(db, form_data.username, form_data.password)
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    access_token = create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/me", response_model=User)
-async def read_users_me(current_user: UserModel = Depends(get_current_user)):
+async def read_users_me(current_user: AuthUser = Depends(get_current_user)):
     return {"username": current_user.username, "full_name": current_user.full_name}
 
 # --- Role-based Access Dependency ---
 def get_current_user_role(roles: List[str]):
-    async def _get_user(user: UserModel = Depends(get_current_user)):
+    async def _get_user(user: AuthUser = Depends(get_current_user)):
         if user.role not in roles:
             raise HTTPException(status_code=403, detail="Access denied")
         return user
@@ -356,17 +563,66 @@ def get_current_user_role(roles: List[str]):
 # async def admin_dashboard(user: UserModel = Depends(get_current_user_role(["admin"]))):
 #     return {"msg": "Welcome admin"}
 
+class RoleUpdate(BaseModel):
+    role: str
+
+@app.put("/admin/users/{user_id}/role", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def update_user_role(user_id: int, data: RoleUpdate, db: AsyncSession = Depends(get_db)):
+    user = await db.get(UserModel, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user.role != data.role:
+        user.role = data.role
+        # Old tokens carry the old role; make the user log in again
+        await revoke_user_tokens(db, user)
+        await db.commit()
+        auth_cache.invalidate(user.username)
+    return {"id": user.id, "username": user.username, "role": user.role}
+
 # --- Add 'role' to TokenData if needed in future ---
 class TokenData(BaseModel):
     username: Optional[str] = None
     role: Optional[str] = None
 
 
+# --- Route stops ---
+def _stop_fields(stop):
+    if isinstance(stop, str):
+        return stop.strip(), None, None
+    return stop.address.strip(), stop.lat, stop.lng
+
+def route_label(stops: RouteStops) -> str:
+    return ROUTE_LABEL_SEPARATOR.join(_stop_fields(stop)[0] for stop in stops)
+
+async def add_route_with_stops(db: AsyncSession, route_entry: RouteHistory, stops: RouteStops):
+    """Add the route and insert its stops in one multi-row INSERT; the caller commits."""
+    db.add(route_entry)
+    await db.flush()
+    if stops:
+        await db.execute(insert(RouteStop.__table__), [
+            {"route_id": route_entry.id, "seq": seq, "address": address, "lat": lat, "lng": lng}
+            for seq, (address, lat, lng) in enumerate(map(_stop_fields, stops))
+        ])
+
+async def load_route_stops(db: AsyncSession, route_ids) -> Dict[int, List[str]]:
+    """Ordered stop addresses for each route id, in one query."""
+    stops = {route_id: [] for route_id in route_ids}
+    if not stops:
+        return stops
+    result = await db.execute(
+        select(RouteStop.route_id, RouteStop.address)
+        .where(RouteStop.route_id.in_(stops))
+        .order_by(RouteStop.route_id, RouteStop.seq)
+    )
+    for route_id, address in result:
+        stops[route_id].append(address)
+    return stops
+
 @app.post("/save_route")
-async def save_route(data: RouteSaveRequest, current_user: UserModel = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def save_route(data: RouteSaveRequest, current_user: AuthUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     try:
         print("➡️ Route save data received:", data)
-        route_str = " ➡️ ".join(data.route)
+        route_str = route_label(data.route)
         print("✅ Final route string:", route_str)
         route_entry = RouteHistory(
             user_id=current_user.id,
@@ -375,7 +631,7 @@ async def save_route(data: RouteSaveRequest, current_user: UserModel = Depends(g
             duration_min=data.duration_min,
             route=route_str
         )
-        db.add(route_entry)
+        await add_route_with_stops(db, route_entry, data.route)
         await db.commit()
         await db.refresh(route_entry)
         return {"status": "Route saved successfully", "id": route_entry.id}
@@ -384,226 +640,295 @@ async def save_route(data: RouteSaveRequest, current_user: UserModel = Depends(g
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail="Internal Server Error: Could not save route")
     
-@app.get("/admin/drivers", dependencies=[Depends(get_current_user_role(["admin"]))])
-async def get_all_driver_routes(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(UserModel.id, UserModel.username)
+def _driver_routes_query(driver_id=None, date_from=None, date_to=None):
+    # One joined query; only the listed columns, so the image blobs are never read
+    query = (
+        select(
+            RouteHistory.id,
+            RouteHistory.user_id,
+            UserModel.username,
+            RouteHistory.distance_km,
+            RouteHistory.duration_min,
+        )
+        .join(UserModel, UserModel.id == RouteHistory.user_id)
         .where(UserModel.role == "driver")
     )
-    drivers = result.fetchall()
+    if driver_id is not None:
+        query = query.where(RouteHistory.user_id == driver_id)
+    if date_from is not None:
+        query = query.where(RouteHistory.created_at >= date_from)
+    if date_to is not None:
+        query = query.where(RouteHistory.created_at < date_to)
+    return query
+
+def _driver_route_row(r, path):
+    return {
+        "route_id": r.id,
+        "driver_id": r.user_id,
+        "driver_name": r.username,
+        "path": path,
+        "distance_km": r.distance_km,
+        "duration_min": r.duration_min,
+    }
 
-    history = []
-    for driver_id, driver_name in drivers:
-        res = await db.execute(
-            select(RouteHistory).where(RouteHistory.user_id == driver_id)
+@app.get("/admin/drivers", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def get_all_driver_routes(
+    response: Response,
+    cursor: Optional[int] = Query(None, description="Return routes with id greater than this"),
+    limit: int = Query(500, ge=1, le=5000),
+    driver_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    query = _driver_routes_query(driver_id, date_from, date_to)
+    if cursor is not None:
+        query = query.where(RouteHistory.id > cursor)
+    query = query.order_by(RouteHistory.id)
+
+    if format == "ndjson":
+        # Export mode: stream every matching row from a server-side cursor,
+        # loading stops once per 1000-row partition on a second session
+        async def export():
+            async with async_session() as session, async_session() as stops_db:
+                result = await session.stream(query.execution_options(yield_per=1000))
+                async for rows in result.partitions():
+                    paths = await load_route_stops(stops_db, [r.id for r in rows])
+                    yield "".join(json.dumps(_driver_route_row(r, paths[r.id])) + "\n" for r in rows)
+
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    paths = await load_route_stops(db, [r.id for r in rows])
+    return [_driver_route_row(r, paths[r.id]) for r in rows]
+
+@app.get("/admin/routes/by_stop", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def get_routes_through_stop(
+    response: Response,
+    address: str = Query(..., min_length=1),
+    cursor: Optional[int] = Query(None, description="Return routes with id greater than this"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_db),
+):
+    # Exact address match, served by the route_stops address index
+    through = select(RouteStop.route_id).where(RouteStop.address == address.strip())
+    query = (
+        select(
+            RouteHistory.id,
+            RouteHistory.user_id,
+            UserModel.username,
+            RouteHistory.distance_km,
+            RouteHistory.duration_min,
         )
-        routes = res.scalars().all()
-        for r in routes:
-            history.append({
-                "route_id": r.id,
-                "driver_id": driver_id,
-                "driver_name": driver_name,
-                "path": r.route.split(" ➡️ ") if r.route else [],
-                "distance_km": r.distance_km,
-                "duration_min": r.duration_min,
-            })
-    return history
+        .join(UserModel, UserModel.id == RouteHistory.user_id)
+        .where(RouteHistory.id.in_(through))
+    )
+    if cursor is not None:
+        query = query.where(RouteHistory.id > cursor)
+    result = await db.execute(query.order_by(RouteHistory.id).limit(limit + 1))
+    rows = result.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    paths = await load_route_stops(db, [r.id for r in rows])
+    return [_driver_route_row(r, paths[r.id]) for r in rows]
+
+# --- ETA model registry ---
+@app.get("/admin/model", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def eta_model_info():
+    return {
+        **eta_models.info(),
+        "promoted": model_registry.current_version(),
+        "versions": [m for _, m in model_registry.list_versions()],
+    }
+
+@app.post("/admin/model/promote/{version}", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def promote_eta_model(version: str = Path(..., pattern=r"^v[0-9-]+$")):
+    try:
+        model_registry.promote(version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Swap this process now; other workers pick it up on their next poll
+    await eta_models.refresh()
+    return eta_models.info()
+
+@app.post("/admin/lane_stats/refresh", dependencies=[Depends(get_current_user_role(["admin"]))])
+async def refresh_lane_stats(full: bool = False):
+    lanes = await lane_stats.refresh_from_logs(DeliveryLog.__table__, full=full)
+    await lane_index.load()
+    return {"lanes_refreshed": lanes, **lane_index.stats()}
+
+# --- Delivery tracking ---
+@app.post("/delivery_logs", status_code=status.HTTP_202_ACCEPTED)
+async def record_delivery(data: delivery_ingest.DeliveryLogRow, current_user: AuthUser = Depends(get_current_user)):
+    try:
+        await log_delivery(**data.model_dump(exclude={"created_at"}))
+    except RecorderFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return {"status": "queued"}
+
+# --- Bulk delivery-log ingestion ---
+@app.post("/delivery_logs/bulk")
+async def bulk_ingest_delivery_logs(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="Defaults from Content-Type"),
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Body is consumed as a stream; rows are written chunk by chunk
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    report = await delivery_ingest.ingest(db, DeliveryLog.__table__, request.stream(), fmt)
+    print(f"📦 {current_user.username} ingested {report['inserted']}/{report['rows']} delivery logs "
+          f"({report['rows_per_sec']} rows/s)")
+    return report
 
 
 class EmailRequest(BaseModel):
     route_id: int
     recipient_email: str
 
-from reportlab.pdfgen import canvas
-import tempfile, uuid
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import os
-
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-
-def generate_pdf(route, summary_image_base64=None):
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.utils import ImageReader
-    from io import BytesIO
-    from PIL import Image
-    import base64
-    import traceback
-
-    pdf_path = "route_summary.pdf"
-    c = canvas.Canvas(pdf_path, pagesize=letter)
-    width, height = letter
-    y = height - 50
-
-    # --- Header ---
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, y, "📍 Route Report")
-    y -= 30
-
-    # --- Route Info ---
-    c.setFont("Helvetica", 12)
-    c.drawString(50, y, f"🆔 Route ID: {route.id}")
-    y -= 20
-    c.drawString(50, y, f"📝 Name: {route.name}")
-    y -= 20
-    c.drawString(50, y, f"📏 Distance: {route.distance_km:.2f} km")
-    y -= 20
-    c.drawString(50, y, f"⏱️ Duration: {route.duration_min:.2f} minutes")
-    y -= 30
-
-    # --- Route Path ---
-    c.setFont("Helvetica-Bold", 13)
-    c.drawString(50, y, "🛣️ Route Path:")
-    y -= 20
-    c.setFont("Helvetica", 12)
-    stops = route.route.split("➡")
-
-    for i, stop in enumerate(stops):
-        c.drawString(70, y, f"- Stop {i + 1}: {stop.strip()}")
-        y -= 20
-        if y < 100:
-            c.showPage()
-            y = height - 50
-            c.setFont("Helvetica", 12)
-
-    # --- Map Image ---
-    if route.map_image_base64:
+async def load_route_image(db: AsyncSession, route, kind: str):
+    """Image bytes for kind "map" or "summary", from the blob store or, for
+    rows not yet migrated, from the legacy base64 column. None if missing."""
+    key = getattr(route, f"{kind}_image_key")
+    if key:
         try:
-            c.showPage()
-            c.setFont("Helvetica-Bold", 14)
-            c.drawCentredString(width / 2, height - 40, "🗺 Optimized Route Map")
-
-            header, base64_img = route.map_image_base64.split(",", 1)
-            img_data = base64.b64decode(base64_img)
-            img_stream = BytesIO(img_data)
-            pil_image = Image.open(img_stream)
-
-            # ✅ Fix transparency
-            if pil_image.mode in ("RGBA", "P"):
-                pil_image = pil_image.convert("RGBA")
-                white_bg = Image.new("RGBA", pil_image.size, (255, 255, 255, 255))
-                pil_image = Image.alpha_composite(white_bg, pil_image)
-                pil_image = pil_image.convert("RGB")
-
-            pil_image.thumbnail((500, 350), Image.LANCZOS)
-            img_buf = BytesIO()
-            pil_image.save(img_buf, format="JPEG", quality=95)
-            img_buf.seek(0)
-
-            img_reader = ImageReader(img_buf)
-            img_w, img_h = pil_image.size
-            img_x = (width - img_w) // 2
-            img_y = (height - img_h) // 2
-            c.drawImage(img_reader, img_x, img_y, width=img_w, height=img_h)
-
-            print("✅ Map image embedded")
-        except Exception as e:
-            traceback.print_exc()
-            print("❌ Map image error:", e)
-
-    # --- Summary Screenshot ---
-    if summary_image_base64:
-        try:
-            c.showPage()
-            c.setFont("Helvetica-Bold", 14)
-            c.drawCentredString(width / 2, height - 40, "🧾 Summary Report")
-
-            header, base64_summary = summary_image_base64.split(",", 1)
-            summary_img_data = base64.b64decode(base64_summary)
-            summary_stream = BytesIO(summary_img_data)
-            summary_pil = Image.open(summary_stream)
-
-            # ✅ Handle transparency
-            if summary_pil.mode in ("RGBA", "P"):
-                summary_pil = summary_pil.convert("RGBA")
-                white_bg = Image.new("RGBA", summary_pil.size, (255, 255, 255, 255))
-                summary_pil = Image.alpha_composite(white_bg, summary_pil)
-                summary_pil = summary_pil.convert("RGB")
-
-            summary_pil.thumbnail((700, 600), Image.LANCZOS)  
-            summary_buf = BytesIO()
-            summary_pil.save(summary_buf, format="JPEG", quality=95)
-            summary_buf.seek(0)
-
-            summary_reader = ImageReader(summary_buf)
-            img_w, img_h = summary_pil.size
-            img_x = (width - img_w) // 2
-            img_y = (height - img_h) // 2
-            c.drawImage(summary_reader, img_x, img_y, width=img_w, height=img_h)
-
-            print("✅ Summary image embedded")
-        except Exception as e:
-            traceback.print_exc()
-            print("❌ Summary image error:", e)
-
-    # --- Footer ---
-    c.setFont("Helvetica-Oblique", 8)
-    c.drawString(50, 30, f"Generated • {__import__('datetime').datetime.now().strftime('%Y-%m-%d %I:%M %p')}")
-    c.save()
-    return pdf_path
-
-
-
-
+            return await asyncio.to_thread(blob_store.get, key)
+        except FileNotFoundError:
+            print(f"⚠️ Blob {key} for route {route.id} {kind} image is missing")
+            return None
+    legacy = await db.execute(
+        select(getattr(RouteHistory, f"{kind}_image_base64")).where(RouteHistory.id == route.id)
+    )
+    data_url = legacy.scalar_one_or_none()
+    return decode_data_url(data_url) if data_url else None
+
+@app.get("/routes/{route_id}/images/{kind}")
+async def get_route_image(
+    route_id: int,
+    request: Request,
+    kind: str = Path(..., pattern="^(map|summary)$"),
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(select(RouteHistory).where(RouteHistory.id == route_id))
+    route = result.scalar_one_or_none()
+    if not route or (route.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Route not found")
+
+    key = getattr(route, f"{kind}_image_key")
+    headers = {"Cache-Control": "private, max-age=31536000, immutable"}
+    if not key:
+        data = await load_route_image(db, route, kind)
+        if data is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        headers["ETag"] = f'"{hashlib.sha256(data).hexdigest()}"'
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        return Response(data, media_type=sniff_content_type(data[:12]), headers=headers)
+
+    # The blob key is the SHA-256 of the bytes, so it is a strong ETag
+    headers["ETag"] = f'"{key}"'
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    def chunks():
+        with blob_store.open(key) as f:
+            while chunk := f.read(64 * 1024):
+                yield chunk
 
+    try:
+        with blob_store.open(key) as f:
+            media_type = sniff_content_type(f.read(12))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return StreamingResponse(chunks(), media_type=media_type, headers=headers)
+
+async def render_route_report(db: AsyncSession, route) -> bytes:
+    # ✅ Generate PDF with map + summary (off the event loop, cached)
+    map_image = await load_route_image(db, route, "map")
+    summary_image = await load_route_image(db, route, "summary")
+    info = {
+        "id": route.id,
+        "name": route.name,
+        "distance_km": route.distance_km,
+        "duration_min": route.duration_min,
+    }
+    stops = (await load_route_stops(db, [route.id]))[route.id]
+    return await pdf_renderer.render(info, stops, map_image, summary_image, route.created_at)
 
+async def build_route_pdf_attachment(route_id: str) -> bytes:
+    """Outbox attachment builder: render the report when the email is sent."""
+    async with async_session() as db:
+        result = await db.execute(select(RouteHistory).where(RouteHistory.id == int(route_id)))
+        route = result.scalar_one_or_none()
+        if route is None:
+            raise ValueError(f"Route {route_id} no longer exists")
+        return await render_route_report(db, route)
 
+register_attachment_builder("route_pdf", build_route_pdf_attachment)
 
-@app.post("/email_route/")
+@app.post("/email_route/", status_code=status.HTTP_202_ACCEPTED)
 async def email_route_pdf(
     data: EmailRequest,
-    current_user: UserModel = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    try:
-        # Fetch route
-        result = await db.execute(
-            select(RouteHistory).where(
-                RouteHistory.id == data.route_id,
-                RouteHistory.user_id == current_user.id
-            )
+    # Fetch route
+    result = await db.execute(
+        select(RouteHistory.id, RouteHistory.name).where(
+            RouteHistory.id == data.route_id,
+            RouteHistory.user_id == current_user.id
         )
-        route = result.scalar_one_or_none()
-        if not route:
-            raise HTTPException(status_code=404, detail="Route not found")
-
-        # ✅ Generate PDF with map + summary
-        pdf_path = generate_pdf(route, summary_image_base64=route.summary_image_base64)
-
-        # Prepare Email
-        msg = EmailMessage()
-        msg["Subject"] = "📍 Smart Logistics Route"
-        msg["From"] = os.getenv("SMTP_USERNAME")
-        msg["To"] = data.recipient_email
-        msg.set_content(f"Hi, please find attached the optimized route for '{route.name}'.")
-
-        with open(pdf_path, "rb") as f:
-            msg.add_attachment(
-                f.read(),
-                maintype="application",
-                subtype="pdf",
-                filename="route_report.pdf"
-            )
+    )
+    route = result.first()
+    if not route:
+        raise HTTPException(status_code=404, detail="Route not found")
 
-        # Send Email
-        await aiosmtplib.send(
-            msg,
-            hostname=os.getenv("SMTP_HOST"),
-            port=int(os.getenv("SMTP_PORT")),
-            start_tls=True,
-            username=os.getenv("SMTP_USERNAME"),
-            password=os.getenv("SMTP_PASSWORD")
+    try:
+        # Queue the email; the outbox worker renders the PDF and sends it
+        job_id = await outbox.enqueue(
+            recipient=data.recipient_email,
+            subject="📍 Smart Logistics Route",
+            body=f"Hi, please find attached the optimized route for '{route.name}'.",
+            user_id=current_user.id,
+            attachment_name="route_report.pdf",
+            attachment_kind="route_pdf",
+            attachment_ref=route.id,
         )
-
-        return {"message": f"PDF sent to {data.recipient_email}"}
     except Exception:
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail="Failed to send email")
-
+        raise HTTPException(status_code=500, detail="Failed to queue email")
+    return {"message": f"PDF queued for {data.recipient_email}", "job_id": job_id, "status": "queued"}
 
+@app.get("/email_jobs/{job_id}")
+async def email_job_status(
+    job_id: int,
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    result = await db.execute(
+        select(
+            EmailOutbox.id, EmailOutbox.status, EmailOutbox.attempts, EmailOutbox.last_error,
+            EmailOutbox.created_at, EmailOutbox.sent_at,
+        ).where(EmailOutbox.id == job_id, EmailOutbox.user_id == current_user.id)
+    )
+    job = result.first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Email job not found")
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "created_at": job.created_at,
+        "sent_at": job.sent_at,
+    }
 
 
 # --- Suggest Locations ---
@@ -611,22 +936,215 @@ async def email_route_pdf(
 async def suggest_locations(query: str):
     if not query:
         raise HTTPException(status_code=400, detail="Query is required")
+    async def fetch():
+        url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{quote(query)}.json"
+        params = {"access_token": MAPBOX_TOKEN, "autocomplete": "true", "limit": 5, "country": "in"}
+        res = await get_client("mapbox").get(url, params=params)
+        res.raise_for_status()
+        return [f["place_name"] for f in res.json().get("features", [])] or None
+
     try:
-        url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{query}.json?access_token={MAPBOX_TOKEN}&autocomplete=true&limit=5&country=in"
-        res = requests.get(url).json()
-        return {"suggestions": [f["place_name"] for f in res.get("features", [])]}
+        suggestions = await geocode_cache.lookup("mapbox_suggest", query, fetch)
+        return {"suggestions": suggestions or []}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Suggest failed: {str(e)}")
 
+# --- Route Optimization ---
+OPTIMIZE_TIME_BUDGET_MS = int(os.getenv("OPTIMIZE_TIME_BUDGET_MS", "50"))
+OPTIMIZE_MAX_STOPS = int(os.getenv("OPTIMIZE_MAX_STOPS", "200"))
+
+@app.post("/optimize")
+async def optimize_route(
+    data: RouteRequest,
+    provider: str = Query("local", pattern="^(local|ors)$"),
+    time_budget_ms: int = Query(OPTIMIZE_TIME_BUDGET_MS, ge=1, le=2000),
+    current_user: AuthUser = Depends(get_current_user),
+):
+    addresses = [loc.address for loc in data.addresses]
+    if len(addresses) < 2:
+        raise HTTPException(status_code=400, detail="At least two addresses are required.")
+    if len(addresses) > OPTIMIZE_MAX_STOPS:
+        raise HTTPException(status_code=413, detail=f"Too many addresses (max {OPTIMIZE_MAX_STOPS})")
+    try:
+        coords = await routing_utils.geocode_addresses(addresses)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Geocoding service unavailable: {str(e)}")
+
+    if provider == "ors":
+        try:
+            # Travel times come from the cached matrix service, so ORS only solves
+            order = await routing_utils.get_optimized_route(addresses, coords=coords, use_matrix=True)
+            return {"optimized_order": order, "provider": "ors"}
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            # Fall through to the local solver if ORS is down or returns junk
+            print("⚠️ ORS optimization failed, using local solver:", e)
+
+    start = time.perf_counter()
+    dist, _ = await distance_matrix.get_matrix(coords)
+    tour, distance_km = await asyncio.to_thread(
+        route_solver.solve_route, dist, 0, len(addresses) > 2, time_budget_ms
+    )
+    return {
+        "optimized_order": [addresses[i] for i in tour],
+        "distance_km": round(distance_km, 2),
+        "provider": "local",
+        "solve_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+class MatrixRequest(BaseModel):
+    sources: List[List[float]]
+    destinations: Optional[List[List[float]]] = None
+    provider: Optional[str] = None
+
+@app.post("/matrix")
+async def travel_matrix(data: MatrixRequest, current_user: AuthUser = Depends(get_current_user)):
+    """Distance (km) and duration (min) between [lng, lat] points."""
+    if not data.sources:
+        raise HTTPException(status_code=400, detail="At least one source is required")
+    try:
+        dist, dur = await distance_matrix.get_matrix(data.sources, data.destinations, data.provider)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "distances_km": np.round(dist, 3).tolist(),
+        "durations_min": np.round(dur, 2).tolist(),
+    }
+
+# --- Multi-vehicle routing ---
+class VRPPoint(BaseModel):
+    address: str
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+class VRPVehicle(BaseModel):
+    id: str
+    depot: int = 0
+    end_depot: Optional[int] = None
+    capacity: Optional[float] = None
+    shift_start_min: float = 0
+    shift_end_min: Optional[float] = None
+
+class VRPStop(VRPPoint):
+    demand: float = 0
+    service_min: float = 0
+    tw_start_min: float = 0
+    tw_end_min: Optional[float] = None
+
+class VRPRequest(BaseModel):
+    depots: List[VRPPoint]
+    vehicles: List[VRPVehicle]
+    stops: List[VRPStop]
+    time_limit_ms: int = 2000
+
+async def _resolve_points(points: List[VRPPoint]):
+    missing = [p.address for p in points if p.lat is None or p.lng is None]
+    geocoded = iter(await routing_utils.geocode_addresses(missing)) if missing else iter(())
+    return [[p.lng, p.lat] if p.lat is not None and p.lng is not None else next(geocoded) for p in points]
+
+@app.post("/vrp")
+async def solve_vehicle_routing(data: VRPRequest, current_user: AuthUser = Depends(get_current_user)):
+    if not data.depots or not data.vehicles:
+        raise HTTPException(status_code=400, detail="At least one depot and one vehicle are required")
+    for v in data.vehicles:
+        for d in (v.depot, v.end_depot):
+            if d is not None and not 0 <= d < len(data.depots):
+                raise HTTPException(status_code=400, detail=f"Vehicle {v.id}: unknown depot {d}")
+
+    try:
+        coords = await _resolve_points(list(data.depots) + list(data.stops))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Geocoding service unavailable: {str(e)}")
+
+    dist, dur = await distance_matrix.get_matrix(coords)
+    n_depots = len(data.depots)
+    inf = float("inf")
+    problem = vrp_solver.Problem(
+        vehicles=[
+            vrp_solver.Vehicle(
+                id=v.id, start=v.depot, end=v.depot if v.end_depot is None else v.end_depot,
+                capacity=inf if v.capacity is None else v.capacity,
+                shift_start=v.shift_start_min,
+                shift_end=inf if v.shift_end_min is None else v.shift_end_min,
+            )
+            for v in data.vehicles
+        ],
+        stops=[
+            vrp_solver.Stop(
+                id=str(i), location=n_depots + i, demand=s.demand, service_min=s.service_min,
+                tw_start=s.tw_start_min, tw_end=inf if s.tw_end_min is None else s.tw_end_min,
+            )
+            for i, s in enumerate(data.stops)
+        ],
+        durations=dur.tolist(),
+    )
+    time_limit = min(max(data.time_limit_ms, 10), 30000) / 1000
+    solution = await asyncio.to_thread(vrp_solver.solve_vrp_parallel, problem, time_limit)
+
+    routes = []
+    for vehicle, req, stop_ids in zip(problem.vehicles, data.vehicles, solution.routes):
+        if not stop_ids:
+            continue
+        path = [vehicle.start] + [problem.stops[i].location for i in stop_ids] + [vehicle.end]
+        arrivals = vrp_solver.schedule(problem, stop_ids, vehicle)
+        # name/distance_km/duration_min/route match RouteSaveRequest, so each
+        # entry can be POSTed to /save_route as-is
+        routes.append({
+            "vehicle_id": req.id,
+            "name": f"Vehicle {req.id}",
+            "distance_km": round(float(sum(dist[a, b] for a, b in zip(path, path[1:]))), 2),
+            "duration_min": round(float(sum(dur[a, b] for a, b in zip(path, path[1:]))), 2),
+            "route": [data.depots[vehicle.start].address]
+                     + [data.stops[i].address for i in stop_ids]
+                     + [data.depots[vehicle.end].address],
+            "stops": [
+                {"address": data.stops[i].address, "arrival_min": round(t, 1)}
+                for i, t in zip(stop_ids, arrivals)
+            ],
+        })
+    return {
+        "routes": routes,
+        "unassigned": [data.stops[i].address for i in solution.unassigned],
+        "total_duration_min": round(sum(r["duration_min"] for r in routes), 2),
+    }
+
 # --- Route History ---
 @app.get("/history")
-async def get_route_history(current_user: UserModel = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(RouteHistory)
+async def get_route_history(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = Query(None, description="Return routes with id lower than this"),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: AuthUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Saving or deleting a route changes max(id) or count(*), so both make a
+    # cheap validator; answered from ix_route_history_user_id_id alone
+    stats = await db.execute(
+        select(func.max(RouteHistory.id), func.count(RouteHistory.id))
         .where(RouteHistory.user_id == current_user.id)
-        .order_by(desc(RouteHistory.id))
     )
-    routes = result.scalars().all()
+    max_id, count = stats.one()
+    etag = f'W/"{max_id or 0}-{count}-{cursor or ""}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    query = (
+        select(RouteHistory.id, RouteHistory.distance_km, RouteHistory.duration_min, RouteHistory.route)
+        .where(RouteHistory.user_id == current_user.id)
+    )
+    if cursor is not None:
+        query = query.where(RouteHistory.id < cursor)
+    result = await db.execute(query.order_by(desc(RouteHistory.id)).limit(limit + 1))
+    rows = result.fetchall()
+    response.headers.update(headers)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
     return [
         {
             "id": r.id,
@@ -634,23 +1152,28 @@ async def get_route_history(current_user: UserModel = Depends(get_current_user),
             "duration_min": r.duration_min,
             "route": r.route,
         }
-        for r in routes
+        for r in rows
     ]
 
 # --- New Endpoint: OpenCage Geocoding ---
 @app.get("/geocode")
-async def geocode(address: str = Query(..., min_length=3), current_user: UserModel = Depends(get_current_user)):
-    try:
-        url = f"https://api.opencagedata.com/geocode/v1/json?q={address}&key={OPENCAGE_TOKEN}&limit=1"
-        res = requests.get(url, timeout=5)
+async def geocode(address: str = Query(..., min_length=3), current_user: AuthUser = Depends(get_current_user)):
+    async def fetch():
+        url = "https://api.opencagedata.com/geocode/v1/json"
+        res = await get_client("opencage").get(url, params={"q": address, "key": OPENCAGE_TOKEN, "limit": 1})
         res.raise_for_status()
         data = res.json()
         if data["results"]:
             location = data["results"][0]["geometry"]
             return {"lat": location["lat"], "lng": location["lng"]}
-        else:
+        return None
+
+    try:
+        location = await geocode_cache.lookup("opencage", address, fetch)
+        if location is None:
             raise HTTPException(status_code=404, detail="Location not found")
-    except requests.RequestException as e:
+        return location
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=503, detail=f"Geocoding service unavailable: {str(e)}")
 
 # --- New Endpoint: Mapbox Traffic-aware Routing ---
@@ -658,166 +1181,51 @@ async def geocode(address: str = Query(..., min_length=3), current_user: UserMod
 async def traffic_route(source: str = Query(...), destination: str = Query(...)):
     try:
         coords = f"{source};{destination}"
-        url = (
-            f"https://api.mapbox.com/directions/v5/mapbox/driving-traffic/"
-            f"{coords}?access_token={MAPBOX_TOKEN}&overview=full&geometries=geojson"
-        )
-        res = requests.get(url)
+        url = f"https://api.mapbox.com/directions/v5/mapbox/driving-traffic/{coords}"
+        params = {"access_token": MAPBOX_TOKEN, "overview": "full", "geometries": "geojson"}
+        res = await get_client("mapbox").get(url, params=params)
         res.raise_for_status()
         return res.json()
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error fetching route: {str(e)}")
     
-from email.message import EmailMessage
-from email.utils import make_msgid
-
-from fastapi import Depends
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-from io import BytesIO
-from email.message import EmailMessage
-from PIL import Image
-import base64, os
-import aiosmtplib
-from fastapi import HTTPException
-from fastapi import status
-
 @app.post("/save_route_with_map")
 async def save_route_with_map(
     data: RouteEmailRequest,
     db: AsyncSession = Depends(get_db),
-    user: UserModel = Depends(get_current_user),
+    user: AuthUser = Depends(get_current_user),
 ):
     try:
-        route_str = "➡".join(data.route)
+        try:
+            map_image = decode_data_url(data.map_image_base64)
+            summary_image = decode_data_url(data.summary_image_base64) if data.summary_image_base64 else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        map_key = await asyncio.to_thread(blob_store.put, map_image)
+        summary_key = await asyncio.to_thread(blob_store.put, summary_image) if summary_image else None
+
         route_entry = RouteHistory(
             user_id=user.id,
             name=data.name,
             distance_km=data.distance_km,
             duration_min=data.duration_min,
-            route=route_str,
-            map_image_base64=data.map_image_base64,
-            summary_image_base64=data.summary_image_base64 
+            route=route_label(data.route),
+            map_image_key=map_key,
+            summary_image_key=summary_key,
         )
-        db.add(route_entry)
+        await add_route_with_stops(db, route_entry, data.route)
         await db.commit()
         await db.refresh(route_entry)
         return {"id": route_entry.id}
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print("❌ Save route error:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to save route: {str(e)}")
 
-
-
-        # Step 2: Generate PDF
-        pdf_buffer = BytesIO()
-        c = canvas.Canvas(pdf_buffer, pagesize=letter)
-        width, height = letter
-
-        # === HEADER BOX ===
-        c.setStrokeColorRGB(0.3, 0.3, 0.3)
-        c.setFillColorRGB(0.93, 0.93, 0.93)
-        c.rect(40, height - 100, width - 80, 50, fill=1)
-
-        c.setFont("Helvetica-Bold", 18)
-        c.setFillColorRGB(0.1, 0.1, 0.1)
-        c.drawString(50, height - 80, "📍 Route Report")
-
-        # === Route Info ===
-        c.setFont("Helvetica", 12)
-        c.setFillColorRGB(0, 0, 0)
-        c.drawString(50, height - 130, f"🆔 Route ID: {route_entry.id}")
-        c.drawString(50, height - 150, f"📦 Name: {data.name}")
-        c.drawString(50, height - 170, f"📏 Distance: {data.distance_km:.2f} km")
-        c.drawString(50, height - 190, f"⏱ Duration: {data.duration_min:.2f} minutes")
-
-        # === Route Path ===
-        c.setFont("Helvetica-Bold", 13)
-        c.drawString(50, height - 220, "🗺 Route Path:")
-        c.setFont("Helvetica", 11)
-        y = height - 240
-        for i, point in enumerate(data.route, 1):
-            c.drawString(60, y, f"➡ Stop {i}: {point}")
-            y -= 18
-
-        # === Footer ===
-        c.setFont("Helvetica-Oblique", 8)
-        c.setFillColorRGB(0.5, 0.5, 0.5)
-        c.drawCentredString(width / 2, 20, f"Generated by Smart Logistics • {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-
-        # === Map Page ===
-        c.showPage()
-        c.setFont("Helvetica-Bold", 14)
-        c.drawCentredString(width / 2, height - 40, "🗺 Optimized Route Map")
-
-        try:
-            header, base64_img = data.map_image_base64.split(",", 1)
-            img_data = base64.b64decode(base64_img)
-            img_stream = BytesIO(img_data)
-            pil_image = Image.open(img_stream)
-
-            if pil_image.mode in ("RGBA", "P"):
-                pil_image = pil_image.convert("RGB")
-
-            pil_image.thumbnail((500, 350))
-            img_buf = BytesIO()
-            pil_image.save(img_buf, format="JPEG")
-            img_buf.seek(0)
-
-            img_reader = ImageReader(img_buf)
-
-            # Centered image
-            img_x = (width - pil_image.width) // 2
-            img_y = (height - pil_image.height) // 2
-            c.drawImage(img_reader, img_x, img_y, width=pil_image.width, height=pil_image.height)
-
-            print("✅ Image embedded")
-
-        except Exception as e:
-            traceback.print_exc()
-            print("❌ Image error:", e)
-
-        c.showPage()
-        c.save()
-        pdf_buffer.seek(0)
-
-        # Step 3: Email PDF
-        msg = EmailMessage()
-        msg["Subject"] = "📍 Smart Logistics Route"
-        msg["From"] = os.getenv("SMTP_USERNAME")
-        msg["To"] = data.recipient_email
-        msg.set_content(f"Hi, please find the attached optimized route for '{data.name}'.")
-
-        msg.add_attachment(
-            pdf_buffer.read(),
-            maintype="application",
-            subtype="pdf",
-            filename="route_report.pdf"
-        )
-
-        await aiosmtplib.send(
-            msg,
-            hostname=os.getenv("SMTP_HOST"),
-            port=int(os.getenv("SMTP_PORT")),
-            start_tls=True,
-            username=os.getenv("SMTP_USERNAME"),
-            password=os.getenv("SMTP_PASSWORD")
-        )
-
-        print("✅ Email sent")
-
-        # ✅ Always return JSON
-        return {"id": route_entry.id}
-
-    except Exception as e:
-        traceback.print_exc()
-        print("❌ Error while saving/emailing route:", str(e))
-        raise HTTPException(status_code=500, detail="Failed to save and email route.")
-
 # --- OpenAPI Customization ---
 from fastapi.openapi.utils import get_openapi
 
@@ -849,17 +1257,36 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
-# --- Run once to create tables ---
+# --- Schema: versioned migrations (migrations.py) ---
 import asyncio
+import migrations
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
 async def create_tables():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migrations.upgrade, Base.metadata)
 
-# asyncio.run(create_tables())
-# --- Run once to create tables ---
 @app.on_event("startup")
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-
+    if DB_AUTO_MIGRATE:
+        await create_tables()
+    else:
+        async with engine.begin() as conn:
+            todo = await conn.run_sync(migrations.pending)
+        if todo:
+            print(f"⚠️ {len(todo)} pending migration(s); run python migrations.py")
+    await outbox.start()
+    eta_models.start()
+    await lane_index.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await outbox.stop()
+    await eta_models.stop()
+    await lane_index.stop()
+    await delivery_recorder.stop()
+    await eta_batcher.stop()
+    await close_http_clients()
+    pdf_renderer.shutdown()
+    password_hasher.shutdown()
+    vrp_solver.shutdown()
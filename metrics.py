@@ -0,0 +1,82 @@
+# metrics.py
+"""Tiny in-process metrics registry exposed by the /metrics endpoint."""
+import threading
+from bisect import bisect_left
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        with _lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, v):
+        self.value = v
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, v):
+        with _lock:
+            self.counts[bisect_left(self.buckets, v)] += 1
+            self.count += 1
+            self.sum += v
+
+    def snapshot(self):
+        cumulative, running = {}, 0
+        for le, c in zip(self.buckets + ["+Inf"], self.counts):
+            running += c
+            cumulative[str(le)] = running
+        return {"buckets": cumulative, "count": self.count, "sum": round(self.sum, 6)}
+
+
+def _get(name, factory):
+    with _lock:
+        if name not in _registry:
+            _registry[name] = factory()
+        return _registry[name]
+
+
+def counter(name):
+    return _get(name, Counter)
+
+
+def gauge(name):
+    return _get(name, Gauge)
+
+
+def histogram(name, buckets):
+    return _get(name, lambda: Histogram(buckets))
+
+
+def register(name, fn):
+    """Register a callable whose return value is reported as-is."""
+    with _lock:
+        _registry[name] = fn
+
+
+def snapshot():
+    with _lock:
+        items = list(_registry.items())
+    return {name: (m() if callable(m) and not hasattr(m, "snapshot") else m.snapshot()) for name, m in items}
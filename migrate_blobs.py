@@ -0,0 +1,49 @@
+# migrate_blobs.py
+# Moves base64 map/summary images out of route_history into blob_store.
+# Safe to re-run: only rows that still have inline images are touched.
+import asyncio
+from sqlalchemy import or_, select, update
+from main import RouteHistory, async_session, create_tables
+from blob_store import blob_store, decode_data_url
+
+BATCH_SIZE = 100
+
+async def migrate():
+    await create_tables()
+
+    last_id, moved, failed = 0, 0, 0
+    while True:
+        async with async_session() as db:
+            result = await db.execute(
+                select(RouteHistory.id, RouteHistory.map_image_base64, RouteHistory.summary_image_base64)
+                .where(
+                    RouteHistory.id > last_id,
+                    or_(RouteHistory.map_image_base64.isnot(None), RouteHistory.summary_image_base64.isnot(None)),
+                )
+                .order_by(RouteHistory.id)
+                .limit(BATCH_SIZE)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            for row in rows:
+                try:
+                    values = {"map_image_base64": None, "summary_image_base64": None}
+                    if row.map_image_base64:
+                        values["map_image_key"] = blob_store.put(decode_data_url(row.map_image_base64))
+                    if row.summary_image_base64:
+                        values["summary_image_key"] = blob_store.put(decode_data_url(row.summary_image_base64))
+                except ValueError as e:
+                    print(f"❌ Route {row.id}: {e}")
+                    failed += 1
+                    continue
+                await db.execute(update(RouteHistory).where(RouteHistory.id == row.id).values(**values))
+                moved += 1
+            await db.commit()
+            last_id = rows[-1].id
+            print(f"➡️ Migrated up to route {last_id}")
+
+    print(f"✅ Moved images for {moved} routes ({failed} failed)")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
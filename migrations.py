@@ -0,0 +1,178 @@
+# migrations.py
+"""Versioned schema migrations.
+
+Each migration is (version, name, fn(sync_conn, metadata)) and runs once;
+applied versions are recorded in schema_migrations. Migrations only use the
+*_if_missing helpers, so a database created by the old create_all startup
+can be adopted as-is. The baseline creates tables from the models'
+metadata, and later steps add what the baseline may not have had.
+
+On PostgreSQL the run holds an advisory lock, so several workers starting
+at once apply each migration exactly once.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending versions
+"""
+from datetime import datetime
+
+from sqlalchemy import ARRAY, Column, Integer, String, TIMESTAMP, MetaData, Table, inspect, select, text
+
+_LOCK_ID = 7432051  # arbitrary, shared by every process running migrations
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", TIMESTAMP, nullable=False),
+)
+
+
+# --- Helpers ---
+def create_table_if_missing(conn, metadata, name):
+    metadata.tables[name].create(conn, checkfirst=True)
+
+
+def add_column_if_missing(conn, table, column, sql_type):
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}"))
+
+
+def create_index_if_missing(conn, name, table, columns_sql):
+    if name not in {ix["name"] for ix in inspect(conn).get_indexes(table)}:
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({columns_sql})"))
+
+
+# --- Migrations ---
+BASELINE_TABLES = ["users", "route_history", "delivery_logs", "geocode_cache", "email_outbox", "lane_stats"]
+
+
+def m001_baseline(conn, metadata):
+    for name in BASELINE_TABLES:
+        create_table_if_missing(conn, metadata, name)
+
+
+def m002_route_history_image_keys(conn, metadata):
+    add_column_if_missing(conn, "route_history", "created_at", "TIMESTAMP")
+    add_column_if_missing(conn, "route_history", "map_image_key", "VARCHAR(64)")
+    add_column_if_missing(conn, "route_history", "summary_image_key", "VARCHAR(64)")
+
+
+def m003_users_token_version(conn, metadata):
+    add_column_if_missing(conn, "users", "token_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def m004_hot_query_indexes(conn, metadata):
+    # /history: WHERE user_id = ? ORDER BY id DESC
+    create_index_if_missing(conn, "ix_route_history_user_id_id", "route_history", "user_id, id DESC")
+    # eta_train.py --since <timestamp>: WHERE created_at > ? ORDER BY created_at, id
+    create_index_if_missing(conn, "ix_delivery_logs_created_at", "delivery_logs", "created_at, id")
+
+
+def m005_delivery_logs_portable_stops(conn, metadata):
+    # stops was ARRAY(Text), which only PostgreSQL has: store it as JSON and
+    # keep the count in num_stops, backfilled from the arrays before converting
+    stops_type = {c["name"]: c["type"] for c in inspect(conn).get_columns("delivery_logs")}["stops"]
+    add_column_if_missing(conn, "delivery_logs", "num_stops", "INTEGER NOT NULL DEFAULT 0")
+    if isinstance(stops_type, ARRAY):
+        conn.execute(text("UPDATE delivery_logs SET num_stops = coalesce(cardinality(stops), 0)"))
+        conn.execute(text("ALTER TABLE delivery_logs ALTER COLUMN stops TYPE json USING to_json(stops)"))
+
+
+def _split_route(route):
+    # save_route joined stops with " ➡️ ", save_route_with_map with "➡"
+    parts = (part.strip().lstrip("\ufe0f").strip() for part in (route or "").split("➡"))
+    return [part for part in parts if part]
+
+
+def m006_route_stops(conn, metadata):
+    create_table_if_missing(conn, metadata, "route_stops")
+    routes, stops = metadata.tables["route_history"], metadata.tables["route_stops"]
+    missing = select(routes.c.id, routes.c.route).where(
+        ~select(stops.c.route_id).where(stops.c.route_id == routes.c.id).exists()
+    ).order_by(routes.c.id)
+    last_id = 0
+    while True:
+        batch = conn.execute(missing.where(routes.c.id > last_id).limit(1000)).fetchall()
+        if not batch:
+            break
+        rows = [{"route_id": route_id, "seq": seq, "address": address}
+                for route_id, route in batch for seq, address in enumerate(_split_route(route))]
+        if rows:
+            conn.execute(stops.insert(), rows)
+        last_id = batch[-1].id
+
+
+def m007_email_outbox_lease(conn, metadata):
+    add_column_if_missing(conn, "email_outbox", "claimed_at", "TIMESTAMP")
+
+
+def m008_lane_stats_id_watermark(conn, metadata):
+    add_column_if_missing(conn, "lane_stats", "last_log_id", "INTEGER")
+
+
+def m009_lane_history(conn, metadata):
+    create_table_if_missing(conn, metadata, "lane_history")
+
+
+MIGRATIONS = [
+    (1, "baseline", m001_baseline),
+    (2, "route_history_image_keys", m002_route_history_image_keys),
+    (3, "users_token_version", m003_users_token_version),
+    (4, "hot_query_indexes", m004_hot_query_indexes),
+    (5, "delivery_logs_portable_stops", m005_delivery_logs_portable_stops),
+    (6, "route_stops", m006_route_stops),
+    (7, "email_outbox_lease", m007_email_outbox_lease),
+    (8, "lane_stats_id_watermark", m008_lane_stats_id_watermark),
+    (9, "lane_history", m009_lane_history),
+]
+
+
+# --- Runner ---
+def applied_versions(conn):
+    schema_migrations.create(conn, checkfirst=True)
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def upgrade(conn, metadata):
+    """Apply pending migrations in order; run inside one transaction."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _LOCK_ID})
+    done = applied_versions(conn)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        fn(conn, metadata)
+        conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append(version)
+        print(f"🧱 Applied migration {version:03d} {name}")
+    return applied
+
+
+def pending(conn):
+    done = applied_versions(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    from main import Base, engine
+
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    parser.add_argument("--status", action="store_true")
+    args = parser.parse_args()
+
+    async def run():
+        async with engine.begin() as conn:
+            if args.status:
+                todo = await conn.run_sync(pending)
+                for version, name, _ in MIGRATIONS:
+                    state = "pending" if (version, name) in todo else "applied"
+                    print(f"{version:03d} {name:<32} {state}")
+            else:
+                applied = await conn.run_sync(upgrade, Base.metadata)
+                print(f"✅ {len(applied)} migration(s) applied" if applied else "✅ Schema is up to date")
+
+    asyncio.run(run())
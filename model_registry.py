@@ -0,0 +1,171 @@
+# model_registry.py
+"""Versioned ETA models on disk and hot swapping in the running API.
+
+Layout of ETA_REGISTRY_DIR (default "model_registry"):
+
+    <version>/model.pkl       fitted sklearn Pipeline (used for warm starts)
+    <version>/compiled/       eta_compiled export (what the API serves)
+    <version>/metrics.json    holdout metrics and training details
+    CURRENT                   name of the promoted version
+
+Versions are written to a temporary directory and renamed into place, and
+CURRENT is replaced atomically, so readers never see a half-written model.
+Every API process polls CURRENT; when it changes, the new model is loaded in
+a thread and swapped in with a single reference assignment. Requests already
+running keep the (version, model) pair they started with.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+import traceback
+from datetime import datetime
+
+import joblib
+
+from eta_compiled import CompiledETAModel, export_compiled
+
+REGISTRY_DIR = os.getenv("ETA_REGISTRY_DIR", "model_registry")
+POLL_SECONDS = float(os.getenv("ETA_MODEL_POLL_SECONDS", "10"))
+
+
+# --- Registry (files) ---
+def _current_path(registry):
+    return os.path.join(registry, "CURRENT")
+
+
+def current_version(registry=REGISTRY_DIR):
+    try:
+        with open(_current_path(registry)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(registry=REGISTRY_DIR):
+    """[(version, metrics)] oldest first."""
+    if not os.path.isdir(registry):
+        return []
+    versions = []
+    for name in sorted(os.listdir(registry)):
+        path = os.path.join(registry, name, "metrics.json")
+        if name.startswith(".") or not os.path.exists(path):
+            continue
+        with open(path) as f:
+            versions.append((name, json.load(f)))
+    return versions
+
+
+def load_pipeline(version, registry=REGISTRY_DIR):
+    return joblib.load(os.path.join(registry, version, "model.pkl"))
+
+
+def register(pipeline, model_metrics, registry=REGISTRY_DIR):
+    """Store a fitted pipeline as a new version and return its name."""
+    version = "v" + datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+    tmp = os.path.join(registry, f".tmp-{version}")
+    os.makedirs(tmp)
+    try:
+        joblib.dump(pipeline, os.path.join(tmp, "model.pkl"))
+        export_compiled(pipeline, os.path.join(tmp, "compiled"))
+        with open(os.path.join(tmp, "metrics.json"), "w") as f:
+            json.dump(dict(model_metrics, version=version, created_at=datetime.utcnow().isoformat()), f, indent=2)
+        os.rename(tmp, os.path.join(registry, version))
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return version
+
+
+def promote(version, registry=REGISTRY_DIR):
+    if not os.path.exists(os.path.join(registry, version, "compiled", "meta.json")):
+        raise ValueError(f"unknown model version: {version}")
+    tmp = _current_path(registry) + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, _current_path(registry))
+
+
+def prune(keep=5, registry=REGISTRY_DIR):
+    """Delete all but the newest `keep` versions, never the promoted one."""
+    current = current_version(registry)
+    versions = [v for v, _ in list_versions(registry)]
+    for version in versions[:-keep] if keep else versions:
+        if version != current:
+            shutil.rmtree(os.path.join(registry, version), ignore_errors=True)
+
+
+# --- Serving side ---
+class ActiveModel:
+    """The model the API predicts with, as one (version, model) pair."""
+
+    def __init__(self, registry=REGISTRY_DIR, fallback_compiled=None, fallback_pickle=None):
+        self.registry = registry
+        self.fallback_compiled = fallback_compiled
+        self.fallback_pickle = fallback_pickle
+        self.current = (None, None)
+        self.loaded_at = None
+        self._task = None
+
+    def _load(self, version):
+        if version is not None:
+            return CompiledETAModel(os.path.join(self.registry, version, "compiled"))
+        # No promoted version yet: the files written by model_train.py, the
+        # newer of the compiled export and the pickle (a stale compiled dir
+        # must not shadow a freshly trained pickle)
+        meta = os.path.join(self.fallback_compiled, "meta.json") if self.fallback_compiled else None
+        if meta and os.path.exists(meta):
+            pickle_mtime = os.path.getmtime(self.fallback_pickle) if self.fallback_pickle and os.path.exists(self.fallback_pickle) else 0
+            if os.path.getmtime(meta) >= pickle_mtime:
+                return CompiledETAModel(self.fallback_compiled)
+        return joblib.load(self.fallback_pickle)
+
+    def load(self):
+        version = current_version(self.registry)
+        try:
+            self.current = (version or "legacy", self._load(version))
+        except FileNotFoundError as e:
+            # Serve without a model (callers fall back) until one is promoted
+            print(f"⚠️ No ETA model loaded: {e}")
+            self.current = (None, None)
+        self.loaded_at = time.time()
+        return self.current[0]
+
+    async def refresh(self):
+        """Swap to the promoted version if it changed. Returns True on swap."""
+        version = current_version(self.registry)
+        if version is None or version == self.current[0]:
+            return False
+        model = await asyncio.to_thread(self._load, version)
+        old = self.current[0]
+        self.current = (version, model)
+        self.loaded_at = time.time()
+        print(f"🔁 ETA model swapped {old} -> {version}")
+        return True
+
+    async def _watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep serving the old model; retry on the next poll
+                traceback.print_exc()
+
+    def start(self, interval=POLL_SECONDS):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def info(self):
+        version, _ = self.current
+        return {"version": version, "loaded_at": self.loaded_at, "registry": self.registry}
@@ -6,6 +6,7 @@ from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 import joblib
+from eta_compiled import export_compiled
 
 # Load data
 df = pd.read_csv("delivery_data.csv")
@@ -36,3 +37,7 @@ model.fit(X_train, y_train)
 # Save model
 joblib.dump(model, "eta_model.pkl")
 print("✅ Model trained and saved as eta_model.pkl")
+
+# Export flattened NumPy arrays for the API's fast-loading predictor
+export_compiled(model, "eta_model_compiled")
+print("✅ Compiled model exported to eta_model_compiled/")
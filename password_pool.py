@@ -0,0 +1,121 @@
+# password_pool.py
+"""bcrypt hashing and verification off the event loop.
+
+Each bcrypt call burns 100-300 ms of CPU. Calls run on a dedicated thread
+pool of PASSWORD_WORKERS threads (bcrypt releases the GIL while hashing).
+At most PASSWORD_QUEUE_LIMIT calls may wait for a thread; beyond that
+PasswordPoolBusy is raised so a login storm is shed with 503s instead of
+queueing without bound. PASSWORD_WORKERS=0 hashes inline on the loop, which
+is the old behaviour and is only useful for comparison.
+
+The work factor is BCRYPT_ROUNDS. Hashes made with another cost are
+re-hashed on the next successful login (see verify_and_update).
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+import metrics
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+MS_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT, context=pwd_context):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.context = context
+        self._executor = None
+        self._slots = None
+        self._loop = None
+        self.waiting = 0
+        self.running = 0
+        self.rejected = metrics.Counter()
+        self.completed = metrics.Counter()
+        self.rehashed = metrics.Counter()
+        self.wait_ms = metrics.Histogram(MS_BUCKETS)
+        self.run_ms = metrics.Histogram(MS_BUCKETS)
+        metrics.register("password_pool", self.stats)
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.workers)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            start = time.perf_counter()
+            result = fn(*args)
+            self.run_ms.observe((time.perf_counter() - start) * 1000)
+            self.completed.inc()
+            return result
+
+        self._ensure_started()
+        if self._slots.locked() and self.waiting >= self.queue_limit:
+            self.rejected.inc()
+            raise PasswordPoolBusy("too many password checks in progress")
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            start = time.perf_counter()
+            self.wait_ms.observe((start - queued) * 1000)
+            result = await self._loop.run_in_executor(self._executor, fn, *args)
+            self.run_ms.observe((time.perf_counter() - start) * 1000)
+            self.completed.inc()
+            return result
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str):
+        """(ok, new_hash): new_hash is set when the stored hash should be
+        replaced, e.g. because BCRYPT_ROUNDS changed."""
+        ok, new_hash = await self._run(self.context.verify_and_update, password, hashed)
+        if ok and new_hash:
+            self.rehashed.inc()
+        return ok, new_hash
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "rounds": BCRYPT_ROUNDS,
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed.value,
+            "rejected": self.rejected.value,
+            "rehashed": self.rehashed.value,
+            "wait_ms": self.wait_ms.snapshot(),
+            "run_ms": self.run_ms.snapshot(),
+        }
+
+
+password_hasher = PasswordHasher()
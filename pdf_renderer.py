@@ -0,0 +1,204 @@
+# pdf_renderer.py
+"""Route report PDFs rendered off the event loop.
+
+Image preparation (flatten transparency, thumbnail, JPEG encode) and PDF
+drawing run in a process pool and return bytes, so concurrent requests never
+share a file on disk. Prepared images are cached by content hash and size box,
+and finished PDFs by route id and a hash of everything drawn on them. The
+footer shows when the route was saved rather than the render time, so
+re-sending an unchanged report is a dictionary lookup.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from PIL import Image
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+import metrics
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_CACHE_MB = int(os.getenv("PDF_CACHE_MB", "64"))
+MAP_BOX = (500, 350)
+SUMMARY_BOX = (700, 600)
+
+
+# --- Worker-side functions (must stay picklable, module level) ---
+def prepare_image(data: bytes, box):
+    """Flatten onto white, shrink to fit `box` and encode as JPEG.
+    Returns (jpeg_bytes, width, height)."""
+    pil_image = Image.open(BytesIO(data))
+    if pil_image.mode in ("RGBA", "P"):
+        pil_image = pil_image.convert("RGBA")
+        white_bg = Image.new("RGBA", pil_image.size, (255, 255, 255, 255))
+        pil_image = Image.alpha_composite(white_bg, pil_image)
+    pil_image = pil_image.convert("RGB")
+    pil_image.thumbnail(box, Image.LANCZOS)
+    buf = BytesIO()
+    pil_image.save(buf, format="JPEG", quality=95)
+    return buf.getvalue(), pil_image.width, pil_image.height
+
+
+def _draw_image_page(c, title, image):
+    width, height = letter
+    c.showPage()
+    c.setFont("Helvetica-Bold", 14)
+    c.drawCentredString(width / 2, height - 40, title)
+    jpeg, img_w, img_h = image
+    img_x = (width - img_w) // 2
+    img_y = (height - img_h) // 2
+    c.drawImage(ImageReader(BytesIO(jpeg)), img_x, img_y, width=img_w, height=img_h)
+
+
+def build_pdf(info: dict, stops: list, map_image=None, summary_image=None, saved_at=None) -> bytes:
+    """Draw the report; images are prepare_image() results or None."""
+    buf = BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter)
+    width, height = letter
+    y = height - 50
+
+    # --- Header ---
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, y, "📍 Route Report")
+    y -= 30
+
+    # --- Route Info ---
+    c.setFont("Helvetica", 12)
+    c.drawString(50, y, f"🆔 Route ID: {info['id']}")
+    y -= 20
+    c.drawString(50, y, f"📝 Name: {info['name']}")
+    y -= 20
+    c.drawString(50, y, f"📏 Distance: {info['distance_km']:.2f} km")
+    y -= 20
+    c.drawString(50, y, f"⏱️ Duration: {info['duration_min']:.2f} minutes")
+    y -= 30
+
+    # --- Route Path ---
+    c.setFont("Helvetica-Bold", 13)
+    c.drawString(50, y, "🛣️ Route Path:")
+    y -= 20
+    c.setFont("Helvetica", 12)
+    for i, stop in enumerate(stops):
+        c.drawString(70, y, f"- Stop {i + 1}: {stop}")
+        y -= 20
+        if y < 100:
+            c.showPage()
+            y = height - 50
+            c.setFont("Helvetica", 12)
+
+    if map_image:
+        _draw_image_page(c, "🗺 Optimized Route Map", map_image)
+    if summary_image:
+        _draw_image_page(c, "🧾 Summary Report", summary_image)
+
+    # --- Footer ---
+    if saved_at is not None:
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawString(50, 30, f"Route saved • {saved_at:%Y-%m-%d %I:%M %p} UTC")
+    c.save()
+    return buf.getvalue()
+
+
+# --- Parent-side cache and scheduling ---
+class _BytesLRU:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value, nbytes):
+        if key in self._items:
+            return
+        self._items[key] = (value, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes and self._items:
+            _, (_, dropped) = self._items.popitem(last=False)
+            self.size -= dropped
+
+
+class PDFRenderer:
+    def __init__(self, workers=PDF_WORKERS, cache_mb=PDF_CACHE_MB):
+        self.workers = workers
+        self._pool = None
+        # Half the budget for prepared images, half for finished PDFs
+        self._images = _BytesLRU(cache_mb * 1024 * 1024 // 2)
+        self._pdfs = _BytesLRU(cache_mb * 1024 * 1024 // 2)
+        self.pdf_hits = metrics.Counter()
+        self.image_hits = metrics.Counter()
+        self.renders = metrics.Counter()
+        metrics.register("pdf_renderer", self.stats)
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            return await asyncio.to_thread(fn, *args)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def _prepared(self, data, box):
+        if not data:
+            return None
+        key = (hashlib.sha256(data).hexdigest(), box)
+        cached = self._images.get(key)
+        if cached is not None:
+            self.image_hits.inc()
+            return cached[0]
+        try:
+            image = await self._run(prepare_image, data, box)
+        except Exception as e:
+            # Same as before: a broken image drops its page, not the report
+            traceback.print_exc()
+            print("❌ Image error:", e)
+            return None
+        self._images.put(key, image, len(image[0]))
+        return image
+
+    async def render(self, info: dict, stops: list, map_image=None, summary_image=None,
+                     saved_at: datetime = None) -> bytes:
+        digest = hashlib.sha256(json.dumps([info, stops, saved_at], sort_keys=True, default=str).encode())
+        for data in (map_image, summary_image):
+            digest.update(hashlib.sha256(data).digest() if data else b"-")
+        key = (info["id"], digest.hexdigest())
+        cached = self._pdfs.get(key)
+        if cached is not None:
+            self.pdf_hits.inc()
+            return cached[0]
+
+        map_prepared, summary_prepared = await asyncio.gather(
+            self._prepared(map_image, MAP_BOX), self._prepared(summary_image, SUMMARY_BOX)
+        )
+        pdf = await self._run(build_pdf, info, stops, map_prepared, summary_prepared, saved_at)
+        self.renders.inc()
+        self._pdfs.put(key, pdf, len(pdf))
+        return pdf
+
+    def stats(self):
+        return {
+            "renders": self.renders.value,
+            "pdf_cache_hits": self.pdf_hits.value,
+            "image_cache_hits": self.image_hits.value,
+            "cached_pdf_bytes": self._pdfs.size,
+            "cached_image_bytes": self._images.size,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+pdf_renderer = PDFRenderer()
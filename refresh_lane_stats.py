@@ -0,0 +1,21 @@
+# refresh_lane_stats.py
+# Rebuilds lane_stats (see lane_stats.py). Run after eta_train.py in the
+# nightly job; running APIs pick the new stats up on their next reload.
+import argparse
+import asyncio
+from main import DeliveryLog, create_tables
+from lane_stats import refresh_from_logs, rebuild_from_csv
+
+async def run(args):
+    await create_tables()
+    if args.csv:
+        lanes = await rebuild_from_csv(args.csv, DeliveryLog.__table__)
+    else:
+        lanes = await refresh_from_logs(DeliveryLog.__table__, full=args.full)
+    print(f"✅ Refreshed {lanes} lanes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh lane_stats")
+    parser.add_argument("--full", action="store_true", help="recompute every lane")
+    parser.add_argument("--csv", help="import historical deliveries from a CSV (replacing earlier imports) and rebuild")
+    asyncio.run(run(parser.parse_args()))
@@ -1,4 +1,5 @@
 @echo off
 cd /d "C:\Users\jayta\logistics-optimizer"
 python eta_train.py
-python model_train.py
+python retrain_eta.py --mode warm --promote
+python refresh_lane_stats.py
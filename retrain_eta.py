@@ -0,0 +1,144 @@
+# retrain_eta.py
+"""Retrain the ETA model into the model registry.
+
+Modes:
+    full    fit a new pipeline on all training rows (what model_train.py does)
+    warm    keep the promoted model's encoder and trees, add --add-trees trees
+            fitted on the newest --window-rows rows (RandomForest warm_start)
+    window  fit a new pipeline on the newest --window-rows rows only
+
+The newest --holdout fraction of rows (exports are appended in delivery_logs
+id order, so these are the last rows) is never trained on; the new model and
+the promoted one are both scored on it. With --promote the new version is
+promoted unless its MAE is worse than the promoted model's by more than
+--tolerance; running APIs swap to it on their next poll of the registry.
+
+    python retrain_eta.py --mode warm --promote
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+import model_registry
+
+FEATURES = ["distance_km", "num_stops", "weather", "time_of_day", "traffic_level"]
+CATEGORICAL = ["weather", "time_of_day", "traffic_level"]
+TARGET = "actual_eta_min"
+
+
+def build_pipeline(n_estimators=100):
+    preprocessor = ColumnTransformer(
+        transformers=[("cat", OneHotEncoder(handle_unknown="ignore"), CATEGORICAL)],
+        remainder="passthrough"
+    )
+    return Pipeline([
+        ("preprocessor", preprocessor),
+        ("regressor", RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=-1))
+    ])
+
+
+def read_data(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        df = pd.read_parquet(path, columns=FEATURES + [TARGET])
+    elif ext in (".feather", ".arrow"):
+        df = pd.read_feather(path, columns=FEATURES + [TARGET])
+    else:
+        df = pd.read_csv(path, usecols=FEATURES + [TARGET])
+    return df.dropna()
+
+
+def evaluate(pipeline, X, y):
+    pred = pipeline.predict(X)
+    err = np.asarray(pred) - y.to_numpy()
+    return {"mae": round(float(np.abs(err).mean()), 4), "rmse": round(float(np.sqrt((err ** 2).mean())), 4)}
+
+
+def warm_start(pipeline, X, y, add_trees):
+    """Append add_trees trees fitted on (X, y); the fitted encoder is reused
+    so the column layout the existing trees split on doesn't change."""
+    preprocessor = pipeline.named_steps["preprocessor"]
+    forest = pipeline.named_steps["regressor"]
+    forest.set_params(warm_start=True, n_estimators=forest.n_estimators + add_trees)
+    forest.fit(preprocessor.transform(X), y)
+    forest.set_params(warm_start=False)
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the ETA model into the registry")
+    parser.add_argument("--data", default="delivery_data.csv", help="CSV, Parquet or Feather from eta_train.py")
+    parser.add_argument("--mode", choices=["full", "warm", "window"], default="warm")
+    parser.add_argument("--window-rows", type=int, default=5000)
+    parser.add_argument("--add-trees", type=int, default=20)
+    parser.add_argument("--max-trees", type=int, default=300, help="warm starts past this refit on the window")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--promote", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed relative MAE regression")
+    parser.add_argument("--keep", type=int, default=5, help="registry versions to keep")
+    args = parser.parse_args()
+
+    df = read_data(args.data)
+    split = int(len(df) * (1 - args.holdout))
+    train, holdout = df.iloc[:split], df.iloc[split:]
+    X_hold, y_hold = holdout[FEATURES], holdout[TARGET]
+
+    parent = model_registry.current_version()
+    parent_metrics = None
+    mode = args.mode
+    if mode == "warm" and parent is None:
+        print("⚠️ No promoted model to warm-start from; fitting from scratch")
+        mode = "full"
+
+    if mode == "warm":
+        pipeline = model_registry.load_pipeline(parent)
+        parent_metrics = evaluate(pipeline, X_hold, y_hold)
+        if pipeline.named_steps["regressor"].n_estimators + args.add_trees > args.max_trees:
+            print(f"⚠️ Warm start would exceed {args.max_trees} trees; refitting on the window")
+            mode = "window"
+    elif parent is not None:
+        parent_metrics = evaluate(model_registry.load_pipeline(parent), X_hold, y_hold)
+
+    fit_rows = train if mode == "full" else train.iloc[-args.window_rows:]
+    start = time.perf_counter()
+    if mode == "warm":
+        pipeline = warm_start(pipeline, fit_rows[FEATURES], fit_rows[TARGET], args.add_trees)
+    else:
+        pipeline = build_pipeline(args.n_estimators)
+        pipeline.fit(fit_rows[FEATURES], fit_rows[TARGET])
+    train_seconds = time.perf_counter() - start
+
+    scores = evaluate(pipeline, X_hold, y_hold)
+    version = model_registry.register(pipeline, {
+        **scores,
+        "mode": mode,
+        "parent": parent,
+        "parent_mae": parent_metrics["mae"] if parent_metrics else None,
+        "n_estimators": pipeline.named_steps["regressor"].n_estimators,
+        "train_rows": len(fit_rows),
+        "holdout_rows": len(holdout),
+        "train_seconds": round(train_seconds, 3),
+        "data": args.data,
+    })
+    print(f"✅ Registered {version} ({mode}): MAE {scores['mae']} RMSE {scores['rmse']}"
+          + (f" vs {parent} MAE {parent_metrics['mae']}" if parent_metrics else ""))
+
+    if args.promote:
+        if parent_metrics and scores["mae"] > parent_metrics["mae"] * (1 + args.tolerance):
+            print(f"⛔ Not promoting {version}: holdout MAE worse than {parent}")
+        else:
+            model_registry.promote(version)
+            print(f"🚀 Promoted {version}")
+    model_registry.prune(args.keep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# route_solver.py
+"""Local multi-stop route optimizer.
+
+Stops are ordered with a nearest-neighbour seed, then improved with 2-opt and
+Or-opt moves until no move helps or the time budget runs out. The first stop
+is the fixed start; when `fixed_end` is set the last stop is the fixed end.
+The matrix may be asymmetric: moves that reverse a segment pay for the
+reversed legs too.
+"""
+import time
+
+import numpy as np
+
+from distance_matrix import haversine_matrix  # noqa: F401 (re-exported)
+
+
+def tour_cost(dist, tour):
+    tour = np.asarray(tour)
+    return float(dist[tour[:-1], tour[1:]].sum())
+
+
+def nearest_neighbour(dist, start=0, end=None):
+    n = len(dist)
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[start] = False
+    if end is not None:
+        unvisited[end] = False
+    tour = [start]
+    while unvisited.any():
+        row = np.where(unvisited, dist[tour[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        tour.append(nxt)
+        unvisited[nxt] = False
+    if end is not None:
+        tour.append(end)
+    return tour
+
+
+def _two_opt_pass(dist, tour, last, symmetric=True, deadline=None):
+    """Apply the best 2-opt move for each i; positions 0 and `last` never move."""
+    improved = False
+    for i in range(1, last - 1):
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        j = np.arange(i + 1, last)
+        a, b = tour[i - 1], tour[i]
+        c, d = tour[j], tour[j + 1]
+        delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+        if not symmetric:
+            # Reversing tour[i..j] swaps its forward legs for the backward ones
+            fwd = np.concatenate([[0.0], np.cumsum(dist[tour[:-1], tour[1:]])])
+            bwd = np.concatenate([[0.0], np.cumsum(dist[tour[1:], tour[:-1]])])
+            delta += (bwd[j] - bwd[i]) - (fwd[j] - fwd[i])
+        k = int(np.argmin(delta))
+        if delta[k] < -1e-9:
+            jj = int(j[k])
+            tour[i:jj + 1] = tour[i:jj + 1][::-1]
+            improved = True
+    return improved
+
+
+def _or_opt_pass(dist, tour, last, symmetric=True, deadline=None):
+    """Move segments of 1-3 stops (optionally reversed) to their best position."""
+    improved = False
+    for seg_len in (1, 2, 3):
+        i = 1
+        while i + seg_len <= last:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return improved
+            seg = tour[i:i + seg_len]
+            prev, nxt = tour[i - 1], tour[i + seg_len]
+            removal_gain = dist[prev, seg[0]] + dist[seg[-1], nxt] - dist[prev, nxt]
+            rest = np.concatenate([tour[:i], tour[i + seg_len:]])
+            # Insert between rest[p] and rest[p + 1]
+            p = np.arange(0, len(rest) - 1)
+            u, v = rest[p], rest[p + 1]
+            fwd = dist[u, seg[0]] + dist[seg[-1], v] - dist[u, v]
+            rev = dist[u, seg[-1]] + dist[seg[0], v] - dist[u, v]
+            if not symmetric and seg_len > 1:
+                rev = rev + dist[seg[1:], seg[:-1]].sum() - dist[seg[:-1], seg[1:]].sum()
+            cost = np.minimum(fwd, rev)
+            cost[i - 1] = np.inf  # original position
+            k = int(np.argmin(cost))
+            if cost[k] - removal_gain < -1e-9:
+                piece = seg if fwd[k] <= rev[k] else seg[::-1]
+                tour[:] = np.concatenate([rest[:k + 1], piece, rest[k + 1:]])
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def solve_route(dist, start=0, fixed_end=True, time_budget_ms=50):
+    """Return (tour, cost) visiting every index of the square matrix `dist`."""
+    dist = np.asarray(dist, dtype=np.float64)
+    n = len(dist)
+    end = n - 1 if fixed_end and n > 1 else None
+    tour = np.array(nearest_neighbour(dist, start, end))
+    # Stops whose position can change; with one or none there is nothing to improve
+    free = n - 2 if end is not None else n - 1
+    if free <= 1:
+        return tour.tolist(), tour_cost(dist, tour)
+
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    symmetric = np.array_equal(dist, dist.T)
+    # With an open end the last position may change too
+    last = n - 1 if end is not None else n
+    if end is None:
+        # Pad with a zero-cost dummy end so moves can treat both cases alike
+        dist = np.pad(dist, ((0, 1), (0, 1)))
+        tour = np.append(tour, n)
+    while time.perf_counter() < deadline:
+        improved = _two_opt_pass(dist, tour, last, symmetric, deadline)
+        if time.perf_counter() >= deadline:
+            break
+        improved = _or_opt_pass(dist, tour, last, symmetric, deadline) or improved
+        if not improved:
+            break
+    if end is None:
+        tour = tour[:-1]
+        dist = dist[:n, :n]
+    return tour.tolist(), tour_cost(dist, tour)
@@ -1,48 +1,85 @@
-import openrouteservice
+import asyncio
 import os
 from dotenv import load_dotenv
+from geocode_cache import geocode_cache
+from http_client import get_client
+import distance_matrix
+import numpy as np
 
 # Load environment variables
 load_dotenv()
 ORS_API_KEY = os.getenv("ORS_API_KEY")
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
 
-# Initialize ORS client
-client = openrouteservice.Client(key=ORS_API_KEY)
+async def geocode_address(address):
+    """Convert address to [lon, lat] using ORS Pelias search (cached)."""
+    async def fetch():
+        res = await get_client("ors").get(
+            f"{ORS_BASE_URL}/geocode/search",
+            params={"api_key": ORS_API_KEY, "text": address, "size": 1},
+        )
+        res.raise_for_status()
+        geocode = res.json()
+        if geocode and geocode['features']:
+            return geocode['features'][0]['geometry']['coordinates']  # [lon, lat]
+        return None
 
-def geocode_address(address):
-    """Convert address to [lon, lat] using ORS Pelias search."""
-    geocode = client.pelias_search(text=address)
-    if geocode and geocode['features']:
-        coords = geocode['features'][0]['geometry']['coordinates']  # [lon, lat]
-        return coords
-    else:
+    coords = await geocode_cache.lookup("ors", address, fetch)
+    if coords is None:
         raise ValueError(f"Could not geocode address: {address}")
+    return coords
+
+async def geocode_addresses(addresses):
+    """Geocode all addresses concurrently, preserving order."""
+    return list(await asyncio.gather(*(geocode_address(addr) for addr in addresses)))
 
-def get_optimized_route(addresses):
-    """Return the optimized address order using ORS Optimization API."""
+async def get_optimized_route(addresses, coords=None, use_matrix=False):
+    """Return the optimized address order using ORS Optimization API.
+    The first address is the start and the last the end; the stops between
+    them are reordered. With use_matrix, travel times come from
+    distance_matrix (cached, possibly asymmetric) instead of being
+    recomputed by ORS."""
     if len(addresses) < 2:
         raise ValueError("At least two addresses are required.")
+    if len(addresses) == 2:
+        return list(addresses)
 
     # Geocode all addresses
-    coords = [geocode_address(addr) for addr in addresses]
-
-    # ORS expects 'jobs' to be stops (excluding the first which is the vehicle start/end)
-    jobs = [{"id": i+1, "location": loc} for i, loc in enumerate(coords[1:])]
+    if coords is None:
+        coords = await geocode_addresses(addresses)
 
-    vehicle = {
-        "id": 1,
-        "start": coords[0],
-        "end": coords[-1] if len(coords) > 2 else coords[1]
-    }
+    # ORS 'jobs' are the stops between the vehicle's start (0) and end (last);
+    # job ids are indices into addresses
+    end = len(coords) - 1
+    if use_matrix:
+        distances, durations = await distance_matrix.get_matrix(coords)
+        jobs = [{"id": i, "location_index": i} for i in range(1, end)]
+        vehicle = {"id": 1, "profile": "driving-car", "start_index": 0, "end_index": end}
+        payload = {
+            "jobs": jobs,
+            "vehicles": [vehicle],
+            "matrices": {"driving-car": {
+                "durations": np.rint(durations * 60).astype(int).tolist(),  # seconds
+                "distances": np.rint(distances * 1000).astype(int).tolist(),  # metres
+            }},
+        }
+    else:
+        jobs = [{"id": i, "location": coords[i]} for i in range(1, end)]
+        vehicle = {"id": 1, "start": coords[0], "end": coords[end]}
+        payload = {"jobs": jobs, "vehicles": [vehicle]}
 
     # Request optimized route
-    optimized = client.optimization(jobs=jobs, vehicles=[vehicle])
+    res = await get_client("ors").post(
+        f"{ORS_BASE_URL}/optimization",
+        json=payload,
+        headers={"Authorization": ORS_API_KEY or ""},
+    )
+    res.raise_for_status()
+    optimized = res.json()
+    if optimized.get("unassigned"):
+        raise ValueError(f"ORS left {len(optimized['unassigned'])} stops unassigned")
 
-    # Extract step IDs from optimization result
+    # Extract job ids (= address indices) in visiting order
     steps = optimized["routes"][0]["steps"]
-    ordered_indices = [0] + [step["job"] for step in steps if step["type"] == "job"]
-
-    # Convert job IDs back to index in original address list
-    optimized_order = [addresses[0]] + [addresses[job_id] for job_id in ordered_indices[1:]]
-
-    return optimized_order
+    ordered = [step["job"] for step in steps if step["type"] == "job"]
+    return [addresses[0]] + [addresses[i] for i in ordered] + [addresses[end]]
@@ -5,20 +5,35 @@ function AdminDashboard({ token }) {
   const [driverRoutes, setDriverRoutes] = useState([]);
 
   useEffect(() => {
+    let cancelled = false;
     const fetchRoutes = async () => {
       try {
-        const res = await fetch(`${API_BASE}/admin/drivers`, {
-          headers: {
-            Authorization: `Bearer ${token}`,
-          },
-        });
-        const data = await res.json();
-        setDriverRoutes(data);
+        // The endpoint is paginated: keep following X-Next-Cursor until the
+        // last page so no routes are dropped
+        let routes = [];
+        let cursor = null;
+        do {
+          const params = new URLSearchParams({ limit: "1000" });
+          if (cursor) params.set("cursor", cursor);
+          const res = await fetch(`${API_BASE}/admin/drivers?${params}`, {
+            headers: {
+              Authorization: `Bearer ${token}`,
+            },
+          });
+          if (!res.ok) throw new Error(`HTTP ${res.status}`);
+          routes = routes.concat(await res.json());
+          cursor = res.headers.get("X-Next-Cursor");
+          if (cancelled) return;
+          setDriverRoutes(routes);
+        } while (cursor);
       } catch (err) {
         console.error("Failed to fetch driver routes:", err);
       }
     };
     fetchRoutes();
+    return () => {
+      cancelled = true;
+    };
   }, [token]);
 
 return (
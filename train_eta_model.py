@@ -1,20 +1,25 @@
 # train_eta_model.py
 import pandas as pd
-from sklearn.ensemble import RandomForestRegressor
 import joblib
+from retrain_eta import FEATURES, TARGET, build_pipeline
+from eta_compiled import export_compiled
 
 # Load data from delivery_logs.csv or your DB
 df = pd.read_csv("delivery_data.csv")
 
-# Select features and label
-features = ["distance_km", "num_stops", "weather", "time_of_day", "traffic_level"]
-X = pd.get_dummies(df[features])
-y = df["actual_eta_min"]
+# Select features and label; same encoding as model_train.py and eta_search.py
+X = df[FEATURES]
+y = df[TARGET]
 
 # Train model
-model = RandomForestRegressor()
+model = build_pipeline()
 model.fit(X, y)
 
 # Save model
 joblib.dump(model, "eta_model.pkl")
 print("✅ Model saved as eta_model.pkl")
+
+# The API loads the compiled export when it is the newer of the two files, so
+# keep it in step with the pickle
+export_compiled(model, "eta_model_compiled")
+print("✅ Compiled model exported to eta_model_compiled/")
@@ -0,0 +1,281 @@
+# vrp_solver.py
+"""Multi-vehicle routing with capacities, shift windows and stop time windows.
+
+Each run builds a solution by cheapest feasible insertion (in a seeded random
+order), then improves it with relocate, exchange and 2-opt* moves until no
+move helps or the time limit is reached. `solve_vrp_parallel` runs
+independent restarts in a process pool and keeps the best. Times are minutes
+from the start of the day; the objective is total travel time, with a large
+penalty for each stop that could not be assigned.
+
+Deadlines are absolute `time.monotonic()` values, which are system-wide, so
+a deadline set by the caller still holds in pool processes that start late.
+"""
+import math
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import List
+
+UNASSIGNED_PENALTY = 1e6
+INF = math.inf
+
+
+@dataclass
+class Vehicle:
+    id: str
+    start: int  # matrix index of the start depot
+    end: int  # matrix index of the end depot
+    capacity: float = INF
+    shift_start: float = 0.0
+    shift_end: float = INF
+
+
+@dataclass
+class Stop:
+    id: str
+    location: int  # matrix index
+    demand: float = 0.0
+    service_min: float = 0.0
+    tw_start: float = 0.0
+    tw_end: float = INF
+
+
+@dataclass
+class Problem:
+    vehicles: List[Vehicle]
+    stops: List[Stop]
+    durations: List[List[float]]  # minutes, square over all locations
+
+
+@dataclass
+class Solution:
+    routes: List[List[int]]  # stop indices per vehicle
+    unassigned: List[int] = field(default_factory=list)
+    cost: float = INF
+
+
+class _Search:
+    def __init__(self, problem, deadline, rng):
+        self.p = problem
+        self.dur = problem.durations
+        self.deadline = deadline
+        self.rng = rng
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def route_cost(self, route, v):
+        """Travel minutes for the route, or None if it breaks a constraint."""
+        if not route:
+            return 0.0
+        dur, stops = self.dur, self.p.stops
+        t, load, travel, prev = v.shift_start, 0.0, 0.0, v.start
+        for si in route:
+            s = stops[si]
+            load += s.demand
+            leg = dur[prev][s.location]
+            travel += leg
+            t += leg
+            if t < s.tw_start:
+                t = s.tw_start
+            if t > s.tw_end:
+                return None
+            t += s.service_min
+            prev = s.location
+        leg = dur[prev][v.end]
+        travel += leg
+        if load > v.capacity or t + leg > v.shift_end:
+            return None
+        return travel
+
+    def best_insertion(self, si, routes, costs, skip=None):
+        best = (INF, None, None)
+        for r, route in enumerate(routes):
+            if r == skip:
+                continue
+            v = self.p.vehicles[r]
+            for pos in range(len(route) + 1):
+                c = self.route_cost(route[:pos] + [si] + route[pos:], v)
+                if c is not None and c - costs[r] < best[0]:
+                    best = (c - costs[r], r, pos)
+        return best
+
+    def construct(self):
+        n_v = len(self.p.vehicles)
+        routes, costs, unassigned = [[] for _ in range(n_v)], [0.0] * n_v, []
+        order = list(range(len(self.p.stops)))
+        # Tightest windows first, shuffled a little so restarts differ
+        order.sort(key=lambda i: (self.p.stops[i].tw_end, self.rng.random()))
+        if self.rng.random() < 0.5:
+            self.rng.shuffle(order)
+        for si in order:
+            delta, r, pos = self.best_insertion(si, routes, costs)
+            if r is None:
+                unassigned.append(si)
+            else:
+                routes[r].insert(pos, si)
+                costs[r] += delta
+        return routes, costs, unassigned
+
+    # --- Moves (first improvement) ---
+    def relocate(self, routes, costs):
+        for r1 in range(len(routes)):
+            for i in range(len(routes[r1])):
+                if self.expired():
+                    return False
+                si = routes[r1][i]
+                removed = routes[r1][:i] + routes[r1][i + 1:]
+                c1 = self.route_cost(removed, self.p.vehicles[r1])
+                if c1 is None:
+                    continue
+                gain = costs[r1] - c1
+                for r2 in range(len(routes)):
+                    base = removed if r2 == r1 else routes[r2]
+                    base_cost = c1 if r2 == r1 else costs[r2]
+                    v2 = self.p.vehicles[r2]
+                    for pos in range(len(base) + 1):
+                        if r2 == r1 and pos == i:
+                            continue
+                        c2 = self.route_cost(base[:pos] + [si] + base[pos:], v2)
+                        if c2 is not None and c2 - base_cost < gain - 1e-9:
+                            if r2 == r1:
+                                routes[r1] = base[:pos] + [si] + base[pos:]
+                                costs[r1] = c2
+                            else:
+                                routes[r1], costs[r1] = removed, c1
+                                routes[r2] = base[:pos] + [si] + base[pos:]
+                                costs[r2] = c2
+                            return True
+        return False
+
+    def exchange(self, routes, costs):
+        for r1 in range(len(routes)):
+            for r2 in range(r1 + 1, len(routes)):
+                v1, v2 = self.p.vehicles[r1], self.p.vehicles[r2]
+                for i in range(len(routes[r1])):
+                    if self.expired():
+                        return False
+                    for j in range(len(routes[r2])):
+                        a, b = routes[r1][:], routes[r2][:]
+                        a[i], b[j] = b[j], a[i]
+                        ca = self.route_cost(a, v1)
+                        if ca is None:
+                            continue
+                        cb = self.route_cost(b, v2)
+                        if cb is not None and ca + cb < costs[r1] + costs[r2] - 1e-9:
+                            routes[r1], routes[r2], costs[r1], costs[r2] = a, b, ca, cb
+                            return True
+        return False
+
+    def two_opt_star(self, routes, costs):
+        """Swap the tails of two routes."""
+        for r1 in range(len(routes)):
+            for r2 in range(r1 + 1, len(routes)):
+                v1, v2 = self.p.vehicles[r1], self.p.vehicles[r2]
+                for i in range(len(routes[r1]) + 1):
+                    if self.expired():
+                        return False
+                    for j in range(len(routes[r2]) + 1):
+                        a = routes[r1][:i] + routes[r2][j:]
+                        b = routes[r2][:j] + routes[r1][i:]
+                        ca = self.route_cost(a, v1)
+                        if ca is None:
+                            continue
+                        cb = self.route_cost(b, v2)
+                        if cb is not None and ca + cb < costs[r1] + costs[r2] - 1e-9:
+                            routes[r1], routes[r2], costs[r1], costs[r2] = a, b, ca, cb
+                            return True
+        return False
+
+    def insert_unassigned(self, routes, costs, unassigned):
+        for si in list(unassigned):
+            delta, r, pos = self.best_insertion(si, routes, costs)
+            if r is not None:
+                routes[r].insert(pos, si)
+                costs[r] += delta
+                unassigned.remove(si)
+                return True
+        return False
+
+    def run(self):
+        routes, costs, unassigned = self.construct()
+        while not self.expired():
+            if not (self.insert_unassigned(routes, costs, unassigned)
+                    or self.relocate(routes, costs)
+                    or self.exchange(routes, costs)
+                    or self.two_opt_star(routes, costs)):
+                break
+        return Solution(routes, sorted(unassigned), sum(costs) + UNASSIGNED_PENALTY * len(unassigned))
+
+
+def solve_vrp(problem, time_limit_s=2.0, seed=0, deadline=None):
+    """Restart the search with new seeds until the deadline (default: now +
+    time_limit_s); return the best. Always completes at least one run."""
+    if deadline is None:
+        deadline = time.monotonic() + time_limit_s
+    rng = random.Random(seed)
+    best = None
+    while best is None or time.monotonic() < deadline:
+        sol = _Search(problem, deadline, rng).run()
+        if best is None or sol.cost < best.cost:
+            best = sol
+    return best
+
+
+VRP_WORKERS = int(os.getenv("VRP_WORKERS", os.cpu_count() or 1))
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=VRP_WORKERS)
+    return _pool
+
+
+def solve_vrp_parallel(problem, time_limit_s=2.0, workers=None):
+    """Run independent seeded searches across the process pool.
+
+    All searches share one deadline fixed here, so searches queued behind
+    other requests get less time instead of extending the wall time; ones
+    still queued when it passes are cancelled.
+    """
+    deadline = time.monotonic() + time_limit_s
+    workers = min(workers or VRP_WORKERS, VRP_WORKERS)
+    if workers <= 1:
+        return solve_vrp(problem, deadline=deadline)
+    futures = [_get_pool().submit(solve_vrp, problem, time_limit_s, seed, deadline) for seed in range(workers)]
+    # Small grace for a search to return its result after the deadline
+    done, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()) + 0.05)
+    for f in pending:
+        f.cancel()
+    if not done:
+        running = [f for f in pending if not f.cancelled()]
+        if not running:
+            # The pool was busy with other requests throughout; one quick
+            # construction here beats waiting for a slot
+            return solve_vrp(problem, deadline=deadline)
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+    return min((f.result() for f in done), key=lambda s: s.cost)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def schedule(problem, route, vehicle):
+    """Arrival minute at each stop of a feasible route."""
+    t, prev, arrivals = vehicle.shift_start, vehicle.start, []
+    for si in route:
+        s = problem.stops[si]
+        t = max(t + problem.durations[prev][s.location], s.tw_start)
+        arrivals.append(t)
+        t += s.service_min
+        prev = s.location
+    return arrivals